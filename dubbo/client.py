@@ -27,6 +27,7 @@ from urllib import quote
 from kazoo.client import KazooClient
 from kazoo.protocol.states import KazooState
 
+from dubbo.codec.encoder import Request, Signature, RequestCache
 from dubbo.common.constants import DUBBO_ZK_PROVIDERS, DUBBO_ZK_CONFIGURATORS, DUBBO_ZK_CONSUMERS
 from dubbo.common.exceptions import RegisterException
 from dubbo.common.util import parse_url, get_pid, get_ip
@@ -34,19 +35,49 @@ from dubbo.connection.connections import connection_pool
 
 logger = logging.getLogger('python-dubbo')
 
+# 可以只对一次调用生效的解析响应的选项，参见类：dubbo.codec.decoder.Response
+_DECODE_OPTIONS = frozenset(['unicode_strings', 'lazy', 'select', 'defined_objects', 'intern_strings', 'columns',
+                             'typed_arrays', 'dates', 'converters', 'binary_views'])
+
 
 class DubboClient(object):
     """
     用于实现dubbo调用的客户端
     """
 
-    def __init__(self, interface, version='1.0.0', dubbo_version='2.4.10', zk_register=None, host=None):
+    def __init__(self, interface, version='1.0.0', dubbo_version='2.4.10', zk_register=None, host=None,
+                 references=False, specialize=False, cache_size=0, unicode_strings=False,
+                 lazy=False, defined_objects=False, intern_strings=False, columns=False,
+                 typed_arrays=False, dates='string', converters=None, binary_views=False):
         """
         :param interface: 接口名，例如：com.qianmi.pc.es.api.EsProductQueryProvider
         :param version: 接口的版本号，例如：1.0.0，默认为1.0.0
         :param dubbo_version: dubbo的版本号，默认为2.4.10
         :param zk_register: zookeeper注册中心管理端，参见类：ZkRegister
         :param host: 远程主机地址，用于绕过zookeeper进行直连，例如：172.21.4.98:20882
+        :param references: 参数中多次出现的同一个对象/列表只编码一次，之后使用引用代替，
+                           开启之后参数中也可以包含循环引用
+        :param specialize: 同一个方法使用相同结构的参数多次调用之后，为这种结构生成专用的编码方法，
+                           适用于参数结构固定并且调用频繁的方法；开启references时以及已经声明了签名的方法不使用
+        :param cache_size: 大于0时缓存最近的这么多个编码好的请求，参数完全相同的调用直接使用缓存的请求，
+                           只有参数全部为不可变的基本类型时才会被缓存，参见类：dubbo.codec.encoder.RequestCache
+        :param unicode_strings: 为True时响应中的字符串为unicode，否则为utf-8编码的str
+        :param lazy: 为True时响应中的map/list/对象在第一次被访问时才解码，适用于只访问较大响应中的少部分数据的情况，
+                     参见类：dubbo.codec.decoder.LazyDict、dubbo.codec.decoder.LazyList
+        :param defined_objects: 为True时响应中的Java对象被解码为Object.define生成的类的实例而不是dict，
+                                适用于响应中包含大量同一个类的对象的情况，占用的内存更少
+        :param intern_strings: 为True时响应中重复出现的短字符串共用同一个对象，适用于状态码、枚举名等重复较多的字符串，
+                               缓存的命中率参见：dubbo.codec.decoder.string_cache.stats()
+        :param columns: 为True时响应中同一个类的对象的列表被解码为按字段分开的列：{字段名: 列}，
+                        数字的列为array.array或者numpy数组，适用于需要把结果按列分析的情况
+        :param typed_arrays: 为True时响应中的Java基本类型数组(int[], long[], double[]等)被一次性解码为array.array，
+                             安装了numpy时为numpy数组
+        :param dates: 响应中日期的解码方式：'string'(默认)、'millis'、'datetime'或者'utc'，
+                      参见类：dubbo.codec.decoder.Response
+        :param converters: 响应中的Java类的转化方式：{类名: 转化方法}，例如把BigDecimal解码为Decimal，
+                           参见方法：dubbo.codec.decoder.register_decoder
+        :param binary_views: 为True时响应中的二进制数据(byte[])为响应体的memoryview而不是bytearray，不复制数据，
+                             适用于返回较大的二进制数据的方法；call_stream时不使用
         """
         if not zk_register and not host:
             raise RegisterException('zk_register和host至少需要填入一个')
@@ -59,8 +90,32 @@ class DubboClient(object):
 
         self.__zk_register = zk_register
         self.__host = host
+        self.__references = references
+        # 缓存每个方法的请求体中除了参数之外的固定部分
+        self.__templates = {}
+        # 预先声明的方法签名
+        self.__signatures = {}
+        # 每个方法的参数结构以及为其生成的专用编码方法
+        self.__shapes = {} if specialize else None
+        # 缓存编码好的请求
+        self.__cache = RequestCache(cache_size) if cache_size > 0 else None
+        # 解析响应时的选项，参见类：dubbo.codec.decoder.Response
+        self.__decode_options = {'unicode_strings': unicode_strings, 'lazy': lazy, 'defined_objects': defined_objects,
+                                 'intern_strings': intern_strings, 'columns': columns,
+                                 'typed_arrays': typed_arrays, 'dates': dates, 'converters': converters,
+                                 'binary_views': binary_views}
+
+    def declare(self, method, signature):
+        """
+        声明一个方法的Java签名，之后调用此方法时不再根据参数的值推断参数类型，
+        而是根据声明的类型校验以及编码参数，同名的重载方法只能声明其中的一个
+        :param method: 方法名
+        :param signature: 方法签名，例如：'(long, java.util.List<String>)'，或者['long', 'java.util.List<String>']
+        :return:
+        """
+        self.__signatures[method] = Signature(signature)
 
-    def call(self, method, args=(), timeout=None):
+    def call(self, method, args=(), timeout=None, **options):
         """
         执行远程调用
         :param method: 远程调用的方法名
@@ -77,8 +132,62 @@ class DubboClient(object):
                         * java.lang.String
                         * java.lang.Object
         :param timeout: 请求超时时间（秒），不设置则不会超时
+        :param options: 只对此次调用生效的解析响应的选项，覆盖创建客户端时指定的选项，例如：unicode_strings=True；
+                        select=['items[*].id', 'total']时只解码这些路径上的字段，参见类：dubbo.codec.decoder.Response；
+                        未知的选项在发送请求之前抛出TypeError；
+                        值为列表的较大的响应体被写入临时文件并分块解码，其它的值(例如包含列表的分页对象)仍然完整地读入内存，
+                        参见：dubbo.connection.connections.connection_pool.spill_size
+        :return:
+        """
+        decode_options = self.__get_decode_options(options)
+        host, request_param = self.__request_param(method, args)
+        logger.debug('Start request, host={}, params={}'.format(host, request_param))
+        start_time = time.time()
+        request = self.__request(request_param)
+        result = connection_pool.get(host, request, timeout, decode_options)
+        cost_time = int((time.time() - start_time) * 1000)
+        logger.debug('Finish request, host={}, params={}'.format(host, request_param))
+        logger.debug('Request invoked, host={}, params={}, result={}, cost={}ms, timeout={}s'.format(
+            host, request_param, result, cost_time, timeout))
+        return result
+
+    def call_stream(self, method, args=(), timeout=None, **options):
+        """
+        执行远程调用并流式地解码响应，适用于返回很大的列表的方法：响应体不再被完整地缓存，
+        列表中的每个元素的数据到达之后即可被取出，已经取出的元素以及其中的值也不再被保留；
+        不再迭代时应当关闭返回的generator，否则此连接可能被暂停读取直到超过connection_pool.stream_pause_timeout
+        :param method: 远程调用的方法名
+        :param args: 方法参数，参见方法：call
+        :param timeout: 等待下一块数据的超时时间（秒），不设置则不会超时
+        :param options: 只对此次调用生效的解析响应的选项，参见方法：call；流式解码时不使用lazy
+        :return: 逐个产生列表中的元素的generator；响应的值不是列表时只产生这个值，为null时不产生任何值
+        """
+        decode_options = self.__get_decode_options(options)
+        host, request_param = self.__request_param(method, args)
+        logger.debug('Start streaming request, host={}, params={}'.format(host, request_param))
+        return connection_pool.get_stream(host, self.__request(request_param), timeout, decode_options)
+
+    def __get_decode_options(self, options):
+        """
+        合并只对此次调用生效的选项；在发送请求之前检查选项名，
+        避免拼写错误的选项在远程方法已经被执行之后才在解析响应时报错
+        :param options:
         :return:
         """
+        if not options:
+            return self.__decode_options
+        unknown = set(options) - _DECODE_OPTIONS
+        if unknown:
+            raise TypeError('Unknown decode options: {}'.format(', '.join(sorted(unknown))))
+        return dict(self.__decode_options, **options)
+
+    def __request_param(self, method, args):
+        """
+        选择远程主机并生成请求的参数
+        :param method:
+        :param args:
+        :return: 远程主机以及请求的参数
+        """
         if not isinstance(args, (list, tuple)):
             args = [args]
 
@@ -95,15 +204,12 @@ class DubboClient(object):
             'method': method,
             'arguments': args
         }
+        return host, request_param
 
-        logger.debug('Start request, host={}, params={}'.format(host, request_param))
-        start_time = time.time()
-        result = connection_pool.get(host, request_param, timeout)
-        cost_time = int((time.time() - start_time) * 1000)
-        logger.debug('Finish request, host={}, params={}'.format(host, request_param))
-        logger.debug('Request invoked, host={}, params={}, result={}, cost={}ms, timeout={}s'.format(
-            host, request_param, result, cost_time, timeout))
-        return result
+    def __request(self, request_param):
+        return Request(request_param, templates=self.__templates, references=self.__references,
+                       signature=self.__signatures.get(request_param['method']), shapes=self.__shapes,
+                       cache=self.__cache)
 
 
 class ZkRegister(object):
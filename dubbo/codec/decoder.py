@@ -18,21 +18,118 @@
  */
 """
 
-from datetime import datetime
-from struct import unpack
+import re
+import sys
+from array import array
+from bisect import bisect_left
+from collections import Mapping, Sequence
+from datetime import datetime, timedelta, tzinfo
+from struct import unpack, unpack_from, error as StructError
 
+from dubbo.codec.encoder import Object
 from dubbo.common.exceptions import HessianTypeError, DubboException, DubboResponseException
 from dubbo.common.constants import response_status_message
 
-functions = {}
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
+# utf-8编码中的后续字节
+_UTF8_CONTINUATION_BYTES = ''.join(chr(i) for i in xrange(0x80, 0xc0))
+# 除了4个字节的utf-8字符的首字节之外的所有字节
+_UTF8_NOT_SUPPLEMENTARY_LEADS = ''.join(chr(i) for i in xrange(0x100) if not 0xf0 <= i <= 0xf7)
+# 连续的ASCII字符
+_ASCII_BYTES = re.compile(r'[\x00-\x7f]*')
+# 需要解码的字段的路径中的字段名以及[*]
+_SELECT_TOKENS = re.compile(r'\[\*\]|[^.\[\]]+')
+# 根据utf-8字符首字节的高4位得到字符的字节数
+_UTF8_SEQUENCE_LENGTHS = [1] * 12 + [2, 2, 3, 4]
 
-def ranges(*defined_ranges):
+# 解码时为每个(类名, 字段名)生成的类以及解码此类的对象的方法，在所有的响应之间共享
+_DEFINED_CLASSES = {}
+_DEFINED_CLASSES_MAX_SIZE = 4096
+# Java的基本类型数组的类型所对应的array.array的类型
+_ARRAY_TYPECODES = {'[int': 'i', '[short': 'i', '[long': 'l', '[double': 'd', '[float': 'd'}
+# 基本类型数组中连续的同一种编码的数字达到此个数时整段转换，以及不成段时最多逐个读取的数字个数，
+# 参见方法：_read_number_array
+_MIN_NUMBER_RUN = 32
+_MAX_PLAIN_NUMBERS = 256
+# 流式解码时已经解码的数据超过此大小之后被丢弃
+_STREAM_COMPACT_SIZE = 1 << 20
+
+
+class StringCache(object):
+    """
+    进程内共享的短字符串缓存，以字符串的utf-8字节为键，重复出现的字符串共用同一个对象，
+    不需要每次都重新分配，也不需要重复解码
+    """
+
+    def __init__(self, max_size=0x10000, max_length=64):
+        """
+        :param max_size: 最多缓存的字符串数，超出时淘汰较长时间没有使用的字符串
+        :param max_length: 只缓存utf-8编码之后不超过这么多字节的字符串
+        """
+        self.max_size = max_size
+        self.max_length = max_length
+        self.hits = 0
+        self.misses = 0
+        # 近似的LRU，参见类：dubbo.codec.encoder.RequestCache
+        self.__recent = {}
+        self.__old = {}
+
+    def get(self, key):
+        value = self.__recent.get(key)
+        if value is None:
+            value = self.__old.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.put(key, value)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        recent = self.__recent
+        if len(recent) >= (self.max_size + 1) // 2:
+            self.__old, self.__recent = recent, {}
+            recent = self.__recent
+        recent[key] = value
+
+    def stats(self):
+        """
+        :return: 缓存的命中次数、未命中次数、命中率以及缓存的字符串数
+        """
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / total if total else 0.0,
+            'size': len(self)
+        }
+
+    def __len__(self):
+        return len(self.__recent) + len(self.__old)
+
+
+# 解码为str以及unicode的字符串分别使用各自的缓存
+string_cache = StringCache()
+unicode_cache = StringCache()
+# 类名、字段名以及类型名总是共用同一个对象，使用单独的缓存，不影响string_cache的统计
+name_cache = StringCache()
+
+# 每一个字节所对应的解码方法，解码方法的参数为(response, data, pos)，返回解码得到的值以及解码之后的位置
+decoders = [None] * 256
+
+
+def ranges(*defined_ranges, **kwargs):
     """
     根据hessian协议，把处理方法交给其定义好的范围
     :param defined_ranges:
+    :param kwargs: table: 处理方法所在的表，默认为decoders
     :return:
     """
+    table = kwargs.get('table', decoders)
 
     def decorator(func):
         # 遍历所有的范围
@@ -42,16 +139,12 @@ def ranges(*defined_ranges):
                     raise ValueError('Invalid range {}'.format(defined_range))
                 nums = range(defined_range[0], defined_range[1] + 1)
                 for num in nums:
-                    functions[num] = func
+                    table[num] = func
             elif isinstance(defined_range, int):
-                functions[defined_range] = func
+                table[defined_range] = func
             else:
                 raise ValueError('Defined value {} illegal'.format(defined_ranges))
-
-        def wrapper(*args, **kwargs):
-            return func(*args, **kwargs)  # 原始方法正常执行
-
-        return wrapper
+        return func
 
     return decorator
 
@@ -72,17 +165,69 @@ class Response(object):
     * list
     * map
     * date
+    * binary
     * null
     """
 
-    def __init__(self, data):
+    def __init__(self, data, unicode_strings=False, lazy=False, select=None, defined_objects=False,
+                 intern_strings=False, columns=False, typed_arrays=False,
+                 dates='string', converters=None, binary_views=False):
+        """
+        :param data: 响应体的字节
+        :param unicode_strings: 为True时解码得到的字符串为unicode，否则为utf-8编码的str
+        :param lazy: 为True时read_next只跳过map/list/对象并记录其位置，返回的LazyDict/LazyList在第一次被访问时才解码，
+                     适用于只会访问响应中一小部分数据的情况
+        :param select: 只解码这些路径上的字段，其它的字段直接被跳过，例如：['items[*].id', 'total']，
+                       [*]代表列表中的每一个元素；指定了select时不再使用lazy
+        :param defined_objects: 为True时Java对象被解码为Object.define生成的类的实例而不是dict，
+                                字段的值保存在__slots__中，每个类只生成一次，参见方法：dubbo.codec.encoder.Object#define；
+                                延迟解码以及指定了select时不使用
+        :param intern_strings: 为True时重复出现的短字符串共用同一个对象，适用于状态码、枚举名等重复较多的字符串，
+                               参见类：StringCache；类名、字段名以及类型名总是共用同一个对象
+        :param columns: 为True时同一个类的对象的列表被解码为按字段分开的列：{字段名: 列}，不再生成每一行的对象，
+                        整数和浮点数的列为array.array，安装了numpy时为numpy数组，其它的列为list；
+                        列表中的元素不全是同一个类的对象时仍然解码为list，参见方法：_read_columns；延迟解码时不使用
+        :param typed_arrays: 为True时Java的基本类型数组(int[], long[], double[]等)被一次性解码为array.array，
+                             安装了numpy时为numpy数组，参见方法：_read_number_array；延迟解码时不使用
+        :param dates: 日期(java.util.Date)的解码方式：'string'为本地时间的字符串，例如：2018-05-20T13:14:15.678000+0800，
+                      'millis'为毫秒级的时间戳(int)，'datetime'为本地时间的datetime，'utc'为带有UTC时区的datetime；
+                      'millis'不需要任何转换，适用于包含大量日期的响应
+        :param converters: 只对此响应生效的Java类的转化方式：{类名: 转化方法}，覆盖register_decoder注册的同名类，
+                           参见方法：register_decoder
+        :param binary_views: 二进制数据(byte[])默认被解码为bytearray，为True时为响应体的memoryview，不复制数据，
+                             分块的二进制数据拼接之后为memoryview；注意memoryview会使整个响应体一直被保留在内存中
+        """
+        if dates not in _DATE_FORMATS:
+            raise ValueError('Invalid dates {}'.format(dates))
+        if not isinstance(data, bytearray):
+            data = bytearray(data)
         self.__data = data  # data是字节数组
+        self.unicode_strings = unicode_strings
+        self.lazy = lazy and not select
+        self.select = _compile_select(select) if select else None
+        self.defined_objects = defined_objects
+        self.intern_strings = intern_strings
+        self.columns = columns
+        self.typed_arrays = typed_arrays
+        self.format_date = _DATE_FORMATS[dates]
+        self.binary_views = binary_views
+        if converters:
+            self.converter_table = dict(_CONVERTERS)
+            self.converter_table.update(converters)
+        else:
+            self.converter_table = _CONVERTERS
+        # 延迟解码时每个map/list/对象的位置与其值以及结束位置的对应关系
+        self.lazy_values = {}
         self.__index = 0
         self.types = []
         self.objects = []
         # 对于一个类来说，有path的地方就应该有field_name
         self.paths = []
         self.field_names = []
+        # 每个类的对象的解码方法，为None时解码为dict
+        self.classes = []
+        # 每个类的对象解码为dict之后的转化方法，为None时不需要转化，参见方法：register_decoder
+        self.converters = []
 
     def get_byte(self):
         """
@@ -119,320 +264,1582 @@ class Response(object):
         self.__index += num
         return value
 
-    @ranges(ord('T'), ord('F'))
-    def read_boolean(self):
+    def read_next(self):
         """
-        读取一个布尔类型
+        读取下一个变量，自动识别变量类型
         :return:
         """
-        value = self.read_byte()
-        if value == ord('T'):
-            return True
-        elif value == ord('F'):
-            return False
-        else:
-            raise HessianTypeError('illegal boolean value: {0}'.format(value))
+        data = self.__data
+        if self.select is not None:
+            value, self.__index = _decode_selected(self, data, self.__index, self.select)
+            return value
+        if self.lazy:
+            pos = self.__index
+            self.__index = _index_values(self, data, pos, 1)
+            return _read_lazy(self, data, pos)[0]
+        value, self.__index = decoders[data[self.__index]](self, data, self.__index)
+        return value
 
-    @ranges((0x80, 0xd7), ord('I'))
-    def read_int(self):
+    def skip_next(self):
         """
-        读取一个整型数据
+        跳过下一个变量，不解码其中的值，但是仍然记录其中的类定义、类型以及可被引用的值，
+        之后对其中的值的引用在被读取时才解码
         :return:
         """
-        value = self.read_byte()
-        if 0x80 <= value <= 0xbf:
-            result = value - 0x90
-        elif 0xc0 <= value <= 0xcf:
-            i = (value - 0xc8) << 8
-            i |= self.read_byte()
-            result = i
-        elif 0xd0 <= value <= 0xd7:
-            i = (value - 0xd4) << 16
-            i |= self.read_byte() << 8
-            i |= self.read_byte()
-            result = i
-        else:
-            result = unpack('!i', self.read_bytes(4))[0]
-        return result
+        self.__index = _index_values(self, self.__data, self.__index, 1)
 
-    @ranges((0x5b, 0x5f), ord('D'))
-    def read_double(self):
+    def __read(self, tags, type_name):
         """
-        读取一个浮点类型
+        读取下一个指定类型的变量
+        :param tags: 此类型的所有标识字节
+        :param type_name:
         :return:
         """
-        value = self.read_byte()
-        if value == 0x5b:
-            result = 0.0
-        elif value == 0x5c:
-            result = 1.0
-        elif value == 0x5d:
-            result = float(unpack('!b', self.read_bytes(1))[0])
-        elif value == 0x5e:
-            result = float(unpack('!h', self.read_bytes(2))[0])
-        elif value == 0x5f:
-            result = float(unpack('!i', self.read_bytes(4))[0]) * 0.001
-        elif value == ord('D'):
-            result = float(unpack('!d', self.read_bytes(8))[0])
-        else:
-            raise HessianTypeError('{0} is not a float'.format(value))
-        return result
+        tag = self.get_byte()
+        if tag not in tags:
+            raise HessianTypeError('{0} is not {1} type'.format(tag, type_name))
+        return self.read_next()
 
-    def _read_utf(self, length):
-        """
-        读取n个字符
-        :param length:
-        :return:
-        """
-        value = u''
-        for i in xrange(length):
-            ch = self.read_byte()
-            if ch < 0x80:
-                value += unichr(ch)
-            elif (ch & 0xe0) == 0xc0:
-                ch1 = self.read_byte()
-                value += unichr(((ch & 0x1f) << 6) + (ch1 & 0x3f))
-            elif (ch & 0xf0) == 0xe0:
-                ch1 = self.read_byte()
-                ch2 = self.read_byte()
-                value += unichr(((ch & 0x0f) << 12) + ((ch1 & 0x3f) << 6) + (ch2 & 0x3f))
-            else:
-                raise ValueError('Can\'t parse utf-8 char {}'.format(ch))
-        return value.encode('utf-8')  # 将unicode转化为str类型
+    def read_boolean(self):
+        return self.__read(_BOOLEAN_TAGS, 'boolean')
+
+    def read_int(self):
+        return self.__read(_INT_TAGS, 'int')
+
+    def read_long(self):
+        return self.__read(_LONG_TAGS, 'long')
+
+    def read_double(self):
+        return self.__read(_DOUBLE_TAGS, 'double')
 
-    @ranges((0x00, 0x1f), (0x30, 0x33), 0x52, ord('S'))
     def read_string(self):
+        return self.__read(_STRING_TAGS, 'string')
+
+    def read_object(self):
+        return self.__read(_OBJECT_TAGS, 'object')
+
+    def read_list(self):
+        return self.__read(_LIST_TAGS, 'list')
+
+    def read_map(self):
+        return self.__read(_MAP_TAGS, 'map')
+
+    def read_date(self):
+        return self.__read(_DATE_TAGS, 'date')
+
+    def read_null(self):
+        return self.__read(_NULL_TAGS, 'null')
+
+    def read_binary(self):
+        return self.__read(_BINARY_TAGS, 'binary')
+
+    def read_error(self):
         """
-        读取一个字符串
+        解析Java的错误信息，因为需要知道错误的类型，所以需要单独处理
         :return:
         """
-        value = self.read_byte()
-        string = ''
-        while value == 'R':
-            length = unpack('!h', self.read_bytes(2))[0]
-            string += self._read_utf(length)
-            value = self.read_byte()
-
-        if value == ord('S'):
-            length = unpack('!h', self.read_bytes(2))[0]
-        elif 0x00 <= value <= 0x1f:
-            length = value
+        data = self.__data
+        # 错误信息用于拼接异常的消息，其中的字符串总是str，对象总是dict
+        options = self.unicode_strings, self.defined_objects
+        self.unicode_strings = self.defined_objects = False
+        try:
+            error_type, pos = _decode_class_definition(self, data, self.__index)
+            error, self.__index = _decode_object(self, data, pos)
+        finally:
+            self.unicode_strings, self.defined_objects = options
+        error['cause'] = error_type
+        return error
+
+    def __repr__(self):
+        return str(self.__data)
+
+
+def _decode_unknown(response, data, pos):
+    raise HessianTypeError('Unknown type tag {0} at {1}'.format(data[pos], pos))
+
+
+@ranges(ord('N'))
+def _decode_null(response, data, pos):
+    return None, pos + 1
+
+
+@ranges(ord('T'))
+def _decode_true(response, data, pos):
+    return True, pos + 1
+
+
+@ranges(ord('F'))
+def _decode_false(response, data, pos):
+    return False, pos + 1
+
+
+@ranges((0x80, 0xbf))
+def _decode_int_1(response, data, pos):
+    """
+    单字节的整型数据，以及后续的各种定长整型数据
+    """
+    return data[pos] - 0x90, pos + 1
+
+
+@ranges((0xc0, 0xcf))
+def _decode_int_2(response, data, pos):
+    return ((data[pos] - 0xc8) << 8) | data[pos + 1], pos + 2
+
+
+@ranges((0xd0, 0xd7))
+def _decode_int_3(response, data, pos):
+    return ((data[pos] - 0xd4) << 16) | (data[pos + 1] << 8) | data[pos + 2], pos + 3
+
+
+@ranges(ord('I'), 0x59)
+def _decode_int_5(response, data, pos):
+    """
+    4个字节的整型数据，0x59为使用4个字节表示的long
+    """
+    return unpack_from('!i', data, pos + 1)[0], pos + 5
+
+
+@ranges((0xd8, 0xef))
+def _decode_long_1(response, data, pos):
+    return data[pos] - 0xe0, pos + 1
+
+
+@ranges((0xf0, 0xff))
+def _decode_long_2(response, data, pos):
+    return ((data[pos] - 0xf8) << 8) | data[pos + 1], pos + 2
+
+
+@ranges((0x38, 0x3f))
+def _decode_long_3(response, data, pos):
+    return ((data[pos] - 0x3c) << 16) | (data[pos + 1] << 8) | data[pos + 2], pos + 3
+
+
+@ranges(ord('L'))
+def _decode_long_9(response, data, pos):
+    return unpack_from('!q', data, pos + 1)[0], pos + 9
+
+
+@ranges(0x5b)
+def _decode_double_zero(response, data, pos):
+    return 0.0, pos + 1
+
+
+@ranges(0x5c)
+def _decode_double_one(response, data, pos):
+    return 1.0, pos + 1
+
+
+@ranges(0x5d)
+def _decode_double_byte(response, data, pos):
+    return float(unpack_from('!b', data, pos + 1)[0]), pos + 2
+
+
+@ranges(0x5e)
+def _decode_double_short(response, data, pos):
+    return float(unpack_from('!h', data, pos + 1)[0]), pos + 3
+
+
+@ranges(0x5f)
+def _decode_double_mill(response, data, pos):
+    return float(unpack_from('!i', data, pos + 1)[0]) * 0.001, pos + 5
+
+
+@ranges(ord('D'))
+def _decode_double(response, data, pos):
+    return unpack_from('!d', data, pos + 1)[0], pos + 9
+
+
+def _find_utf8_end(data, pos, length):
+    """
+    找到从pos开始的length个Java字符(UTF-16编码单元)所对应的utf-8字节的结束位置；
+    每个字符至少占用一个字节，所以每次向后取尚未找到的字符数个字节，
+    根据其中不是后续字节(0x80~0xbf)的字节数得到其中包含的字符数，直到找到全部的字符
+    :param data:
+    :param pos:
+    :param length:
+    :return: 结束位置
+    """
+    start = pos
+    end = pos + length
+    # 只包含ASCII字符时字节数即为字符数，绝大多数的短字符串都是这种情况
+    if end <= len(data) and _ASCII_BYTES.match(data, pos, end).end() == end:
+        return end
+
+    chunk = data[pos:end]
+    while length > 0:
+        if len(chunk) < end - pos:
+            raise HessianTypeError('String out of data at {}'.format(start))
+        # 4个字节的utf-8字符在Java中为一对代理字符，算作两个字符
+        length -= len(chunk.translate(None, _UTF8_CONTINUATION_BYTES))
+        length -= len(chunk.translate(None, _UTF8_NOT_SUPPLEMENTARY_LEADS))
+        if length > 0:
+            pos, end = end, end + length
+            chunk = data[pos:end]
+
+    # 最后一个字符的后续字节可能还没有被包含进来
+    last = end - 1
+    while last > start and 0x80 <= data[last] < 0xc0:
+        last -= 1
+    if end > start and data[last] >= 0xc0:
+        end = max(end, last + _UTF8_SEQUENCE_LENGTHS[data[last] >> 4])
+        if end > len(data):
+            raise HessianTypeError('String out of data at {}'.format(start))
+    return end
+
+
+def _to_string(value, as_unicode):
+    """
+    把utf-8编码的字节转化为字符串，字节已经是utf-8编码，所以返回str时不需要解码
+    :param value: bytearray或者str
+    :param as_unicode: 为True时返回unicode，否则返回utf-8编码的str
+    :return:
+    """
+    # 超出BMP的字符被编码为一对代理字符，解码再编码之后代理对才会被合并为4个字节的utf-8字符
+    if '\xed' in value:
+        value = value.decode('utf-8').encode('utf-8')
+    if as_unicode:
+        return value.decode('utf-8')
+    return str(value)
+
+
+def _read_string(data, pos, as_unicode, cache=None):
+    """
+    读取一个字符串，超过0xffff个字符的字符串被分为多块，除了最后一块之外其它每块都以0x52(R)开头，
+    所有块的字节拼接起来之后一次性转化为字符串
+    :param data:
+    :param pos:
+    :param as_unicode:
+    :param cache: 短字符串的缓存，参见类：StringCache
+    :return: 字符串以及读取之后的位置
+    """
+    string = None
+    value = data[pos]
+    while value == 0x52:
+        length = unpack_from('!H', data, pos + 1)[0]
+        end = _find_utf8_end(data, pos + 3, length)
+        if string is None:
+            string = data[pos + 3:end]
         else:
-            length = (value - 0x30) << 8 | self.read_byte()
+            string += memoryview(data)[pos + 3:end]
+        pos = end
+        value = data[pos]
 
-        string += self._read_utf(length)
-        return string
+    length, pos = _read_string_length(data, pos)
+    end = _find_utf8_end(data, pos, length)
+    # 分块的字符串不使用缓存
+    if cache is not None and string is None and end - pos <= cache.max_length:
+        key = str(buffer(data, pos, end - pos))
+        value = cache.get(key)
+        if value is None:
+            value = _to_string(key, as_unicode)
+            cache.put(key, value)
+        return value, end
 
-    @ranges((0x60, 0x6f), ord('O'))
-    def read_object(self):
-        """
-        读取一个对象
-        :return:
-        """
-        result = {}
-        self.objects.append(result)
-        value = self.read_byte()
-        if 0x60 <= value <= 0x6f:
-            ref = value - 0x60
+    chunk = data[pos:end]
+    if string is not None:
+        string += chunk
+        chunk = string
+    return _to_string(chunk, as_unicode), end
+
+
+def _read_string_length(data, pos):
+    """
+    读取字符串最后一块的长度
+    :return: 长度以及字符串内容开始的位置
+    """
+    value = data[pos]
+    if value <= 0x1f:
+        return value, pos + 1
+    elif 0x30 <= value <= 0x33:
+        return (value - 0x30) << 8 | data[pos + 1], pos + 2
+    elif value == ord('S'):
+        return unpack_from('!H', data, pos + 1)[0], pos + 3
+    else:
+        raise HessianTypeError('{0} is not string type'.format(value))
+
+
+@ranges((0x00, 0x1f), (0x30, 0x33), 0x52, ord('S'))
+def _decode_string(response, data, pos):
+    if response.intern_strings:
+        if response.unicode_strings:
+            return _read_string(data, pos, True, unicode_cache)
+        return _read_string(data, pos, False, string_cache)
+    return _read_string(data, pos, response.unicode_strings)
+
+
+def _read_binary_chunk(data, pos):
+    """
+    读取二进制数据的一块的位置
+    :return: 这一块的数据的开始位置以及结束位置
+    """
+    value = data[pos]
+    if 0x20 <= value <= 0x2f:
+        length, pos = value - 0x20, pos + 1
+    elif 0x34 <= value <= 0x37:
+        length, pos = (value - 0x34) << 8 | data[pos + 1], pos + 2
+    elif value == 0x41 or value == 0x42:
+        length, pos = unpack_from('!H', data, pos + 1)[0], pos + 3
+    else:
+        raise HessianTypeError('{0} is not binary type'.format(value))
+    if pos + length > len(data):
+        raise HessianTypeError('Binary out of data at {}'.format(pos))
+    return pos, pos + length
+
+
+@ranges((0x20, 0x2f), (0x34, 0x37), 0x41, 0x42)
+def _decode_binary(response, data, pos):
+    """
+    读取二进制数据，超过0x8000个字节的数据被分为多块，除了最后一块之外其它每块都以0x41(A)开头；
+    只有一块时直接截取这一块，binary_views为True时为data的memoryview，不复制数据；多块时才需要拼接
+    """
+    chunks = None
+    while data[pos] == 0x41:
+        start, pos = _read_binary_chunk(data, pos)
+        if chunks is None:
+            chunks = data[start:pos]
         else:
-            ref = self.read_int()
-        field_names = self.field_names[ref]
-        for field_name in field_names:
-            field_value = self.read_next()
-            result[field_name] = field_value
-
-        path = self.paths[ref]
-        if path == 'java.math.BigDecimal':
-            result = float(result['value']) or 0
-            self.objects[-1] = result
-        elif path == 'java.math.BigInteger':
-            result = int(result['value'])
-            self.objects[-1] = result
+            chunks += memoryview(data)[start:pos]
 
-        return result
+    start, end = _read_binary_chunk(data, pos)
+    if chunks is not None:
+        chunks += memoryview(data)[start:end]
+        return memoryview(chunks) if response.binary_views else chunks, end
+    if response.binary_views:
+        return memoryview(data)[start:end], end
+    return data[start:end], end
+
+
+@ranges((0x60, 0x6f), ord('O'))
+def _decode_object(response, data, pos):
+    """
+    读取一个对象
+    """
+    objects = response.objects
+    ref, pos = _read_object_head(response, data, pos)
+    decode_fields = response.classes[ref]
+    if decode_fields is not None:
+        return decode_fields(response, data, pos)
+
+    result = {}
+    index = len(objects)
+    objects.append(result)
+    for field_name in response.field_names[ref]:
+        result[field_name], pos = decoders[data[pos]](response, data, pos)
+
+    converter = response.converters[ref]
+    if converter is not None:
+        result = converter(result)
+        objects[index] = result
+    return result, pos
+
+
+def _read_object_head(response, data, pos):
+    """
+    读取对象的类的引用
+    :return: 类的引用以及对象的第一个字段的值的位置
+    """
+    value = data[pos]
+    if 0x60 <= value <= 0x6f:
+        return value - 0x60, pos + 1
+    return decoders[data[pos + 1]](response, data, pos + 1)
+
+
+def _decode_class_definition(response, data, pos):
+    """
+    读取一个类的类属性，主要是类名和类中的变量名
+    :return: 类名以及读取之后的位置
+    """
+    # 类名以及字段名总是str
+    path, pos = _read_string(data, pos + 1, False, name_cache)
+    response.paths.append(path)
+
+    field_length, pos = decoders[data[pos]](response, data, pos)
+    field_names = []
+    for i in xrange(field_length):
+        field_name, pos = _read_string(data, pos, False, name_cache)
+        field_names.append(field_name)
+    response.field_names.append(field_names)
+    converter = response.converter_table.get(path)
+    response.converters.append(converter)
+    if response.defined_objects and converter is None:
+        response.classes.append(_get_defined_class(path, field_names))
+    else:
+        response.classes.append(None)
+    return path, pos
+
+
+def _get_defined_class(path, field_names):
+    """
+    获取一个类的对象的解码方法，对象被解码为Object.define生成的类的实例，类以及解码方法只生成一次；
+    字段名不能作为属性名的类仍然被解码为dict
+    :param path:
+    :param field_names:
+    :return: 解码方法，参数为(response, data, pos)，返回对象以及读取之后的位置；或者None
+    """
+    key = path, tuple(field_names)
+    decode_fields = _DEFINED_CLASSES.get(key)
+    if decode_fields is not None or key in _DEFINED_CLASSES:
+        return decode_fields
+
+    try:
+        cls = Object.define(path, field_names)
+    except ValueError:
+        # 字段名重复或者不能作为属性名
+        decode_fields = None
+    else:
+        # 直接对__slots__中的属性赋值，比逐个调用setattr快得多
+        lines = ['def decode(response, data, pos):',
+                 '    result = new(cls)',
+                 '    response.objects.append(result)']
+        for name in field_names:
+            lines.append('    result.{}, pos = decoders[data[pos]](response, data, pos)'.format(name))
+        lines.append('    return result, pos')
+        namespace = {'new': cls.__new__, 'cls': cls, 'decoders': decoders}
+        exec compile('\n'.join(lines), '<decoder for {}>'.format(path), 'exec') in namespace
+        decode_fields = namespace['decode']
+    if len(_DEFINED_CLASSES) < _DEFINED_CLASSES_MAX_SIZE:
+        _DEFINED_CLASSES[key] = decode_fields
+    return decode_fields
+
+
+@ranges(ord('C'))
+def _decode_class(response, data, pos):
+    """
+    类定义之后紧跟着此类的一个对象
+    """
+    _, pos = _decode_class_definition(response, data, pos)
+    return _decode_object(response, data, pos)
+
+
+def _decode_type(response, data, pos):
+    """
+    type代表了list或者map中泛型的类型，在Python中此类型无意义
+    """
+    if data[pos] in _STRING_TAGS:
+        _type, pos = _read_string(data, pos, False, name_cache)
+        response.types.append(_type)
+        return _type, pos
+    _type, pos = decoders[data[pos]](response, data, pos)
+    if isinstance(_type, int):
+        return response.types[_type], pos
+    else:
+        raise HessianTypeError('Unknown _type type for value: {0}'.format(_type))
+
+
+def _read_list_head(response, data, pos):
+    """
+    读取列表的类型以及长度
+    :return: 列表的长度以及第一个元素的位置，可变长度的列表的长度为None
+    """
+    _type, length, pos = _read_typed_list_head(response, data, pos)
+    return length, pos
+
+
+def _read_typed_list_head(response, data, pos):
+    """
+    读取列表的类型以及长度，除了基本类型数组之外，type对于Python来说没有用处
+    :return: 列表的类型、长度以及第一个元素的位置，没有类型的列表的类型为None，可变长度的列表的长度为None
+    """
+    value = data[pos]
+    pos += 1
+    _type = None
+    if 0x70 <= value <= 0x77 or value == 0x55 or value == 0x56:
+        _type, pos = _decode_type(response, data, pos)
+    if value == 0x56 or value == 0x58:
+        length, pos = decoders[data[pos]](response, data, pos)
+        return _type, length, pos
+    elif 0x70 <= value <= 0x77:
+        return _type, value - 0x70, pos
+    elif 0x78 <= value <= 0x7f:
+        return _type, value - 0x78, pos
+    return _type, None, pos
+
+
+@ranges((0x70, 0x7f), (0x55, 0x58))
+def _decode_list(response, data, pos):
+    """
+    读取一个列表
+    """
+    result = []
+    index = len(response.objects)
+    response.objects.append(result)
+    _type, length, pos = _read_typed_list_head(response, data, pos)
+    if response.typed_arrays and _type in _ARRAY_TYPECODES:
+        values, pos = _read_number_array(response, data, pos, length, _ARRAY_TYPECODES[_type])
+        response.objects[index] = values
+        return values, pos
+    if response.columns and length != 0 and data[pos] in _OBJECT_TAGS:
+        columns, rows, pos = _read_columns(response, data, pos, length)
+        if rows is None:
+            response.objects[index] = columns
+            return columns, pos
+        # 元素不全是同一个类的对象，已经读取的元素转化为行之后继续读取剩余的元素
+        result.extend(rows)
+        if length is not None:
+            length -= len(rows)
+
+    append = result.append
+    # 可变长度的列表
+    if length is None:
+        while data[pos] != 0x5a:
+            item, pos = decoders[data[pos]](response, data, pos)
+            append(item)
+        return result, pos + 1  # 跳过最后一个'Z'字符
+
+    for i in xrange(length):
+        item, pos = decoders[data[pos]](response, data, pos)
+        append(item)
+    return result, pos
+
+
+def _read_columns(response, data, pos, length):
+    """
+    把同一个类的对象的列表按字段读取为列，不生成每一行的对象：所有字段的值按顺序读取之后再按字段切分为列，
+    列的类型由第一行的值决定：int为array('l')，float为array('d')，其它的以及有不符合此类型的值的列为list
+    :param length: 列表的长度，可变长度的列表为None
+    :return: 列、行以及读取之后的位置；遇到不是同一个类的对象的元素时列为None，行为已经读取的对象(dict)，
+             位置为此元素的位置；否则行为None
+    """
+    objects = response.objects
+    # 所有的对象共用同一个占位，被引用时再解码为dict
+    skipped = _SkippedRows()
+    indexes, positions = skipped.indexes, skipped.positions
+    values = []
+    append = values.append
+    class_ref = names = None
+    while len(indexes) != length if length is not None else data[pos] != 0x5a:
+        if data[pos] == ord('C'):
+            _, pos = _decode_class_definition(response, data, pos)
+        if data[pos] not in _OBJECT_TAGS or data[pos] == ord('C'):
+            break
+        start = pos
+        ref, pos = _read_object_head(response, data, pos)
+        if class_ref is None:
+            names = response.field_names[ref]
+            if not names or response.converters[ref] is not None or len(set(names)) != len(names):
+                pos = start
+                break
+            class_ref = ref
+        elif ref != class_ref:
+            pos = start
+            break
+
+        indexes.append(len(objects))
+        positions.append(start)
+        objects.append(skipped)
+        for _ in names:
+            value, pos = decoders[data[pos]](response, data, pos)
+            append(value)
+    else:
+        if length is None:
+            pos += 1  # 跳过最后一个'Z'字符
+        size = len(names or ())
+        result = {}
+        for i, name in enumerate(names or ()):
+            result[name] = _to_column(values[i::size])
+        return result, None, pos
+
+    # 回退为行，对象的占位替换为对应的行，保证之后的引用得到的是同一个对象
+    size = len(names or ())
+    rows = [dict(zip(names, values[i:i + size])) for i in xrange(0, len(values), size)]
+    for index, row in zip(indexes, rows):
+        objects[index] = row
+    return None, rows, pos
+
+
+def _to_column(values):
+    """
+    把一列的值转化为array.array或者numpy数组，不能转化时仍然为list
+    """
+    value_type = type(values[0])
+    typecode = 'l' if value_type is int else 'd' if value_type is float else None
+    if typecode is None:
+        return values
+    try:
+        return _to_numpy(array(typecode, values))
+    except (TypeError, OverflowError):
+        return values
+
+
+def _to_numpy(values):
+    """
+    安装了numpy时把array.array转化为共用同一块内存的numpy数组
+    """
+    if numpy is not None:
+        return numpy.frombuffer(values, values.typecode)
+    return values
+
+
+def _read_number_array(response, data, pos, length, typecode):
+    """
+    把Java的基本类型数组一次性读取为array.array或者numpy数组：连续的同一种编码的数字达到_MIN_NUMBER_RUN个时
+    整段转换字节，参见方法：_unpack_numbers；否则逐个读取接下来的若干个数字，连续不成段的次数越多逐个读取的越多
+    :param length: 数组的长度，可变长度的列表为None
+    :param typecode: array.array的类型
+    :return: 数组以及读取之后的位置
+    """
+    values = array(typecode)
+    # 逐个读取的数字先放入list再一次性放入数组，比逐个放入数组快
+    items = []
+    append = items.append
+    if length is None:
+        while data[pos] != 0x5a:
+            value, pos = decoders[data[pos]](response, data, pos)
+            append(value)
+        values.fromlist(items)
+        return _to_numpy(values), pos + 1  # 跳过最后一个'Z'字符
+
+    encodings = _DOUBLE_ENCODINGS if typecode == 'd' else _INT_ENCODINGS
+    remaining = length
+    plain = 1
+    while remaining > 0:
+        encoding = encodings[data[pos]]
+        if encoding is not None:
+            width, tags, unpack = encoding
+            count = _count_numbers(data, pos, width, tags, min(remaining, (len(data) - pos) // width))
+            if count >= _MIN_NUMBER_RUN:
+                run = unpack(data, pos, count)
+                if run.typecode == typecode:
+                    values.extend(run)
+                else:
+                    values.fromlist(run.tolist())
+                pos += width * count
+                remaining -= count
+                plain = 1
+                continue
+            plain = min(plain * 2, _MAX_PLAIN_NUMBERS)
+        count = min(plain, remaining)
+        for i in xrange(count):
+            value, pos = decoders[data[pos]](response, data, pos)
+            append(value)
+        values.fromlist(items)
+        del items[:]
+        remaining -= count
+    return _to_numpy(values), pos
+
+
+def _count_numbers(data, pos, width, tags, limit):
+    """
+    从pos开始连续的同一种编码的数字的个数，每次检查的数字的个数逐次翻倍
+    :param width: 每个数字的字节数，包括类型标识
+    :param tags: 匹配连续的这种编码的类型标识的正则表达式
+    :param limit: 最多的个数
+    :return:
+    """
+    count = 0
+    block = 64
+    while count < limit:
+        size = min(block, limit - count)
+        start = pos + count * width
+        matched = tags.match(data[start:start + size * width:width]).end()
+        count += matched
+        if matched < size:
+            break
+        block *= 2
+    return count
+
+
+def _unpack_numbers(data, pos, count, width, typecode, tag_tables=(), scale=None):
+    """
+    一次性转换连续的count个同一种编码的数字：把每个数字转化为typecode的大端字节，
+    这些字节由类型标识经过tag_tables转换之后的字节以及类型标识之后的字节组成，之后一次性转化为array.array
+    :param width: 每个数字的字节数，包括类型标识
+    :param typecode: array.array的类型，其字节数为len(tag_tables) + width - 1
+    :param tag_tables: 类型标识的转换表，例如：0xc8~0xcf开头的int的高位字节为(类型标识 - 0xc8)
+    :param scale: 转换之后的值再乘以此值
+    :return: array.array
+    """
+    size = len(tag_tables) + width - 1
+    end = pos + count * width
+    packed = bytearray(count * size)
+    if tag_tables:
+        tags = data[pos:end:width]
+        for i, table in enumerate(tag_tables):
+            packed[i::size] = tags.translate(table)
+    for i in xrange(1, width):
+        packed[len(tag_tables) + i - 1::size] = data[pos + i:end:width]
+    values = array(typecode, str(packed))
+    if size > 1 and sys.byteorder == 'little':
+        values.byteswap()
+    if scale is not None:
+        values = array('d', [value * scale for value in values])
+    return values
+
+
+def _number_encodings(encodings):
+    """
+    生成基本类型数组中每个类型标识所对应的编码
+    :param encodings: [(类型标识的范围, 字节数, array.array的类型, 类型标识的偏移量, 是否需要符号位, scale)]
+    :return: 每个类型标识所对应的(字节数, 匹配连续的这种编码的类型标识的正则表达式, 转换方法)，无法识别的为None
+    """
+    table = [None] * 256
+    for (first, last), width, typecode, offset, signed, scale in encodings:
+        if array(typecode).itemsize == 0 or typecode == 'l' and array('l').itemsize != 8:
+            continue
+        tag_tables = []
+        if signed:
+            tag_tables.append(''.join(chr(0xff if i - offset < 0 else 0) for i in xrange(0x100)))
+        if offset is not None:
+            tag_tables.append(''.join(chr((i - offset) & 0xff) for i in xrange(0x100)))
+        tags = re.compile('[{}-{}]*'.format(re.escape(chr(first)), re.escape(chr(last))))
+
+        def unpack(data, pos, count, width=width, typecode=typecode, tag_tables=tuple(tag_tables), scale=scale):
+            return _unpack_numbers(data, pos, count, width, typecode, tag_tables, scale)
+
+        for tag in xrange(first, last + 1):
+            table[tag] = width, tags, unpack
+    return table
+
+
+# int[]以及long[]中的数字的编码，long[]中的数字也可能使用int的编码
+_INT_ENCODINGS = _number_encodings([
+    ((0x80, 0xbf), 1, 'b', 0x90, False, None),
+    ((0xc0, 0xcf), 2, 'h', 0xc8, False, None),
+    ((0xd0, 0xd7), 3, 'i', 0xd4, True, None),
+    ((0x49, 0x49), 5, 'i', None, False, None),
+    ((0xd8, 0xef), 1, 'b', 0xe0, False, None),
+    ((0xf0, 0xff), 2, 'h', 0xf8, False, None),
+    ((0x38, 0x3f), 3, 'i', 0x3c, True, None),
+    ((0x59, 0x59), 5, 'i', None, False, None),
+    ((0x4c, 0x4c), 9, 'l', None, False, None),
+])
+# double[]中的数字的编码：0.0以及1.0、byte、short、毫(int * 0.001)以及8个字节的double
+_DOUBLE_ENCODINGS = _number_encodings([
+    ((0x5b, 0x5c), 1, 'b', 0x5b, False, None),
+    ((0x5d, 0x5d), 2, 'b', None, False, None),
+    ((0x5e, 0x5e), 3, 'h', None, False, None),
+    ((0x5f, 0x5f), 5, 'i', None, False, 0.001),
+    ((0x44, 0x44), 9, 'd', None, False, None),
+])
+
+
+@ranges(ord('H'), ord('M'))
+def _decode_map(response, data, pos):
+    """
+    读取一个dict，有类型的map(M)的类型对于Python来说没有用处
+    """
+    result = {}
+    response.objects.append(result)
+    if data[pos] == ord('M'):
+        _type, pos = _decode_type(response, data, pos + 1)
+    else:
+        pos += 1
+    while data[pos] != 0x5a:
+        key, pos = decoders[data[pos]](response, data, pos)
+        result[key], pos = decoders[data[pos]](response, data, pos)
+    return result, pos + 1  # 跳过最后一个'Z'字符
+
+
+@ranges(0x4a)
+def _decode_date(response, data, pos):
+    timestamp = unpack_from('!q', data, pos + 1)[0]
+    return response.format_date(timestamp), pos + 9
+
+
+@ranges(0x4b)
+def _decode_date_minute(response, data, pos):
+    timestamp = unpack_from('!i', data, pos + 1)[0] * 60000
+    return response.format_date(timestamp), pos + 5
+
+
+def _format_date(timestamp):
+    return datetime.fromtimestamp(timestamp / 1e3).strftime("%Y-%m-%dT%H:%M:%S.%f+0800")
+
+
+def _local_datetime(timestamp):
+    seconds, millis = divmod(timestamp, 1000)
+    return datetime.fromtimestamp(seconds).replace(microsecond=millis * 1000)
+
+
+class _UTC(tzinfo):
+    """
+    Python2中没有datetime.timezone.utc
+    """
+
+    def utcoffset(self, dt):
+        return timedelta(0)
 
-    @ranges(ord('C'))
-    def read_class(self):
+    def tzname(self, dt):
+        return 'UTC'
+
+    def dst(self, dt):
+        return timedelta(0)
+
+    def __repr__(self):
+        return 'UTC'
+
+
+_UTC_EPOCH = datetime(1970, 1, 1, tzinfo=_UTC())
+
+# 日期的各种解码方式，参见类：Response
+_DATE_FORMATS = {
+    'string': _format_date,
+    'millis': int,
+    'datetime': _local_datetime,
+    'utc': lambda timestamp: _UTC_EPOCH + timedelta(milliseconds=timestamp),
+}
+
+
+@ranges(0x51)
+def _decode_ref(response, data, pos):
+    """
+    读取一个已知的object/list/map
+    """
+    ref_id, pos = decoders[data[pos + 1]](response, data, pos + 1)
+    value = response.objects[ref_id]
+    if value.__class__ is _SkippedRows:
+        value = value.get(ref_id)
+    if value.__class__ is _SkippedValue:
+        value = response.objects[ref_id] = _decode_skipped(response, data, value)
+    return value, pos
+
+
+for _tag, _decoder in enumerate(decoders):
+    if _decoder is None:
+        decoders[_tag] = _decode_unknown
+
+_BOOLEAN_TAGS = frozenset([ord('T'), ord('F')])
+_INT_TAGS = frozenset(range(0x80, 0xd8) + [ord('I')])
+_LONG_TAGS = frozenset(range(0xd8, 0x100) + range(0x38, 0x40) + [0x59, ord('L')])
+_DOUBLE_TAGS = frozenset(range(0x5b, 0x60) + [ord('D')])
+_STRING_TAGS = frozenset(range(0x00, 0x20) + range(0x30, 0x34) + [0x52, ord('S')])
+_OBJECT_TAGS = frozenset(range(0x60, 0x70) + [ord('O'), ord('C')])
+_LIST_TAGS = frozenset(range(0x70, 0x80) + range(0x55, 0x59))
+_MAP_TAGS = frozenset([ord('H'), ord('M')])
+_DATE_TAGS = frozenset([0x4a, 0x4b])
+_NULL_TAGS = frozenset([ord('N')])
+_BINARY_TAGS = frozenset(range(0x20, 0x30) + range(0x34, 0x38) + [0x41, 0x42])
+
+# 解码时被转化为其它值的Java类：{类名: 转化方法}，参见方法：register_decoder
+_CONVERTERS = {
+    'java.math.BigDecimal': lambda value: float(value['value']) or 0,
+    'java.math.BigInteger': lambda value: int(value['value']),
+}
+
+
+def register_decoder(class_name, converter):
+    """
+    注册Java类的解码方式，此类的对象先被解码为dict，之后再使用converter转化，
+    例如把BigDecimal解码为Decimal而不是float：
+        register_decoder('java.math.BigDecimal', lambda value: Decimal(value['value']))
+    转化方法在读取类定义时确定，解码每个对象时不需要再查找；已经注册过的类会被覆盖
+    :param class_name: Java类的全限定名，例如：java.math.BigDecimal
+    :param converter: 转化方法，参数为字段名与字段值的dict；为None时取消此类的转化，解码为dict
+    :return:
+    """
+    if converter is None:
+        _CONVERTERS.pop(class_name, None)
+    else:
+        _CONVERTERS[class_name] = converter
+
+
+class LazyDict(object):
+    """
+    延迟解码的map或者对象，第一次被访问时才解码其中的值，值中的map/list/对象仍然是延迟解码的；
+    除了不是dict的子类之外，其它的用法与dict相同，需要真正的dict时使用方法：materialize
+    """
+    __slots__ = ('_response', '_data', '_pos', '_fields', '_value')
+
+    def __init__(self, response, data, pos, fields=None):
         """
-        读取一个类的类属性，主要是类名和类中的变量名
-        :return:
+        :param response:
+        :param data:
+        :param pos: 第一个键或者字段的值的位置
+        :param fields: 对象的所有字段名，为None时代表这是一个以'Z'结尾的map
         """
-        self.read_byte()
-        path = self.read_string()
-        self.paths.append(path)
+        self._response = response
+        self._data = data
+        self._pos = pos
+        self._fields = fields
+        self._value = None
+
+    def _load(self):
+        value = self._value
+        if value is None:
+            response, data, pos = self._response, self._data, self._pos
+            value = {}
+            if self._fields is None:
+                while data[pos] != 0x5a:
+                    key, pos = _read_lazy(response, data, pos)
+                    value[key], pos = _read_lazy(response, data, pos)
+            else:
+                for field_name in self._fields:
+                    value[field_name], pos = _read_lazy(response, data, pos)
+            self._value = value
+        return value
+
+    def __getattr__(self, name):
+        # keys、get、items等方法直接使用解码之后的dict的方法
+        return getattr(self._load(), name)
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __setitem__(self, key, value):
+        self._load()[key] = value
+
+    def __delitem__(self, key):
+        del self._load()[key]
+
+    def __contains__(self, key):
+        return key in self._load()
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __eq__(self, other):
+        return self._load() == other
+
+    def __ne__(self, other):
+        return self._load() != other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self._load())
 
-        field_length = self.read_int()
-        field_names = []
-        for i in xrange(field_length):
-            field_names.append(self.read_string())
-        self.field_names.append(field_names)
-        return self.read_object()
 
-    def read_type(self):
+class LazyList(object):
+    """
+    延迟解码的list，第一次被访问时才解码其中的元素，元素中的map/list/对象仍然是延迟解码的；
+    除了不是list的子类之外，其它的用法与list相同，需要真正的list时使用方法：materialize
+    """
+    __slots__ = ('_response', '_data', '_pos', '_length', '_value')
+
+    def __init__(self, response, data, pos, length=None):
         """
-        type代表了list或者map中泛型的类型，在Python中此类型无意义
-        :return:
+        :param response:
+        :param data:
+        :param pos: 第一个元素的位置
+        :param length: 元素的个数，为None时代表这是一个以'Z'结尾的list
         """
-        _type = self.read_next()
-        if isinstance(_type, int):
-            return self.types[_type]
-        elif isinstance(_type, str):
-            self.types.append(_type)
-            return _type
+        self._response = response
+        self._data = data
+        self._pos = pos
+        self._length = length
+        self._value = None
+
+    def _load(self):
+        value = self._value
+        if value is None:
+            response, data, pos = self._response, self._data, self._pos
+            value = []
+            append = value.append
+            if self._length is None:
+                while data[pos] != 0x5a:
+                    item, pos = _read_lazy(response, data, pos)
+                    append(item)
+            else:
+                for i in xrange(self._length):
+                    item, pos = _read_lazy(response, data, pos)
+                    append(item)
+            self._value = value
+        return value
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __getitem__(self, index):
+        return self._load()[index]
+
+    def __setitem__(self, index, value):
+        self._load()[index] = value
+
+    def __delitem__(self, index):
+        del self._load()[index]
+
+    def __contains__(self, item):
+        return item in self._load()
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        if self._value is None and self._length is not None:
+            return self._length
+        return len(self._load())
+
+    def __eq__(self, other):
+        return self._load() == other
+
+    def __ne__(self, other):
+        return self._load() != other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self._load())
+
+
+Mapping.register(LazyDict)
+Sequence.register(LazyList)
+
+
+def materialize(value, memo=None):
+    """
+    把延迟解码的值完全解码为dict和list，同一个对象只会被解码一次，以保留响应中的引用关系
+    :param value:
+    :param memo:
+    :return:
+    """
+    if not isinstance(value, (LazyDict, LazyList, dict, list)):
+        return value
+    if memo is None:
+        memo = {}
+    result = memo.get(id(value))
+    if result is not None:
+        return result
+
+    if isinstance(value, (LazyDict, dict)):
+        result = memo[id(value)] = {}
+        for key, item in value.iteritems():
+            result[key] = materialize(item, memo)
+    else:
+        result = memo[id(value)] = []
+        for item in value:
+            result.append(materialize(item, memo))
+    return result
+
+
+def _read_lazy(response, data, pos):
+    """
+    延迟解码时读取一个已经被跳过的值，map/list/对象直接使用跳过时记录下来的值
+    :return: 值以及读取之后的位置
+    """
+    lazy_value = response.lazy_values.get(pos)
+    if lazy_value is not None:
+        return lazy_value
+    return decoders[data[pos]](response, data, pos)
+
+
+def _index_values(response, data, pos, count=None):
+    """
+    跳过连续的count个值，跳过时仍然要按顺序记录所有的类定义、类型以及可被引用的值，以保证之后能够正确的解析引用；
+    延迟解码时其中的map/list/对象被记录为LazyDict/LazyList并保存在response.lazy_values中，
+    否则只记录一个_SkippedValue，在被引用时才解码
+    :param response:
+    :param data:
+    :param pos:
+    :param count: 为None时跳过直到'Z'的所有值以及最后的'Z'
+    :return: 跳过之后的位置
+    """
+    sizes = _FIXED_SIZES
+    match = _ASCII_BYTES.match
+    i = 0
+    while 1:
+        if count is None:
+            tag = data[pos]
+            if tag == 0x5a:
+                return pos + 1
+        elif i < count:
+            tag = data[pos]
+            i += 1
+        else:
+            return pos
+        size = sizes[tag]
+        if size:
+            pos += size
+        # 只包含ASCII字符的短字符串
+        elif tag <= 0x1f and match(data, pos + 1, pos + 1 + tag).end() == pos + 1 + tag:
+            pos += 1 + tag
         else:
-            raise HessianTypeError('Unknown _type type for value: {0}'.format(_type))
+            pos = indexers[tag](response, data, pos)
 
-    @ranges((0x70, 0x7f), (0x55, 0x58))
-    def read_list(self):
+
+def _fixed_sizes():
+    """
+    数字、布尔值、日期以及短的二进制数据等定长的值的长度，跳过时直接根据长度跳过，其它的值为0
+    """
+    sizes = [0] * 256
+    for tag in xrange(0x20, 0x30):
+        sizes[tag] = tag - 0x20 + 1
+    for tags, size in (((0x80, 0xbf), 1), ((0xc0, 0xcf), 2), ((0xd0, 0xd7), 3), ((0xd8, 0xef), 1),
+                       ((0xf0, 0xff), 2), ((0x38, 0x3f), 3), ((0x5b, 0x5c), 1)):
+        for tag in xrange(tags[0], tags[1] + 1):
+            sizes[tag] = size
+    for tag, size in ((ord('I'), 5), (0x59, 5), (ord('L'), 9), (0x5d, 2), (0x5e, 3), (0x5f, 5), (ord('D'), 9),
+                      (ord('N'), 1), (ord('T'), 1), (ord('F'), 1), (0x4a, 9), (0x4b, 5)):
+        sizes[tag] = size
+    return sizes
+
+
+_FIXED_SIZES = _fixed_sizes()
+
+# 延迟解码时跳过每一种值的方法，参数与decoders中的方法相同，返回跳过之后的位置
+indexers = [None] * 256
+
+
+@ranges((0x00, 0x1f), (0x30, 0x33), 0x52, ord('S'), table=indexers)
+def _index_string(response, data, pos):
+    value = data[pos]
+    while value == 0x52:
+        pos = _find_utf8_end(data, pos + 3, unpack_from('!H', data, pos + 1)[0])
+        value = data[pos]
+    length, pos = _read_string_length(data, pos)
+    return _find_utf8_end(data, pos, length)
+
+
+@ranges((0x60, 0x6f), ord('O'), table=indexers)
+def _index_object(response, data, pos):
+    start = pos
+    ref, pos = _read_object_head(response, data, pos)
+    # 会被转化为其它值的对象直接解码
+    if response.converters[ref] is not None:
+        value, pos = _decode_object(response, data, start)
+    else:
+        field_names = response.field_names[ref]
+        value = LazyDict(response, data, pos, field_names) if response.lazy else _SkippedValue(start)
+        response.objects.append(value)
+        pos = _index_values(response, data, pos, len(field_names))
+    if response.lazy:
+        response.lazy_values[start] = value, pos
+    return pos
+
+
+@ranges(ord('C'), table=indexers)
+def _index_class(response, data, pos):
+    _, object_pos = _decode_class_definition(response, data, pos)
+    end = _index_object(response, data, object_pos)
+    if response.lazy:
+        response.lazy_values[pos] = response.lazy_values[object_pos]
+    return end
+
+
+@ranges((0x70, 0x7f), (0x55, 0x58), table=indexers)
+def _index_list(response, data, pos):
+    start = pos
+    length, pos = _read_list_head(response, data, pos)
+    result = LazyList(response, data, pos, length) if response.lazy else _SkippedValue(start)
+    response.objects.append(result)
+    pos = _index_values(response, data, pos, length)
+    if response.lazy:
+        response.lazy_values[start] = result, pos
+    return pos
+
+
+@ranges(ord('H'), ord('M'), table=indexers)
+def _index_map(response, data, pos):
+    start = pos
+    if data[pos] == ord('M'):
+        _type, pos = _decode_type(response, data, pos + 1)
+    else:
+        pos += 1
+    result = LazyDict(response, data, pos) if response.lazy else _SkippedValue(start)
+    response.objects.append(result)
+    pos = _index_values(response, data, pos)
+    if response.lazy:
+        response.lazy_values[start] = result, pos
+    return pos
+
+
+@ranges((0x34, 0x37), 0x41, 0x42, table=indexers)
+def _index_binary(response, data, pos):
+    while data[pos] == 0x41:
+        pos = _read_binary_chunk(data, pos)[1]
+    return _read_binary_chunk(data, pos)[1]
+
+
+@ranges(0x51, table=indexers)
+def _index_ref(response, data, pos):
+    return decoders[data[pos + 1]](response, data, pos + 1)[1]
+
+
+for _tag, _indexer in enumerate(indexers):
+    if _indexer is None:
+        indexers[_tag] = _decode_unknown
+
+
+class _SkippedValue(object):
+    """
+    被跳过的map/list/对象在response.objects中的占位，被引用时才解码
+    """
+    __slots__ = ('pos', 'decoding')
+
+    def __init__(self, pos):
+        self.pos = pos
+        self.decoding = False
+
+
+# 流式解码时已经取出的元素以及其中的map/list/对象在response.objects中共用的占位，对它们的引用无法被解析
+_RELEASED = _SkippedValue(-1)
+
+
+class _SkippedRows(object):
+    """
+    按列解码的列表中的所有对象在response.objects中共用的占位，参见方法：_read_columns
+    """
+    __slots__ = ('indexes', 'positions')
+
+    def __init__(self):
+        # 每个对象在response.objects中的位置以及在数据中的位置
+        self.indexes = array('l')
+        self.positions = array('l')
+
+    def get(self, index):
         """
-        读取一个列表
-        :return:
+        :param index: 对象在response.objects中的位置
+        :return: 此对象的占位，参见类：_SkippedValue
         """
-        result = []
-        self.objects.append(result)
-        value = self.read_byte()
-        # 固定长度的有类型短小列表
-        if 0x70 <= value <= 0x77:
-            _type = self.read_type()  # type对于Python来说没有用处
-            length = value - 0x70
-            for i in xrange(length):
-                result.append(self.read_next())
-        # 固定长度的无类型短小列表
-        elif 0x78 <= value <= 0x7f:
-            length = value - 0x78
-            for i in xrange(length):
-                result.append(self.read_next())
-        # 固定长度的有类型列表
-        elif value == 0x56:
-            _type = self.read_type()
-            length = self.read_int()
-            for i in xrange(length):
-                result.append(self.read_next())
-        # 固定长度的无类型列表
-        elif value == 0x58:
-            length = self.read_int()
-            for i in xrange(length):
-                result.append(self.read_next())
-        # 可变长度的有类型列表
-        elif value == 0x55:
-            _type = self.read_type()
-        # 可变长度的无类型列表
-        elif value == 0x57:
-            pass
-        return result
+        if self.positions is None:
+            return _SkippedValue(-1)
+        return _SkippedValue(self.positions[bisect_left(self.indexes, index)])
 
-    @ranges((0xd8, 0xff), (0x38, 0x3f), 0x59, ord('L'))
-    def read_long(self):
+
+def _decode_skipped(response, data, skipped):
+    """
+    解码一个被跳过的值，其中的类定义、类型以及可被引用的值在跳过时已经被记录过了，
+    所以解码时新记录下来的这些值在解码之后被丢弃，以保证之后的引用仍然是正确的
+    :param response:
+    :param data:
+    :param skipped:
+    :return:
+    """
+    if skipped.pos < 0:
+        raise HessianTypeError('Reference to a value that is no longer available')
+    if skipped.decoding:
+        raise HessianTypeError('Circular reference to skipped value at {}'.format(skipped.pos))
+    lists = (response.paths, response.field_names, response.classes, response.converters, response.types,
+             response.objects)
+    sizes = [len(values) for values in lists]
+    skipped.decoding = True
+    try:
+        return decoders[data[skipped.pos]](response, data, skipped.pos)[0]
+    finally:
+        skipped.decoding = False
+        for values, size in zip(lists, sizes):
+            del values[size:]
+
+
+def _compile_select(select):
+    """
+    把需要解码的字段的路径转化为树形结构，例如：['items[*].id', 'total']转化为
+    {'items': {'[*]': {'id': None}}, 'total': None}，None代表需要完整的值
+    :param select:
+    :return:
+    """
+    tree = {}
+    for path in select:
+        tokens = _SELECT_TOKENS.findall(path)
+        if not tokens or ''.join(tokens) != path.replace('.', ''):
+            raise ValueError('Invalid select path {}'.format(path))
+        node = tree
+        for token in tokens[:-1]:
+            if token in node and node[token] is None:
+                break  # 已经需要完整的值
+            node = node.setdefault(token, {})
+        else:
+            node[tokens[-1]] = None
+    return tree
+
+
+def _decode_selected(response, data, pos, selected):
+    """
+    只解码选中的字段，其它的字段被跳过
+    :param response:
+    :param data:
+    :param pos:
+    :param selected: 选中的字段，参见方法：_compile_select
+    :return: 值以及读取之后的位置
+    """
+    if selected is None:
+        return decoders[data[pos]](response, data, pos)
+    tag = data[pos]
+    if tag in _OBJECT_TAGS:
+        return _select_object(response, data, pos, selected)
+    elif tag in _MAP_TAGS:
+        return _select_map(response, data, pos, selected)
+    elif tag in _LIST_TAGS:
+        return _select_list(response, data, pos, selected)
+    # 与选中的字段的结构不一致的值直接解码
+    return decoders[tag](response, data, pos)
+
+
+def _select_object(response, data, pos, selected):
+    start = pos
+    if data[pos] == ord('C'):
+        _, pos = _decode_class_definition(response, data, pos)
+        start = pos
+    ref, pos = _read_object_head(response, data, pos)
+    if response.converters[ref] is not None:
+        return _decode_object(response, data, start)
+
+    result = {}
+    response.objects.append(result)
+    skip = 0
+    for field_name in response.field_names[ref]:
+        if field_name in selected:
+            if skip:
+                pos = _index_values(response, data, pos, skip)
+                skip = 0
+            result[field_name], pos = _decode_selected(response, data, pos, selected[field_name])
+        else:
+            skip += 1
+    if skip:
+        pos = _index_values(response, data, pos, skip)
+    return result, pos
+
+
+def _select_map(response, data, pos, selected):
+    result = {}
+    response.objects.append(result)
+    if data[pos] == ord('M'):
+        _type, pos = _decode_type(response, data, pos + 1)
+    else:
+        pos += 1
+    while data[pos] != 0x5a:
+        key, pos = decoders[data[pos]](response, data, pos)
+        if key in selected:
+            result[key], pos = _decode_selected(response, data, pos, selected[key])
+        else:
+            pos = _index_values(response, data, pos, 1)
+    return result, pos + 1
+
+
+def _select_list(response, data, pos, selected):
+    """
+    列表中的每一个元素都使用[*]之后的路径，没有[*]时直接使用当前的路径
+    """
+    selected = selected.get('[*]', selected)
+    result = []
+    response.objects.append(result)
+    append = result.append
+    length, pos = _read_list_head(response, data, pos)
+    if length is None:
+        while data[pos] != 0x5a:
+            item, pos = _decode_selected(response, data, pos, selected)
+            append(item)
+        return result, pos + 1
+    for i in xrange(length):
+        item, pos = _decode_selected(response, data, pos, selected)
+        append(item)
+    return result, pos
+
+
+class _IncompleteData(Exception):
+    """
+    流式解码时已经收到的数据还不足以解码下一个值
+    """
+
+
+class ResponseStream(object):
+    """
+    流式解码分多次收到的响应体，响应的值为列表时每当一个元素的数据完整之后就可以取出这个元素，不需要等待整个响应体。
+    已经取出的元素以及其中的map/list/对象不再被保留，之后对它们的引用无法被解析；已经解码的数据会被丢弃，其中被跳过的值也无法再被解码
+    """
+
+    def __init__(self, keep_values=False, **options):
         """
-        读取一个long类型的数字
-        :return:
+        :param keep_values: 为True时已经取出的元素仍然被保留在列表中，对它们的引用可以被解析，
+                            完整的值为value，适用于分块解码完整的响应，参见方法：decode_mapped；
+                            指定了typed_arrays或者columns时列表被完整地解码
+        :param options: 解码的选项，参见类：Response；流式解码时不使用lazy，
+                        收到的数据会被追加以及丢弃，所以也不使用binary_views
         """
-        value = self.read_byte()
-        if 0xd8 <= value <= 0xef:
-            result = value - 0xe0
-        elif 0xf0 <= value <= 0xff:
-            result = ((value - 0xf8) << 8) | self.read_byte()
-        elif 0x38 <= value <= 0x3f:
-            i = (value - 0x3c) << 16
-            i |= self.read_byte() << 8
-            i |= self.read_byte()
-            result = i
-        elif value == 0x59:
-            result = unpack('!i', self.read_bytes(4))[0]
-        elif value == ord('L'):
-            result = unpack('!q', self.read_bytes(8))[0]
-        else:
-            raise HessianTypeError('{0} is not long type'.format(value))
-        return result
+        options['lazy'] = False
+        options['binary_views'] = False
+        self.response = Response(bytearray(), **options)
+        self.keep_values = keep_values
+        # keep_values为True时响应的值，值为列表时在读取到列表的头部之后即为此列表
+        self.value = None
+        # 异常的响应，参见方法：Response#read_error
+        self.error_response = None
+        self.done = False
+        self.__data = bytearray()
+        self.__pos = 0
+        self.__finished = False
+        self.__read = self.__read_flag
+        # 列表中剩余的元素个数，可变长度的列表为None
+        self.__remaining = None
+        self.__selected = None
+        # 数据不足时至少收到这么多的数据之后再重试
+        self.__retry_size = 0
+        # response.objects中已经检查过的位置，参见方法：__compact
+        self.__checked = 0
 
-    @ranges(ord('N'))
-    def read_null(self):
+    def feed(self, data):
         """
-        读取一个None
+        添加收到的数据
+        :param data:
         :return:
         """
-        value = self.read_byte()
-        if value == ord('N'):
-            return None
-        else:
-            raise HessianTypeError('{0} is not null'.format(value))
+        self.__data += data
 
-    @ranges(ord('H'), ord('M'))
-    def read_map(self):
+    def finish(self):
         """
-        读取一个dict
+        响应体的数据已经全部收到
         :return:
         """
-        value = self.read_byte()
-
-        if value == ord('M') or value == ord('H'):
-            result = {}
-            self.objects.append(result)
-            while self.get_byte() != ord('Z'):
-                key = self.read_next()
-                value = self.read_next()
-                result[key] = value
-            self.read_byte()  # 干掉最后一个'Z'字符
-            return result
-        else:
-            raise HessianTypeError('{0} is not a map.'.format(value))
+        self.__finished = True
 
-    @ranges(0x4a, 0x4b)
-    def read_date(self):
+    def buffered_size(self):
         """
-        读取一个date类型的值
+        尚未被解码的数据的字节数
         :return:
         """
-        value = self.read_byte()
-        if value == 0x4a:
-            timestamp = unpack('!q', self.read_bytes(8))[0]
-        elif value == 0x4b:
-            timestamp = unpack('!i', self.read_bytes(4))[0]
-            timestamp *= 60000
-        else:
-            raise HessianTypeError('{0} is not date type'.format(value))
-        return datetime.fromtimestamp(timestamp / 1e3).strftime("%Y-%m-%dT%H:%M:%S.%f+0800")
+        return len(self.__data) - self.__pos
 
-    @ranges(0x51)
-    def read_ref(self):
+    def read_values(self):
         """
-        读取一个已知的object/list/map
-        :return:
+        解码已经收到的数据中所有完整的值
+        :return: 新解码出来的列表的元素
         """
-        self.read_byte()  # 干掉0x51
-        ref_id = self.read_int()
-        return self.objects[ref_id]
+        values = []
+        if not self.__finished and self.buffered_size() < self.__retry_size:
+            return values
+        while not self.done:
+            try:
+                self.__read(values)
+            except _IncompleteData:
+                # 数据至少增加一倍之后再重试，避免很大的元素被反复地从头解码
+                self.__retry_size = self.buffered_size() * 2
+                break
+        self.__compact()
+        return values
 
-    def read_next(self):
+    def __decode(self, decode, *args):
         """
-        读取下一个变量，自动识别变量类型
-        :return:
+        从当前的位置解码，数据不足时撤销解码过程中记录下来的类定义、类型以及可被引用的值
+        :param decode: 解码方法
+        :param args:
+        :return: 值以及解码之后的位置
         """
-        data_type = self.get_byte()
-        func = functions[data_type]
-        return func(self)
+        response = self.response
+        lists = (response.paths, response.field_names, response.classes, response.converters, response.types,
+                 response.objects)
+        sizes = [len(values) for values in lists]
+        try:
+            return decode(response, self.__data, self.__pos, *args)
+        except (IndexError, StructError, HessianTypeError) as e:
+            if self.__finished:
+                if isinstance(e, HessianTypeError):
+                    raise
+                raise HessianTypeError('Response out of data at {}'.format(self.__pos))
+            for values, size in zip(lists, sizes):
+                del values[size:]
+            raise _IncompleteData()
 
-    def read_error(self):
+    def __check_data(self):
+        if self.__pos >= len(self.__data):
+            if self.__finished:
+                raise HessianTypeError('Response out of data at {}'.format(self.__pos))
+            raise _IncompleteData()
+
+    def __read_flag(self, values):
+        flag, self.__pos = self.__decode(_decode_selected, None)
+        if flag == 1:
+            self.__read = self.__read_head
+        elif flag == 2:  # 响应的值为NULL
+            self.done = True
+        elif flag == 0:  # 异常的响应值
+            self.__read = self.__read_error
+        else:
+            raise DubboResponseException("Unknown result flag, expect '0' '1' '2', get {}".format(flag))
+
+    def __read_error(self, values):
+        if not self.__finished:
+            raise _IncompleteData()
+        self.error_response = Response(self.__data[self.__pos:])
+        self.done = True
+
+    def __read_head(self, values):
+        self.__check_data()
+        response = self.response
+        select = response.select
+        keep_whole = self.keep_values and (response.typed_arrays or response.columns)
+        if self.__data[self.__pos] not in _LIST_TAGS or keep_whole:
+            # 不是列表的值只能完整地解码
+            value, self.__pos = self.__decode(_decode_selected, select)
+            values.append(value)
+            self.value = value
+            self.done = True
+            return
+        self.__remaining, self.__pos = self.__decode(_read_list_head)
+        if self.keep_values:
+            self.value = []
+            response.objects.append(self.value)
+        else:
+            # 列表本身不会被返回，对它的引用无法被解析
+            response.objects.append(_SkippedValue(-1))
+        self.__selected = select.get('[*]', select) if select else None
+        self.__read = self.__read_element
+
+    def __read_element(self, values):
+        if self.__remaining is None:
+            self.__check_data()
+            if self.__data[self.__pos] == 0x5a:
+                self.__pos += 1
+                self.done = True
+                return
+        elif self.__remaining == 0:
+            self.done = True
+            return
+
+        objects = self.response.objects
+        index = len(objects)
+        value, self.__pos = self.__decode(_decode_selected, self.__selected)
+        if self.__remaining is not None:
+            self.__remaining -= 1
+        if self.keep_values:
+            self.value.append(value)
+        elif len(objects) > index:
+            # 已经取出的元素以及其中所有可被引用的值都不再保留
+            objects[index:] = [_RELEASED] * (len(objects) - index)
+        values.append(value)
+
+    def __compact(self):
         """
-        解析Java的错误信息，因为需要知道错误的类型，所以需要单独处理
+        丢弃已经解码的数据，其中被跳过的值之后无法再被解码
         :return:
         """
-        self.read_byte()
-        error_type = self.read_string()
-        self.paths.append(error_type)
+        pos = self.__pos
+        if pos < _STREAM_COMPACT_SIZE or pos * 2 < len(self.__data):
+            return
+        objects = self.response.objects
+        for i in xrange(self.__checked, len(objects)):
+            if objects[i].__class__ is _SkippedValue:
+                objects[i].pos = -1
+            elif objects[i].__class__ is _SkippedRows:
+                objects[i].positions = None
+        self.__checked = len(objects)
+        del self.__data[:pos]
+        self.__pos = 0
 
-        field_length = self.read_int()
-        field_names = []
-        for i in xrange(field_length):
-            field_names.append(self.read_string())
-        self.field_names.append(field_names)
 
-        error = self.read_object()
-        error['cause'] = error_type
-        return error
+def is_list_response(head):
+    """
+    响应体是否为值为列表的正常响应，只有这样的响应体才能分块解码，参见方法：decode_mapped
+    :param head: 响应体开头的至少两个字节(结果的标识以及值的第一个字节)
+    :return:
+    """
+    return len(head) >= 2 and head[0] == 0x91 and head[1] in _LIST_TAGS
 
-    def __repr__(self):
-        return str(self.__data)
+
+def decode_mapped(data, chunk_size=_STREAM_COMPACT_SIZE, **options):
+    """
+    分块解码完整的响应体(包括结果的标识)，例如被写入临时文件的响应体的mmap，
+    值为列表时每次只复制一块数据，已经解码的数据被丢弃，不需要把整个响应体复制到内存中；
+    其它的值只能一次性地复制全部的数据之后再解码
+    :param data: 支持切片的响应体，例如mmap
+    :param chunk_size: 每次复制的字节数
+    :param options: 解码的选项，参见类：ResponseStream
+    :return: 解码完成的ResponseStream，响应的值为value，异常的响应为error_response
+    """
+    stream = ResponseStream(keep_values=True, **options)
+    response = stream.response
+    # 结果的标识之后不是列表时，逐块地重试反而需要多次从头解码，一次性复制全部的数据
+    if not is_list_response(bytearray(buffer(data, 0, 2))) or response.typed_arrays or response.columns:
+        chunk_size = len(data)
+    pos = 0
+    while pos < len(data):
+        stream.feed(buffer(data, pos, chunk_size))
+        stream.read_values()
+        pos += chunk_size
+    stream.finish()
+    stream.read_values()
+    return stream
 
 
 def parse_response_head(response_head):
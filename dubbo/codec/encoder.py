@@ -28,12 +28,72 @@
 * double
 * java.lang.String
 * java.lang.Object
+* java.util.Date
+* java.math.BigDecimal
+* java.util.List/Set/Map
+* byte[]
 """
+import calendar
+import keyword
+import re
 import struct
+import tempfile
+import time
+from abc import ABCMeta
+from array import array
+from collections import Iterator
+from datetime import datetime, date
+from decimal import Decimal
 
-from dubbo.common.constants import MIN_INT_32, MAX_INT_32, DEFAULT_REQUEST_META
+from dubbo.common.constants import MIN_INT_32, MAX_INT_32, DEFAULT_REQUEST_META, BODY_LENGTH_PLACEHOLDER
 from dubbo.common.exceptions import HessianTypeError
-from dubbo.common.util import double_to_long_bits, get_invoke_id
+from dubbo.common.util import get_invoke_id
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# utf-8中一个字符除去第一个字节之外的后续字节，用于计算字符串的UTF-16长度
+_UTF8_CONTINUATION_BYTES = ''.join(chr(i) for i in xrange(0x80, 0xc0))
+# utf-8中使用4个字节表示的字符
+_SUPPLEMENTARY_CHAR = re.compile(r'([\xf0-\xf4][\x80-\xbf]{3})')
+_SUPPLEMENTARY_CHAR_LEADS = '\xf0\xf1\xf2\xf3\xf4'
+# 缓存常用的超出BMP的字符(例如emoji)所对应的代理对
+_SURROGATE_PAIRS = {}
+_SURROGATE_PAIRS_MAX_SIZE = 4096
+# 数字数组在Java中所对应的类型
+_NUMBER_CLASS_NAMES = {'int': '[I', 'long': '[J', 'double': '[D'}
+# 元素个数达到此值的数字列表会转化为numpy数组再进行编码
+_NUMPY_MIN_SIZE = 64
+# 二进制数据的长度达到此值时，在分段编码中以引用的方式发送，参见方法：Request#encode_segments
+_BINARY_SEGMENT_MIN_SIZE = 0x10000
+# 分段编码时迭代器参数每产生这么多的数据就写入临时文件，参见方法：Request#encode_segments
+_STREAM_CHUNK_SIZE = 0x100000
+# 基本类型的描述符
+_PRIMITIVE_DESCRIPTORS = {'boolean': 'Z', 'byte': 'B', 'char': 'C', 'short': 'S', 'int': 'I', 'long': 'J',
+                          'float': 'F', 'double': 'D'}
+# 包装类型所对应的基本类型
+_BOXED_TYPES = {'java.lang.Boolean': 'boolean', 'java.lang.Byte': 'byte', 'java.lang.Character': 'char',
+                'java.lang.Short': 'short', 'java.lang.Integer': 'int', 'java.lang.Long': 'long',
+                'java.lang.Float': 'float', 'java.lang.Double': 'double'}
+_INT_RANGES = {'byte': (-0x80, 0x7f), 'short': (-0x8000, 0x7fff), 'int': (MIN_INT_32, MAX_INT_32),
+               'long': (-0x8000000000000000, 0x7fffffffffffffff)}
+# 声明的参数类型为这些集合时，根据泛型中的元素类型对元素进行校验以及编码
+_LIST_TYPES = frozenset(['java.util.List', 'java.util.ArrayList', 'java.util.LinkedList', 'java.util.Collection'])
+_SET_TYPES = frozenset(['java.util.Set', 'java.util.HashSet', 'java.util.LinkedHashSet'])
+_MAP_TYPES = frozenset(['java.util.Map', 'java.util.HashMap', 'java.util.LinkedHashMap'])
+# 参数结构相同的调用连续出现这么多次之后生成专用的编码方法
+_SPECIALIZE_THRESHOLD = 3
+# 专用编码方法失效的次数超过此值之后，此方法不再尝试生成专用的编码方法
+_SPECIALIZE_MAX_MISSES = 8
+_SCALAR_TYPES = (type(None), bool, int, long, float, str, unicode)
+_SCALAR_TYPES_SET = frozenset(_SCALAR_TYPES)
+_GENERIC_SHAPE = 'generic'
+# Object.define生成的类的字段名需要作为__slots__中的名字
+_IDENTIFIER = re.compile(r'[A-Za-z_][A-Za-z0-9_]*$')
+# 长字符串的每一个分块包含0x8000个UTF-16字符
+_STRING_CHUNK = re.compile(r'(?:.[\x80-\xbf]*){32768}', re.S)
 
 
 class Object(object):
@@ -76,6 +136,170 @@ class Object(object):
     def get_path(self):
         return self.__path
 
+    @staticmethod
+    def define(path, field_names):
+        """
+        定义一个字段固定的Java类，例如：
+            Item = Object.define('com.foo.Item', ['id', 'name'])
+            item = Item(10086, name='python-dubbo')
+        生成的类使用__slots__保存字段的值，字段的顺序固定不变，并且类定义在定义时就已经被编码
+        :param path: Java对象的路径，例如：java.lang.Object
+        :param field_names: Java对象的所有字段名
+        :return: DefinedObject的子类
+        """
+        if not isinstance(path, (str, unicode)):
+            raise ValueError('Object path {} should be string type.'.format(path))
+        field_names = tuple(field_names)
+        for field_name in field_names:
+            if not isinstance(field_name, (str, unicode)):
+                raise ValueError('Object key {} should be string type.'.format(field_name))
+            # 以两个下划线开头的名字在类中会被改写(name mangling)，无法通过这个名字访问
+            if not _IDENTIFIER.match(field_name) or keyword.iskeyword(field_name) \
+                    or (field_name.startswith('__') and not field_name.endswith('__')) \
+                    or hasattr(DefinedObject, field_name):
+                raise ValueError('Field name {!r} of {} is not a valid attribute name or clashes with the attributes '
+                                 'of DefinedObject.'.format(field_name, path))
+        if len(set(field_names)) != len(field_names):
+            raise ValueError('Duplicate field names in {}'.format(field_names))
+
+        definition = bytearray()
+        definition.append(ord('C'))
+        Request._encode_str(definition, path)
+        Request._encode_int(definition, len(field_names))
+        for field_name in field_names:
+            Request._encode_str(definition, field_name)
+
+        return type(str(path.split('.')[-1]), (DefinedObject,), {
+            '__slots__': tuple(str(field_name) for field_name in field_names),
+            '_path': path,
+            '_field_names': field_names,
+            '_definition': str(definition)
+        })
+
+
+class DefinedObject(object):
+    """
+    通过Object.define生成的Java类的基类
+    """
+    __slots__ = ()
+    _path = None
+    _field_names = ()
+    _definition = None  # 预先编码好的类定义
+
+    def __init__(self, *args, **kwargs):
+        if len(args) > len(self._field_names):
+            raise ValueError('{} has only {} fields'.format(self._path, len(self._field_names)))
+        for field_name in self._field_names:
+            setattr(self, field_name, None)
+        for field_name, value in zip(self._field_names, args):
+            setattr(self, field_name, value)
+        for key, value in kwargs.iteritems():
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key not in self._field_names:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self._field_names:
+            raise KeyError('{} has no field {}'.format(self._path, key))
+        setattr(self, key, value)
+
+    def __repr__(self):
+        values = dict((field_name, getattr(self, field_name)) for field_name in self._field_names)
+        return '<java object {} at {} with {}>'.format(self._path, hex(id(self)), values)
+
+    def __contains__(self, key):
+        return key in self._field_names
+
+    def keys(self):
+        return list(self._field_names)
+
+    def get_path(self):
+        return self._path
+
+
+class Binary(object):
+    """
+    二进制数据，在Java中对应byte[]
+    data可以是str、bytearray、memoryview、buffer以及mmap等支持buffer协议的对象，编码时不会复制data
+    """
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return 'Binary({} bytes)'.format(len(self.data))
+
+
+class Signature(object):
+    """
+    预先声明的方法签名，例如：(long, java.util.List<String>)
+    声明之后请求的参数类型不再根据参数的值推断，参数在编码时根据声明的类型进行校验
+    """
+
+    def __init__(self, signature):
+        """
+        :param signature: 字符串形式的方法签名，或者由所有参数的Java类型组成的列表，
+                          参数类型中没有包名的类被当做java.lang包中的类，
+                          数组以及List/Set/Map的元素根据数组的类型以及泛型中的类型进行校验
+        """
+        if isinstance(signature, (str, unicode)):
+            signature = signature.strip()
+            if signature.startswith('(') and signature.endswith(')'):
+                signature = signature[1:-1]
+            signature = _split_java_types(signature)
+        self.java_types = [java_type.strip() for java_type in signature]
+        self.parameter_types = ''.join(_get_descriptor(java_type) for java_type in self.java_types)
+        self.encoders = [_get_declared_encoder(java_type) for java_type in self.java_types]
+
+    def __repr__(self):
+        return '({})'.format(', '.join(self.java_types))
+
+
+class RequestCache(object):
+    """
+    以方法和参数为键缓存编码好的请求，参数完全相同的请求只需要写入新的请求id，
+    只有参数全部为不可变的基本类型(bool, int, long, float, str, unicode, None以及由它们组成的tuple)时才会被缓存
+    """
+
+    def __init__(self, max_size=1024):
+        """
+        :param max_size: 最多缓存的请求数，超出时淘汰较长时间没有使用的请求
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # 近似的LRU：新的请求写入recent，recent写满之后变为old，old中被使用到的请求会被移回recent
+        self.__recent = {}
+        self.__old = {}
+
+    def get(self, key):
+        data = self.__recent.get(key)
+        if data is None:
+            data = self.__old.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self.put(key, data)
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        recent = self.__recent
+        if len(recent) >= (self.max_size + 1) // 2:
+            self.__old, self.__recent = recent, {}
+            recent = self.__recent
+        recent[key] = data
+
+    def __len__(self):
+        return len(self.__recent) + len(self.__old)
+
 
 class Request(object):
     """
@@ -89,21 +313,123 @@ class Request(object):
     * object
     """
 
-    def __init__(self, request):
+    def __init__(self, request, templates=None, references=False, signature=None, shapes=None, cache=None):
+        """
+        :param request: 请求的参数
+        :param templates: 用于缓存请求体中固定不变的前缀和后缀，参见方法：_encode_template
+        :param references: 同一个对象/列表在请求中多次出现时，除了第一次之外都只编码对其的引用，
+                            此时参数中可以包含循环引用
+        :param signature: 预先声明的方法签名，参见类：Signature
+        :param shapes: 用于缓存根据参数的结构生成的专用编码方法，参见方法：_encode_specialized
+        :param cache: 用于缓存整个请求，参见类：RequestCache
+        """
         self.__body = request
-        self.__classes = []
+        self.__signature = signature
+        self.__templates = templates
+        self.__shapes = shapes
+        self.__cache = cache
+        self.__classes = {}  # 已经定义过的类及其引用编号
+        # 已经编码过的对象/列表，根据id保存其引用编号
+        self.__references = {} if references else None
         self.types = []  # 泛型
         self.invoke_id = get_invoke_id()
+        # 以引用的方式保存的较大的二进制数据，及其在请求中的位置，参见方法：encode_segments
+        self.__segments = None
+        self.__spill = None  # 保存已经编码好的数据的临时文件
 
     def encode(self):
         """
         把请求序列化为字节数组
         :return:
         """
-        request_body = self._encode_request_body()
-        invoke_id = list(bytearray(struct.pack('!q', self.invoke_id)))
-        request_head = DEFAULT_REQUEST_META + invoke_id + get_request_body_length(request_body)
-        return bytearray(request_head + request_body)
+        buf = bytearray()
+        self.encode_into(buf)
+        return buf
+
+    def encode_into(self, buf):
+        """
+        把请求序列化之后追加到buf的末尾，所有的数据都直接写入buf中，
+        请求体的长度在序列化完成之后回填到头部
+        :param buf: bytearray
+        :return: 此次写入的字节数
+        """
+        start = len(buf)
+        cache_key = self._get_cache_key() if self.__cache is not None else None
+        if cache_key is not None:
+            data = self.__cache.get(cache_key)
+            if data is not None:
+                # 只需要替换请求id
+                buf += data
+                struct.pack_into('!q', buf, start + 4, self.invoke_id)
+                return len(data)
+        buf.extend(DEFAULT_REQUEST_META)
+        buf += struct.pack('!q', self.invoke_id)
+        buf += BODY_LENGTH_PLACEHOLDER
+        self._encode_request_body(buf)
+        if self.__spill is not None:
+            # 请求的前一部分已经写入了临时文件，此时把剩下的数据也写入临时文件
+            self._spill(buf)
+            length = self.__spill.tell()
+            self.__spill.seek(12)
+            self.__spill.write(struct.pack('!i', length - 16))
+            self.__spill.seek(0)
+            return length
+        length = len(buf) - start
+        if self.__segments:
+            length += sum(len(segment) for _, segment in self.__segments)
+        # 头部的最后4个字节为请求体的长度
+        struct.pack_into('!i', buf, start + 12, length - 16)
+        if cache_key is not None:
+            self.__cache.put(cache_key, str(buf[start:]))
+        return length
+
+    def _get_cache_key(self):
+        """
+        得到请求在缓存中的键，参数中包含可变的值时不能缓存
+        :return: 不能缓存时返回None
+        """
+        body = self.__body
+        arguments = tuple(body['arguments'])
+        types = tuple(map(type, arguments))
+        if _SCALAR_TYPES_SET.issuperset(types):
+            arguments = types, arguments
+        else:
+            arguments = _get_immutable_key(arguments)
+            if arguments is None:
+                return None
+        return (body['dubbo_version'], body['path'], body['version'], body['method'],
+                self.__signature, arguments)
+
+    def encode_segments(self):
+        """
+        把请求序列化为多个分段，较大的二进制数据不会被复制到请求中，而是直接作为单独的分段；
+        参数中的迭代器所产生的数据较多时，请求会被分块写入临时文件，之后再从临时文件中逐块读取
+        :return: 分段的列表，按顺序写入所有的分段即为完整的请求；每个分段为一个buffer或者一个产生buffer的迭代器
+        """
+        buf = bytearray()
+        self.__segments = []
+        try:
+            self.encode_into(buf)
+            segments, spill = self.__segments, self.__spill
+        except Exception:
+            if self.__spill is not None:
+                self.__spill.close()
+            raise
+        finally:
+            self.__segments = self.__spill = None
+        if spill is not None:
+            return [_read_chunks(spill)]
+
+        view = memoryview(buf)
+        result = []
+        position = 0
+        for offset, segment in segments:
+            if offset > position:
+                result.append(view[position:offset])
+            result.append(segment)
+            position = offset
+        result.append(view[position:])
+        return result
 
     def _get_parameter_types(self, arguments):
         """
@@ -120,35 +446,17 @@ class Request(object):
     def _get_class_name(self, _class):
         """
         根据一个字段的类型得到其在Java中对应类的全限定名
-        转换规则：https://stackoverflow.com/a/3442100/4614538
         :param _class:
         :return:
         """
-        if isinstance(_class, bool):  # bool类型的判断必须放在int类型判断的前面
-            return 'Z'
-        elif isinstance(_class, int):
-            if MIN_INT_32 <= _class <= MAX_INT_32:
-                return 'I'
-            else:
-                return 'J'
-        elif isinstance(_class, float):
-            return 'D'
-        elif isinstance(_class, (str, unicode)):
-            return 'L' + 'java/lang/String' + ';'
-        elif isinstance(_class, Object):
-            path = _class.get_path()
-            path = 'L' + path.replace('.', '/') + ';'
-            return path
-        elif isinstance(_class, list):
-            if len(_class) == 0:
-                raise HessianTypeError('Method parameter {} is a list but length is zero'.format(_class))
-            return '[' + self._get_class_name(_class[0])
-        else:
-            raise HessianTypeError('Unknown argument type: {0}'.format(_class))
+        get_class_name = _CLASS_NAMES.get(type(_class)) or _find_by_type(_CLASS_NAMES, _class,
+                                                                         'Unknown argument type')
+        return get_class_name(self, _class)
 
-    def _encode_request_body(self):
+    def _encode_request_body(self, buf):
         """
         对所有的已知的参数根据dubbo协议进行编码
+        :param buf:
         :return:
         """
         dubbo_version = self.__body['dubbo_version']
@@ -157,14 +465,77 @@ class Request(object):
         method = self.__body['method']
         arguments = self.__body['arguments']
 
-        body = []
-        body.extend(self._encode_single_value(dubbo_version))
-        body.extend(self._encode_single_value(path))
-        body.extend(self._encode_single_value(version))
-        body.extend(self._encode_single_value(method))
-        body.extend(self._encode_single_value(self._get_parameter_types(arguments)))
+        signature = self.__signature
+        if signature is None:
+            parameter_types = self._get_parameter_types(arguments)
+        else:
+            if len(arguments) != len(signature.encoders):
+                raise HessianTypeError('Method {0}{1} takes {2} arguments but {3} were given'.format(
+                    method, signature, len(signature.encoders), len(arguments)))
+            parameter_types = signature.parameter_types
+        key = (dubbo_version, path, version, method, parameter_types)
+        templates = self.__templates
+        if templates is None:
+            prefix, suffix = self._encode_template(*key)
+        elif key in templates:
+            prefix, suffix = templates[key]
+        else:
+            prefix, suffix = templates[key] = self._encode_template(*key)
+
+        buf += prefix
+        if signature is not None:
+            for encoder, argument in zip(signature.encoders, arguments):
+                encoder(self, buf, argument)
+        elif self.__shapes is not None and self.__references is None:
+            self._encode_specialized(buf, key, arguments)
+        else:
+            for argument in arguments:
+                self._encode_single_value(buf, argument)
+        buf += suffix
+
+    def _encode_specialized(self, buf, key, arguments):
+        """
+        同一个方法使用相同结构(类型、对象的字段等)的参数连续调用多次之后，为这种结构生成专用的编码方法，
+        专用的编码方法中不再需要根据类型查找编码方法；参数的结构发生变化时则回退到通用的编码方式
+        :param buf:
+        :param key: 方法的标识
+        :param arguments:
+        :return:
+        """
+        entry = self.__shapes.get(key)
+        # 同一个客户端的多个线程共用entry，其它线程可能同时把entry.encode置为None，所以只读取一次
+        encode = entry.encode if entry is not None else None
+        if encode is not None:
+            if encode(self, buf, arguments, self.__classes):
+                return
+            entry.misses += 1
+            entry.encode = None
+            entry.count = 0
+        if entry is None or entry.misses <= _SPECIALIZE_MAX_MISSES:
+            shape = tuple(_get_shape(argument) for argument in arguments)
+            if entry is None:
+                entry = self.__shapes[key] = _ShapeEntry(shape)
+            elif entry.shape != shape:
+                entry.shape, entry.count = shape, 1
+            else:
+                entry.count += 1
+                if entry.count >= _SPECIALIZE_THRESHOLD:
+                    entry.encode = _compile_shape(shape)
         for argument in arguments:
-            body.extend(self._encode_single_value(argument))
+            self._encode_single_value(buf, argument)
+
+    def _encode_template(self, dubbo_version, path, version, method, parameter_types):
+        """
+        对于同一个方法的同一种参数类型，请求体中除了参数之外的部分都是固定不变的，
+        这一部分只需要编码一次即可
+        :return: 参数之前的前缀以及参数之后的attachments
+        """
+        prefix = bytearray()
+        self._encode_single_value(prefix, dubbo_version)
+        self._encode_single_value(prefix, path)
+        self._encode_single_value(prefix, version)
+        self._encode_single_value(prefix, method)
+        self._encode_single_value(prefix, parameter_types)
 
         attachments = {
             'path': path,
@@ -172,271 +543,1431 @@ class Request(object):
             'version': version
         }
         # attachments参数以H开头，以Z结尾
-        body.append(ord('H'))
+        suffix = bytearray()
+        suffix.append(ord('H'))
         for key in attachments.keys():
             value = attachments[key]
-            body.extend(self._encode_single_value(key))
-            body.extend(self._encode_single_value(value))
-        body.append(ord('Z'))
-
-        # 因为在上面的逻辑中没有对byte大小进行检测，所以在这里进行统一的处理
-        for i in xrange(len(body)):
-            body[i] = body[i] & 0xff
-        return body
+            self._encode_single_value(suffix, key)
+            self._encode_single_value(suffix, value)
+        suffix.append(ord('Z'))
+        return str(prefix), str(suffix)
 
     @staticmethod
-    def _encode_bool(value):
+    def _encode_bool(buf, value):
         """
         对bool类型进行编码
+        :param buf:
         :param value:
         :return:
         """
-        result = []
         if value:
-            result.append(ord('T'))
+            buf.append(ord('T'))
         else:
-            result.append(ord('F'))
-        return result
+            buf.append(ord('F'))
 
     @staticmethod
-    def _encode_int(value):
+    def _encode_int(buf, value):
         """
         对整数进行编码
+        :param buf:
         :param value:
         :return:
         """
-        result = []
         # 超出int类型范围的值则转化为long类型
         # 这里问题在于对于落在int范围内的数字，我们无法判断其是long类型还是int类型，所以一律认为其是int类型
         if value > MAX_INT_32 or value < MIN_INT_32:
-            result.append(ord('L'))
-            result.extend(list(bytearray(struct.pack('!q', value))))
-            return result
+            buf.append(ord('L'))
+            buf += struct.pack('!q', value)
+            return
 
         if -0x10 <= value <= 0x2f:
-            result.append(value + 0x90)
+            buf.append(value + 0x90)
         elif -0x800 <= value <= 0x7ff:
-            result.append(0xc8 + (value >> 8))
-            result.append(value)
+            buf.append(0xc8 + (value >> 8))
+            buf.append(value & 0xff)
         elif -0x40000 <= value <= 0x3ffff:
-            result.append(0xd4 + (value >> 16))
-            result.append(value >> 8)
-            result.append(value)
+            buf.append(0xd4 + (value >> 16))
+            buf.append((value >> 8) & 0xff)
+            buf.append(value & 0xff)
         else:
-            result.append(ord('I'))
-            result.append(value >> 24)
-            result.append(value >> 16)
-            result.append(value >> 8)
-            result.append(value)
-        return result
+            buf.append(ord('I'))
+            buf += struct.pack('!i', value)
 
     @staticmethod
-    def _encode_float(value):
+    def _encode_long(buf, value):
+        """
+        使用Hessian中long类型的编码对整数进行编码，
+        Java中集合的元素没有声明的类型，只有这样编码的数字才会被当做Long
+        :param buf:
+        :param value:
+        :return:
+        """
+        if -0x08 <= value <= 0x0f:
+            buf.append(value + 0xe0)
+        elif -0x800 <= value <= 0x7ff:
+            buf.append(0xf8 + (value >> 8))
+            buf.append(value & 0xff)
+        elif -0x40000 <= value <= 0x3ffff:
+            buf.append(0x3c + (value >> 16))
+            buf.append((value >> 8) & 0xff)
+            buf.append(value & 0xff)
+        elif MIN_INT_32 <= value <= MAX_INT_32:
+            buf.append(0x59)
+            buf += struct.pack('!i', value)
+        else:
+            buf.append(ord('L'))
+            buf += struct.pack('!q', value)
+
+    @staticmethod
+    def _encode_float(buf, value):
         """
         对浮点类型进行编码
+        :param buf:
         :param value:
         :return:
         """
-        result = []
         int_value = int(value)
         if int_value == value:
             if int_value == 0:
-                result.append(0x5b)
-                return result
+                buf.append(0x5b)
+                return
             elif int_value == 1:
-                result.append(0x5c)
-                return result
+                buf.append(0x5c)
+                return
             elif -0x80 <= int_value < 0x80:
-                result.append(0x5d)
-                result.append(int_value)
-                return result
+                buf.append(0x5d)
+                buf.append(int_value & 0xff)
+                return
             elif -0x8000 <= int_value < 0x8000:
-                result.append(0x5e)
-                result.append(int_value >> 8)
-                result.append(int_value)
-                return result
+                buf.append(0x5e)
+                buf += struct.pack('!h', int_value)
+                return
 
         mills = int(value * 1000)
         if 0.001 * mills == value and MIN_INT_32 <= mills <= MAX_INT_32:
-            result.append(0x5f)
-            result.append(mills >> 24)
-            result.append(mills >> 16)
-            result.append(mills >> 8)
-            result.append(mills)
-            return result
-
-        bits = double_to_long_bits(value)
-        result.append(ord('D'))
-        result.append(bits >> 56)
-        result.append(bits >> 48)
-        result.append(bits >> 40)
-        result.append(bits >> 32)
-        result.append(bits >> 24)
-        result.append(bits >> 16)
-        result.append(bits >> 8)
-        result.append(bits)
-        return result
+            buf.append(0x5f)
+            buf += struct.pack('!i', mills)
+            return
+
+        buf.append(ord('D'))
+        buf += struct.pack('!d', value)
 
     @staticmethod
-    def _encode_utf(value):
+    def _encode_str(buf, value):
         """
-        对字符串进行编码，编码格式utf-8
-        参见方法：com.alibaba.com.caucho.hessian.io.Hessian2Output#printString
+        对一个字符串进行编码，字符串的长度为其在Java中UTF-16编码的长度，
+        超过0xffff的字符串需要分块，除了最后一块之外其它每块都以R开头
+        参见方法：com.alibaba.com.caucho.hessian.io.Hessian2Output#writeString
+        :param buf:
         :param value:
         :return:
         """
-        result = []
-        for v in value:
-            ch = ord(v)
-            if ch < 0x80:
-                result.append(ch & 0xff)
-            elif ch < 0x800:
-                result.append((0xc0 + ((ch >> 6) & 0x1f)) & 0xff)
-                result.append((0x80 + (ch & 0x3f)) & 0xff)
+        # 在进行网络传输操作时一律使用utf-8编码的str进行操作
+        if isinstance(value, unicode):
+            chars = len(value)
+            data = value.encode('utf-8')
+        else:
+            chars = len(value.decode('utf-8'))  # 同时校验str是否为合法的utf-8编码
+            data = value
+
+        if chars == len(data):  # 只包含ASCII字符
+            length = chars
+        else:
+            for lead in _SUPPLEMENTARY_CHAR_LEADS:
+                if lead in data:
+                    data = _encode_surrogate_pairs(data)
+                    break
+            length = len(data.translate(None, _UTF8_CONTINUATION_BYTES))
+
+        offset = 0
+        while length > 0xffff:
+            if length == len(data) - offset:
+                end = offset + 0x8000
             else:
-                result.append((0xe0 + ((ch >> 12) & 0xf)) & 0xff)
-                result.append((0x80 + ((ch >> 6) & 0x3f)) & 0xff)
-                result.append((0x80 + (ch & 0x3f)) & 0xff)
-        return result
+                end = _STRING_CHUNK.match(data, offset).end()
+            sub_length = 0x8000
+            # 分块不能在一个代理对的中间断开
+            if data[end - 3] == '\xed' and '\xa0' <= data[end - 2] <= '\xaf':
+                end -= 3
+                sub_length -= 1
+            buf.append(0x52)
+            buf += struct.pack('!H', sub_length)
+            buf += buffer(data, offset, end - offset)
+            offset = end
+            length -= sub_length
 
-    def _encode_str(self, value):
-        """
-        对一个字符串进行编码
-        :param value:
-        :return:
-        """
-        result = []
-        # 在进行网络传输操作时一律使用unicode进行操作
-        if isinstance(value, str):
-            value = value.decode('utf-8')
-        length = len(value)
         if length <= 0x1f:
-            result.append(0x00 + length)
+            buf.append(0x00 + length)
         elif length <= 0x3ff:
-            result.append(0x30 + (length >> 8))
-            result.append(length)
+            buf.append(0x30 + (length >> 8))
+            buf.append(length & 0xff)
         else:
-            result.append(ord('S'))
-            result.append(length >> 8)
-            result.append(length)
-
-        result.extend(self._encode_utf(value))
-        return result
+            buf.append(ord('S'))
+            buf += struct.pack('!H', length)
+        if offset:
+            buf += buffer(data, offset)
+        else:
+            buf += data
 
-    def _encode_object(self, value):
+    def _encode_object(self, buf, value):
         """
-        对一个对象进行编码
+        对一个对象进行编码，字段名不同的同一个类会被定义为不同的类
+        :param buf:
         :param value:
         :return:
         """
-        result = []
+        if self._encode_reference(buf, value):
+            return
         path = value.get_path()
         field_names = value.keys()
+        key = (path, tuple(field_names))
 
-        if path not in self.__classes:
-            result.append(ord('C'))
-            result.extend(self._encode_single_value(path))
+        class_id = self.__classes.get(key)
+        if class_id is None:
+            class_id = self.__classes[key] = len(self.__classes)
+            buf.append(ord('C'))
+            self._encode_single_value(buf, path)
 
-            result.extend(self._encode_single_value(len(field_names)))
+            self._encode_single_value(buf, len(field_names))
 
             for field_name in field_names:
-                result.extend(self._encode_single_value(field_name))
-            self.__classes.append(path)
-        class_id = self.__classes.index(path)
+                self._encode_single_value(buf, field_name)
+        self._encode_class_id(buf, class_id)
+        for field_name in field_names:
+            self._encode_single_value(buf, value[field_name])
+
+    def _encode_defined_object(self, buf, value):
+        """
+        对一个通过Object.define定义的类的对象进行编码，类定义只需要复制预先编码好的字节
+        :param buf:
+        :param value:
+        :return:
+        """
+        if self._encode_reference(buf, value):
+            return
+        cls = type(value)
+        class_id = self.__classes.get(cls)
+        if class_id is None:
+            class_id = self.__classes[cls] = len(self.__classes)
+            buf += cls._definition
+        self._encode_class_id(buf, class_id)
+        for field_name in cls._field_names:
+            self._encode_single_value(buf, getattr(value, field_name))
+
+    def _encode_reference(self, buf, value):
+        """
+        在Hessian中每一个对象/列表/字典都按照出现的顺序拥有一个引用编号，
+        如果当前的值之前已经被编码过了，则只需要写入对其的引用(0x51)
+        :param buf:
+        :param value:
+        :return: 是否写入了引用
+        """
+        references = self.__references
+        if references is None:
+            return False
+        reference = references.get(id(value))
+        if reference is not None:
+            buf.append(0x51)
+            self._encode_int(buf, reference[0])
+            return True
+        # 同时保存value本身，保证在编码的过程中其id不会被重复使用
+        references[id(value)] = len(references), value
+        return False
+
+    def _encode_class_id(self, buf, class_id):
+        """
+        对象的头部为其类的引用编号
+        :param buf:
+        :param class_id:
+        :return:
+        """
         if class_id <= 0xf:
-            class_id += 0x60
-            class_id &= 0xff
-            result.append(class_id)
+            buf.append(0x60 + class_id)
         else:
-            result.append(ord('O'))
-            result.extend(self._encode_single_value(class_id))
-        for field_name in field_names:
-            result.extend(self._encode_single_value(value[field_name]))
-        return result
+            buf.append(ord('O'))
+            self._encode_int(buf, class_id)
 
-    def _encode_list(self, value):
+    def _encode_list(self, buf, value):
         """
         对一个列表进行编码
+        :param buf:
         :param value:
         :return:
         """
-        result = []
         length = len(value)
         if length == 0:
             # 没有值则无法判断类型，一律返回null
-            return self._encode_single_value(None)
+            self._encode_single_value(buf, None)
+            return
+        if self._encode_reference(buf, value):
+            return
+        if type(value[0]) in (int, long, float):
+            self._encode_numbers(buf, value)
+            return
         if isinstance(value[0], bool):
             _type = '[boolean'
-        elif isinstance(value[0], int):
-            _type = '[int'
-        elif isinstance(value[0], float):
-            _type = '[double'
-        elif isinstance(value[0], str):
+        elif isinstance(value[0], (str, unicode)):
             _type = '[string'
-        elif isinstance(value[0], Object):
+        elif isinstance(value[0], (Object, DefinedObject)):
             _type = '[object'
         else:
-            raise HessianTypeError('Unknown list type: {}'.format(value[0]))
-        if length < 0x7:
-            result.append(0x70 + length)
-            if _type not in self.types:
-                self.types.append(_type)
-                result.extend(self._encode_single_value(_type))
-            else:
-                result.extend(self._encode_single_value(self.types.index(_type)))
-        else:
-            result.append(0x56)
-            if _type not in self.types:
-                self.types.append(_type)
-                result.extend(self._encode_single_value(_type))
-            else:
-                result.extend(self._encode_single_value(self.types.index(_type)))
-            result.extend(self._encode_single_value(length))
+            # 其它类型的元素使用无类型的列表
+            self._encode_untyped_list(buf, value)
+            return
+        self._encode_list_head(buf, _type, length)
         for v in value:
             if type(value[0]) != type(v):
                 raise HessianTypeError('All elements in list must be the same type, first type'
                                        ' is {0} but current type is {1}'.format(type(value[0]), type(v)))
-            result.extend(self._encode_single_value(v))
-        return result
+            self._encode_single_value(buf, v)
+
+    def _encode_untyped_list(self, buf, value, encode=None):
+        """
+        对一个无类型的列表进行编码，在Java中对应java.util.ArrayList
+        :param buf:
+        :param value:
+        :param encode: 元素的编码方法，参数为(request, buf, value)，默认使用通用的编码方式
+        :return:
+        """
+        length = len(value)
+        if length < 0x8:
+            buf.append(0x78 + length)
+        else:
+            buf.append(0x58)
+            self._encode_int(buf, length)
+        if encode is None:
+            for v in value:
+                self._encode_single_value(buf, v)
+        else:
+            for v in value:
+                encode(self, buf, v)
+
+    def _encode_tuple(self, buf, value):
+        """
+        对一个tuple进行编码，tuple会被当做java.util.ArrayList
+        :param buf:
+        :param value:
+        :return:
+        """
+        if self._encode_reference(buf, value):
+            return
+        self._encode_untyped_list(buf, value)
+
+    def _encode_set(self, buf, value):
+        """
+        对一个set进行编码，set会被当做java.util.HashSet
+        :param buf:
+        :param value:
+        :return:
+        """
+        if self._encode_reference(buf, value):
+            return
+        self._encode_list_head(buf, 'java.util.HashSet', len(value))
+        for v in value:
+            self._encode_single_value(buf, v)
+
+    def _encode_map(self, buf, value):
+        """
+        对一个dict进行编码，dict会被当做java.util.HashMap
+        :param buf:
+        :param value:
+        :return:
+        """
+        if self._encode_reference(buf, value):
+            return
+        buf.append(ord('H'))
+        for k, v in value.iteritems():
+            self._encode_single_value(buf, k)
+            self._encode_single_value(buf, v)
+        buf.append(ord('Z'))
+
+    def _encode_decimal(self, buf, value):
+        """
+        对一个Decimal进行编码，Decimal会被当做java.math.BigDecimal，其唯一的字段value为数字的字符串表示
+        :param buf:
+        :param value:
+        :return:
+        """
+        self._encode_defined_object(buf, _BigDecimal(str(value)))
+
+    @staticmethod
+    def _encode_date(buf, value):
+        """
+        对一个日期进行编码，没有时区的日期(datetime/date)被当做本地时间
+        :param buf:
+        :param value:
+        :return:
+        """
+        if isinstance(value, datetime) and value.tzinfo is not None:
+            seconds = calendar.timegm(value.utctimetuple())
+        else:
+            seconds = time.mktime(value.timetuple())
+        millis = int(seconds) * 1000
+        if isinstance(value, datetime):
+            millis += value.microsecond // 1000
+        # 整分钟的时间使用4个字节表示
+        if millis % 60000 == 0 and MIN_INT_32 <= millis // 60000 <= MAX_INT_32:
+            buf.append(0x4b)
+            buf += struct.pack('!i', millis // 60000)
+        else:
+            buf.append(0x4a)
+            buf += struct.pack('!q', millis)
+
+    def _encode_binary(self, buf, value):
+        """
+        对二进制数据进行编码，超过0x8000个字节的数据被分为多个分块
+        :param buf:
+        :param value: Binary, bytearray, memoryview或者buffer
+        :return:
+        """
+        data = _to_buffer(value.data if isinstance(value, Binary) else value)
+        length = len(data)
+        segments = self.__segments if length >= _BINARY_SEGMENT_MIN_SIZE else None
+        offset = 0
+        while length - offset > 0x8000:
+            buf.append(0x41)
+            buf += '\x80\x00'
+            _write_binary(buf, data, offset, 0x8000, segments)
+            offset += 0x8000
+        remaining = length - offset
+        if remaining < 0x10:
+            buf.append(0x20 + remaining)
+        elif remaining < 0x400:
+            buf.append(0x34 + (remaining >> 8))
+            buf.append(remaining & 0xff)
+        else:
+            buf.append(0x42)
+            buf += struct.pack('!H', remaining)
+        _write_binary(buf, data, offset, remaining, segments)
 
-    def _encode_single_value(self, value):
+    def _encode_iterator(self, buf, value, encode=None):
         """
-        根据hessian协议对单个变量进行编码
+        对一个迭代器进行编码，迭代器会被当做长度可变的java.util.ArrayList，
+        在分段编码时每产生_STREAM_CHUNK_SIZE字节的数据就写入临时文件，不需要在内存中保存全部的数据
+        :param buf:
         :param value:
+        :param encode: 元素的编码方法，参数为(request, buf, value)，默认使用通用的编码方式
+        :return:
+        """
+        if self._encode_reference(buf, value):
+            return
+        buf.append(0x57)
+        streaming = self.__segments is not None
+        for v in value:
+            if encode is None:
+                self._encode_single_value(buf, v)
+            else:
+                encode(self, buf, v)
+            if streaming and len(buf) >= _STREAM_CHUNK_SIZE:
+                self._spill(buf)
+        buf.append(ord('Z'))
+
+    def _spill(self, buf):
+        """
+        把buf中的数据以及以引用的方式保存的二进制数据按顺序写入临时文件，之后清空buf
+        :param buf:
         :return:
         """
-        # 布尔类型
-        if isinstance(value, bool):
-            return self._encode_bool(value)
-        # 整型（包括长整型）
-        elif isinstance(value, int):
-            return self._encode_int(value)
-        # 浮点类型
-        elif isinstance(value, float):
-            return self._encode_float(value)
-        # 字符串类型
-        elif isinstance(value, (str, unicode)):
-            return self._encode_str(value)
-        # 对象类型
-        elif isinstance(value, Object):
-            return self._encode_object(value)
-        # 列表(list)类型，不可以使用tuple替代
-        elif isinstance(value, list):
-            return self._encode_list(value)
-        # null
+        if self.__spill is None:
+            self.__spill = tempfile.TemporaryFile()
+        position = 0
+        for offset, segment in self.__segments:
+            self.__spill.write(buffer(buf, position, offset - position))
+            self.__spill.write(segment)
+            position = offset
+        self.__spill.write(buffer(buf, position))
+        del self.__segments[:]
+        del buf[:]
+
+    def _encode_list_head(self, buf, _type, length):
+        """
+        对有类型的固定长度列表的头部进行编码
+        :param buf:
+        :param _type:
+        :param length:
+        :return:
+        """
+        if length < 0x7:
+            buf.append(0x70 + length)
+        else:
+            buf.append(0x56)
+        if _type not in self.types:
+            self.types.append(_type)
+            self._encode_single_value(buf, _type)
+        else:
+            self._encode_single_value(buf, self.types.index(_type))
+        if length >= 0x7:
+            self._encode_single_value(buf, length)
+
+    def _encode_numbers(self, buf, value):
+        """
+        把数字列表、array.array以及numpy数组编码为Java的基本类型数组，所有的元素一次性进行编码，
+        编码的结果与逐个元素进行编码的结果完全一致
+        :param buf:
+        :param value:
+        :return:
+        """
+        length = len(value)
+        if length == 0:
+            self._encode_single_value(buf, None)
+            return
+        if not isinstance(value, list) and self._encode_reference(buf, value):
+            return
+        kind, values = _get_number_kind(value)
+        if kind is None:
+            # 混合了不同类型的元素的列表使用无类型的列表
+            self._encode_untyped_list(buf, value)
+            return
+        self._encode_list_head(buf, '[' + kind, length)
+        if kind == 'double':
+            self._encode_double_array(buf, values)
+        else:
+            self._encode_int_array(buf, values)
+
+    @staticmethod
+    def _encode_int_array(buf, values):
+        """
+        对整数数组中的所有元素进行编码，参见方法：_encode_int
+        :param buf:
+        :param values: list, array.array或者numpy数组
+        :return:
+        """
+        if numpy is not None and isinstance(values, numpy.ndarray):
+            buf += _encode_numpy_ints(values)
+            return
+        lo, hi = min(values), max(values)
+        if -0x10 <= lo and hi <= 0x2f:
+            buf += bytearray(map((0x90).__add__, values))
+            return
+        # 所有的元素都使用定长的编码
+        if lo > 0x3ffff or hi < -0x40000:
+            if MIN_INT_32 <= lo and hi <= MAX_INT_32:
+                buf += _interleave(ord('I'), struct.pack('!{}i'.format(len(values)), *values), 4)
+                return
+            elif lo > MAX_INT_32 or hi < MIN_INT_32:
+                buf += _interleave(ord('L'), struct.pack('!{}q'.format(len(values)), *values), 8)
+                return
+
+        append = buf.append
+        pack = struct.pack
+        for value in values:
+            if -0x10 <= value <= 0x2f:
+                append(value + 0x90)
+            elif -0x800 <= value <= 0x7ff:
+                append(0xc8 + (value >> 8))
+                append(value & 0xff)
+            elif -0x40000 <= value <= 0x3ffff:
+                append(0xd4 + (value >> 16))
+                append((value >> 8) & 0xff)
+                append(value & 0xff)
+            elif MIN_INT_32 <= value <= MAX_INT_32:
+                append(0x49)
+                buf += pack('!i', value)
+            else:
+                append(0x4c)
+                buf += pack('!q', value)
+
+    @staticmethod
+    def _encode_double_array(buf, values):
+        """
+        对浮点数数组中的所有元素进行编码，参见方法：_encode_float
+        :param buf:
+        :param values: list, array.array或者numpy数组
+        :return:
+        """
+        if numpy is not None and isinstance(values, numpy.ndarray):
+            buf += _encode_numpy_doubles(values)
+            return
+        packed = struct.pack('!{}d'.format(len(values)), *values)
+        append = buf.append
+        pack = struct.pack
+        offset = 0
+        for value in values:
+            int_value = int(value)
+            if int_value == value and -0x8000 <= int_value < 0x8000:
+                if int_value == 0:
+                    append(0x5b)
+                elif int_value == 1:
+                    append(0x5c)
+                elif -0x80 <= int_value < 0x80:
+                    append(0x5d)
+                    append(int_value & 0xff)
+                else:
+                    append(0x5e)
+                    buf += pack('!h', int_value)
+            else:
+                mills = int(value * 1000)
+                if 0.001 * mills == value and MIN_INT_32 <= mills <= MAX_INT_32:
+                    append(0x5f)
+                    buf += pack('!i', mills)
+                else:
+                    append(0x44)
+                    buf += packed[offset:offset + 8]
+            offset += 8
+
+    def _encode_single_value(self, buf, value):
+        """
+        根据hessian协议对单个变量进行编码，编码的结果直接写入buf中
+        :param buf:
+        :param value:
+        :return:
+        """
+        encoder = _ENCODERS.get(type(value)) or _find_by_type(_ENCODERS, value, 'Unknown argument type')
+        encoder(self, buf, value)
+
+
+def register_encoder(_type, encoder, class_name=None):
+    """
+    注册自定义类型的编码方式，编码时先使用encoder把值转化为可以编码的值(例如Object)，之后再对转化后的值进行编码
+    :param _type: Python中的类型，其子类同样会使用此编码方式
+    :param encoder: 转化值的函数，例如：lambda value: str(value)
+    :param class_name: 作为方法参数时在Java中对应的类的全限定名，例如java.util.UUID；为None时根据转化后的值确定
+    :return:
+    """
+    _REGISTERED_ENCODERS[_type] = lambda request, buf, value: request._encode_single_value(buf, encoder(value))
+    if class_name is None:
+        _REGISTERED_CLASS_NAMES[_type] = lambda request, value: request._get_class_name(encoder(value))
+    else:
+        class_name = 'L' + class_name.replace('.', '/') + ';'
+        _REGISTERED_CLASS_NAMES[_type] = lambda request, value: class_name
+    # 清除之前根据父类找到的编码方式
+    _ENCODERS.clear()
+    _ENCODERS.update(_REGISTERED_ENCODERS)
+    _CLASS_NAMES.clear()
+    _CLASS_NAMES.update(_REGISTERED_CLASS_NAMES)
+
+
+def _find_by_type(table, value, message):
+    """
+    类型在表中不存在时，按照继承的顺序查找其父类，找到之后缓存起来
+    :param table:
+    :param value:
+    :param message: 找不到时的错误信息
+    :return:
+    """
+    _type = type(value)
+    for base in getattr(_type, '__mro__', ()):
+        handler = table.get(base)
+        if handler is not None:
+            table[_type] = handler
+            return handler
+    # 抽象类(例如Iterator)需要使用isinstance进行判断
+    for base, handler in table.items():
+        if isinstance(base, ABCMeta) and isinstance(value, base):
+            table[_type] = handler
+            return handler
+    raise HessianTypeError('{0}: {1}'.format(message, value))
+
+
+def _static(func):
+    """
+    把静态的编码方法转化为和其它编码方法相同的形式
+    :param func:
+    :return:
+    """
+    return lambda request, buf, value: func(buf, value)
+
+
+def _get_int_class_name(request, value):
+    if MIN_INT_32 <= value <= MAX_INT_32:
+        return 'I'
+    else:
+        return 'J'
+
+
+def _get_list_class_name(request, value):
+    if len(value) == 0:
+        raise HessianTypeError('Method parameter {} is a list but length is zero'.format(value))
+    if type(value[0]) in (int, long, float):
+        kind = _get_number_kind(value)[0]
+        return 'Ljava/util/List;' if kind is None else _NUMBER_CLASS_NAMES[kind]
+    return '[' + request._get_class_name(value[0])
+
+
+_BigDecimal = Object.define('java.math.BigDecimal', ['value'])
+
+# 每种类型所对应的编码方法，编码方法的参数为(request, buf, value)
+_REGISTERED_ENCODERS = {
+    type(None): lambda request, buf, value: buf.append(ord('N')),
+    bool: _static(Request._encode_bool),
+    int: _static(Request._encode_int),
+    long: _static(Request._encode_int),
+    float: _static(Request._encode_float),
+    str: _static(Request._encode_str),
+    unicode: _static(Request._encode_str),
+    Object: Request._encode_object.im_func,
+    DefinedObject: Request._encode_defined_object.im_func,
+    # 列表(list)类型，tuple和set则被当做Java中的集合类
+    list: Request._encode_list.im_func,
+    tuple: Request._encode_tuple.im_func,
+    set: Request._encode_set.im_func,
+    frozenset: Request._encode_set.im_func,
+    dict: Request._encode_map.im_func,
+    datetime: _static(Request._encode_date),
+    date: _static(Request._encode_date),
+    Decimal: Request._encode_decimal.im_func,
+    array: Request._encode_numbers.im_func,
+    Binary: Request._encode_binary.im_func,
+    bytearray: Request._encode_binary.im_func,
+    memoryview: Request._encode_binary.im_func,
+    buffer: Request._encode_binary.im_func,
+    Iterator: Request._encode_iterator.im_func,
+}
+# 每种类型作为方法参数时在Java中对应的类名，转换规则：https://stackoverflow.com/a/3442100/4614538
+_REGISTERED_CLASS_NAMES = {
+    bool: lambda request, value: 'Z',
+    int: _get_int_class_name,
+    long: _get_int_class_name,
+    float: lambda request, value: 'D',
+    str: lambda request, value: 'Ljava/lang/String;',
+    unicode: lambda request, value: 'Ljava/lang/String;',
+    Object: lambda request, value: 'L' + value.get_path().replace('.', '/') + ';',
+    DefinedObject: lambda request, value: 'L' + value.get_path().replace('.', '/') + ';',
+    list: _get_list_class_name,
+    tuple: lambda request, value: 'Ljava/util/List;',
+    set: lambda request, value: 'Ljava/util/Set;',
+    frozenset: lambda request, value: 'Ljava/util/Set;',
+    dict: lambda request, value: 'Ljava/util/Map;',
+    datetime: lambda request, value: 'Ljava/util/Date;',
+    date: lambda request, value: 'Ljava/util/Date;',
+    Decimal: lambda request, value: 'Ljava/math/BigDecimal;',
+    array: lambda request, value: _NUMBER_CLASS_NAMES[_get_number_kind(value)[0]],
+    Binary: lambda request, value: '[B',
+    bytearray: lambda request, value: '[B',
+    memoryview: lambda request, value: '[B',
+    buffer: lambda request, value: '[B',
+    Iterator: lambda request, value: 'Ljava/util/List;',
+}
+if numpy is not None:
+    _REGISTERED_ENCODERS[numpy.ndarray] = Request._encode_numbers.im_func
+    _REGISTERED_CLASS_NAMES[numpy.ndarray] = _REGISTERED_CLASS_NAMES[array]
+# 包含了根据父类找到的类型
+_ENCODERS = dict(_REGISTERED_ENCODERS)
+_CLASS_NAMES = dict(_REGISTERED_CLASS_NAMES)
+
+
+def _to_buffer(data):
+    """
+    得到data的只读视图，不会复制data
+    :param data:
+    :return: memoryview或者buffer
+    """
+    if isinstance(data, memoryview):
+        return data
+    try:
+        return memoryview(data)
+    except TypeError:
+        # 例如mmap和array.array只支持旧的buffer协议
+        return buffer(data)
+
+
+def _write_binary(buf, data, offset, size, segments):
+    """
+    写入二进制数据中的一段
+    :param buf:
+    :param data: memoryview或者buffer
+    :param offset:
+    :param size:
+    :param segments: 不为None时不复制数据，只记录此段数据在请求中的位置
+    :return:
+    """
+    if isinstance(data, memoryview):
+        chunk = data[offset:offset + size]
+    else:
+        chunk = buffer(data, offset, size)
+    if segments is None:
+        buf += chunk
+    else:
+        segments.append((len(buf), chunk))
+
+
+def _get_immutable_key(value):
+    """
+    得到不可变的值用于缓存的键，键中包含了值的类型，避免1、1.0以及True被当做同一个值
+    :param value:
+    :return: 值是可变的时返回None
+    """
+    _type = type(value)
+    if _type in _SCALAR_TYPES:
+        return _type, value
+    if _type is tuple:
+        keys = tuple(_get_immutable_key(v) for v in value)
+        if None in keys:
+            return None
+        return tuple, keys
+    return None
+
+
+def _split_java_types(signature):
+    """
+    按照不在泛型中的逗号分割参数类型
+    :param signature: 例如：long, java.util.Map<String, Integer>
+    :return:
+    """
+    java_types = []
+    depth = start = 0
+    for i, char in enumerate(signature):
+        if char == '<':
+            depth += 1
+        elif char == '>':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            java_types.append(signature[start:i])
+            start = i + 1
+    if signature[start:].strip():
+        java_types.append(signature[start:])
+    if depth != 0 or any(not java_type.strip() for java_type in java_types):
+        raise HessianTypeError('Illegal method signature: {}'.format(signature))
+    return java_types
+
+
+def _get_raw_type(java_type):
+    """
+    去掉泛型，并且补全java.lang包中的类的包名
+    :param java_type: 例如：java.util.List<String>[]
+    :return: 例如：java.util.List[]
+    """
+    raw_type = re.sub(r'<.*>', '', java_type).replace(' ', '')
+    name = raw_type.rstrip('[]')
+    if name not in _PRIMITIVE_DESCRIPTORS and '.' not in name:
+        raw_type = 'java.lang.' + raw_type
+    return raw_type
+
+
+def _get_descriptor(java_type):
+    """
+    得到Java类型的描述符，例如：long -> J，String[] -> [Ljava/lang/String;
+    :param java_type:
+    :return:
+    """
+    raw_type = _get_raw_type(java_type)
+    name = raw_type.rstrip('[]')
+    dimensions = (len(raw_type) - len(name)) // 2
+    if name in _PRIMITIVE_DESCRIPTORS:
+        descriptor = _PRIMITIVE_DESCRIPTORS[name]
+    else:
+        descriptor = 'L' + name.replace('.', '/') + ';'
+    return '[' * dimensions + descriptor
+
+
+def _get_declared_encoder(java_type):
+    """
+    根据参数声明的类型得到校验以及编码参数的方法，
+    数组以及List/Set/Map的元素根据其声明的类型逐个进行校验和编码，其它的参数则使用通用的编码方式
+    :param java_type:
+    :return: 编码方法，参数为(request, buf, value)
+    """
+    java_type = java_type.strip()
+    raw_type = _get_raw_type(java_type)
+    if raw_type.endswith('[]'):
+        return _get_array_encoder(java_type, re.sub(r'\[\s*\]$', '', java_type).strip())
+    if raw_type in _LIST_TYPES or raw_type in _SET_TYPES:
+        return _get_collection_encoder(java_type, raw_type in _SET_TYPES)
+    if raw_type in _MAP_TYPES:
+        return _get_map_encoder(java_type)
+
+    name = _BOXED_TYPES.get(raw_type, raw_type)
+    if name in _INT_RANGES:
+        min_value, max_value = _INT_RANGES[name]
+
+        def check(value):
+            return type(value) in (int, long) and min_value <= value <= max_value
+        # 使用Long的编码，保证作为集合的元素时在Java中得到的是Long而不是Integer
+        encode = Request._encode_long if raw_type == 'java.lang.Long' else Request._encode_int
+    elif name in ('float', 'double'):
+        def check(value):
+            return type(value) in (int, long, float)
+
+        def encode(buf, value):
+            Request._encode_float(buf, float(value))
+    elif name == 'boolean':
+        def check(value):
+            return type(value) is bool
+        encode = Request._encode_bool
+    elif name == 'char':
+        def check(value):
+            if isinstance(value, str):
+                value = value.decode('utf-8')
+            return isinstance(value, unicode) and len(value) == 1
+        encode = Request._encode_str
+    elif name == 'java.lang.String':
+        def check(value):
+            return isinstance(value, (str, unicode))
+        encode = Request._encode_str
+    elif name == 'java.util.Date':
+        def check(value):
+            return isinstance(value, (datetime, date))
+        encode = Request._encode_date
+    else:
+        return _encode_generic
+
+    # 基本类型不能为null，其包装类型则可以
+    nullable = raw_type not in _PRIMITIVE_DESCRIPTORS
+
+    def encode_declared(request, buf, value):
+        if check(value):
+            encode(buf, value)
+        elif value is None and nullable:
+            buf.append(ord('N'))
+        else:
+            raise HessianTypeError('Argument {0!r} is not a valid {1}'.format(value, java_type))
+    return encode_declared
+
+
+def _encode_generic(request, buf, value):
+    """
+    没有声明类型的参数使用通用的编码方式
+    :param request:
+    :param buf:
+    :param value:
+    :return:
+    """
+    request._encode_single_value(buf, value)
+
+
+def _get_type_arguments(java_type):
+    """
+    得到泛型中的类型参数
+    :param java_type: 例如：java.util.Map<String, List<Long>>
+    :return: 例如：['String', 'List<Long>']，没有泛型时返回空列表
+    """
+    match = re.search(r'<(.*)>$', java_type)
+    if match is None:
+        return []
+    return [argument.strip() for argument in _split_java_types(match.group(1))]
+
+
+def _get_array_type(raw_type):
+    """
+    得到数组的元素在Hessian中的类型名称
+    :param raw_type: 例如：int, java.lang.String, java.lang.Integer[]
+    :return: 例如：int, string, [java.lang.Integer
+    """
+    if raw_type.endswith('[]'):
+        return '[' + _get_array_type(raw_type[:-2])
+    if raw_type in _PRIMITIVE_DESCRIPTORS:
+        return raw_type
+    return {'java.lang.String': 'string', 'java.lang.Object': 'object'}.get(raw_type, raw_type)
+
+
+def _get_array_encoder(java_type, element_type):
+    """
+    得到数组类型的参数的编码方法
+    :param java_type: 例如：long[]
+    :param element_type: 数组元素的类型，例如：long
+    :return: 编码方法，参数为(request, buf, value)
+    """
+    element_raw_type = _get_raw_type(element_type)
+    if element_raw_type == 'byte':
+        def encode_bytes(request, buf, value):
+            if isinstance(value, (Binary, bytearray, memoryview, buffer)):
+                request._encode_binary(buf, value)
+            elif value is None:
+                buf.append(ord('N'))
+            else:
+                raise HessianTypeError('Argument {0!r} is not a valid {1}'.format(value, java_type))
+        return encode_bytes
+    if element_raw_type in ('short', 'int', 'long', 'float', 'double'):
+        return _get_number_array_encoder(java_type, element_raw_type)
+    if element_raw_type == 'char':
+        # Java中的char[]被编码为字符串
+        def encode_chars(request, buf, value):
+            if isinstance(value, (str, unicode)):
+                request._encode_str(buf, value)
+            elif value is None:
+                buf.append(ord('N'))
+            else:
+                raise HessianTypeError('Argument {0!r} is not a valid {1}'.format(value, java_type))
+        return encode_chars
+
+    _type = '[' + _get_array_type(element_raw_type)
+    encode_element = _get_declared_encoder(element_type)
+
+    def encode_array(request, buf, value):
+        if isinstance(value, (list, tuple)):
+            if request._encode_reference(buf, value):
+                return
+            request._encode_list_head(buf, _type, len(value))
+            for v in value:
+                encode_element(request, buf, v)
+        elif value is None:
+            buf.append(ord('N'))
+        else:
+            raise HessianTypeError('Argument {0!r} is not a valid {1}'.format(value, java_type))
+    return encode_array
+
+
+def _get_number_array_encoder(java_type, name):
+    """
+    得到数字数组类型的参数的编码方法，校验所有的元素之后一次性进行编码
+    :param java_type: 例如：long[]
+    :param name: 基本类型，例如：long
+    :return: 编码方法，参数为(request, buf, value)
+    """
+    _type = '[' + name
+    if name in _INT_RANGES:
+        min_value, max_value = _INT_RANGES[name]
+        allowed_types = frozenset([int, long])
+        dtype = 'int64'
+        encode_values = Request._encode_int_array
+    else:
+        min_value = max_value = None
+        allowed_types = frozenset([int, long, float])
+        dtype = 'float64'
+        encode_values = Request._encode_double_array
+
+    def check(values):
+        if not set(map(type, values)) <= allowed_types:
+            return False
+        return min_value is None or not values or (min_value <= min(values) and max(values) <= max_value)
+
+    def encode_numbers(request, buf, value):
+        if value is None:
+            buf.append(ord('N'))
+            return
+        if isinstance(value, (list, tuple)):
+            values = value
+        elif isinstance(value, array) or (numpy is not None and isinstance(value, numpy.ndarray)):
+            values = value.tolist()
+        else:
+            raise HessianTypeError('Argument {0!r} is not a valid {1}'.format(value, java_type))
+        if not check(values):
+            invalid = next(v for v in values if not check([v]))
+            raise HessianTypeError('Element {0!r} of argument is not a valid {1}'.format(invalid, name))
+        if request._encode_reference(buf, value):
+            return
+        request._encode_list_head(buf, _type, len(values))
+        if not values:
+            return
+        if numpy is not None and len(values) >= _NUMPY_MIN_SIZE:
+            values = numpy.array(values, dtype=dtype)
+        encode_values(buf, values)
+    return encode_numbers
+
+
+def _get_collection_encoder(java_type, is_set):
+    """
+    得到List/Set类型的参数的编码方法，元素根据泛型中的类型进行校验以及编码
+    :param java_type: 例如：java.util.List<Long>
+    :param is_set: 是否为Set，Set被编码为java.util.HashSet，其它的集合被编码为java.util.ArrayList
+    :return: 编码方法，参数为(request, buf, value)
+    """
+    arguments = _get_type_arguments(java_type)
+    encode_element = _get_declared_encoder(arguments[0]) if len(arguments) == 1 else _encode_generic
+
+    def encode_collection(request, buf, value):
+        if isinstance(value, (list, tuple, set, frozenset)):
+            if request._encode_reference(buf, value):
+                return
+            if is_set:
+                request._encode_list_head(buf, 'java.util.HashSet', len(value))
+                for v in value:
+                    encode_element(request, buf, v)
+            else:
+                request._encode_untyped_list(buf, value, encode_element)
+        elif isinstance(value, Iterator) and not is_set:
+            request._encode_iterator(buf, value, encode_element)
+        elif value is None:
+            buf.append(ord('N'))
+        else:
+            raise HessianTypeError('Argument {0!r} is not a valid {1}'.format(value, java_type))
+    return encode_collection
+
+
+def _get_map_encoder(java_type):
+    """
+    得到Map类型的参数的编码方法，键和值根据泛型中的类型进行校验以及编码
+    :param java_type: 例如：java.util.Map<String, Long>
+    :return: 编码方法，参数为(request, buf, value)
+    """
+    arguments = _get_type_arguments(java_type)
+    if len(arguments) == 2:
+        encode_key, encode_value = map(_get_declared_encoder, arguments)
+    else:
+        encode_key = encode_value = _encode_generic
+
+    def encode_map(request, buf, value):
+        if isinstance(value, dict):
+            if request._encode_reference(buf, value):
+                return
+            buf.append(ord('H'))
+            for k, v in value.iteritems():
+                encode_key(request, buf, k)
+                encode_value(request, buf, v)
+            buf.append(ord('Z'))
         elif value is None:
-            return [ord('N')]
+            buf.append(ord('N'))
+        else:
+            raise HessianTypeError('Argument {0!r} is not a valid {1}'.format(value, java_type))
+    return encode_map
+
+
+class _ShapeEntry(object):
+    """
+    一个方法最近一次调用时参数的结构，以及为这种结构生成的专用编码方法
+    """
+    __slots__ = ('shape', 'count', 'encode', 'misses')
+
+    def __init__(self, shape):
+        self.shape = shape
+        self.count = 1  # 连续使用这种结构调用的次数
+        self.encode = None
+        self.misses = 0  # 结构发生变化导致专用编码方法失效的次数
+
+
+def _get_shape(value):
+    """
+    得到一个值的结构，结构相同的值可以使用同一个专用编码方法
+    :param value:
+    :return: 基本类型为其类型；对象为(类型, 类名, 字段名, 字段的结构)；对象列表为(list, 元素的结构)；
+             其它的值一律使用通用的编码方式
+    """
+    _type = type(value)
+    if _type in _SCALAR_TYPES:
+        return _type
+    if _type is Object:
+        values = value._Object__values
+        field_names = tuple(values.keys())
+        return Object, value.get_path(), field_names, tuple(_get_shape(values[k]) for k in field_names)
+    if isinstance(value, DefinedObject):
+        return DefinedObject, _type, tuple(_get_shape(getattr(value, k)) for k in _type._field_names)
+    if _type is list and value and (type(value[0]) is Object or isinstance(value[0], DefinedObject)):
+        shape = _get_shape(value[0])
+        for v in value:
+            if _get_shape(v) != shape:
+                return _GENERIC_SHAPE
+        return list, shape
+    return _GENERIC_SHAPE
+
+
+def _compile_shape(shape):
+    """
+    根据参数的结构生成专用的编码方法，生成的方法先检查参数的结构，结构一致时才进行编码
+    :param shape: 所有参数的结构
+    :return: 编码方法，参数为(request, buf, arguments, classes)，参数的结构不一致时不写入任何数据并返回False
+    """
+    checks = []
+    encodes = []
+    constants = {
+        'Object': Object,
+        'encode_int': Request._encode_int,
+        'encode_float': Request._encode_float,
+        'encode_str': Request._encode_str,
+    }
+    counter = [0]
+
+    def constant(value):
+        name = 'c{}'.format(len(constants))
+        constants[name] = value
+        return name
+
+    def variable():
+        counter[0] += 1
+        return 'v{}'.format(counter[0])
+
+    def emit_check(value_shape, name, indent):
+        pad = ' ' * indent
+        if value_shape is _GENERIC_SHAPE:
+            return
+        if value_shape in _SCALAR_TYPES:
+            checks.append(pad + 'if type({}) is not {}:'.format(name, constant(value_shape)))
+            checks.append(pad + '    return False')
+        elif value_shape[0] is list:
+            element = variable()
+            checks.append(pad + 'if type({}) is not list:'.format(name))
+            checks.append(pad + '    return False')
+            checks.append(pad + 'for {} in {}:'.format(element, name))
+            emit_check(value_shape[1], element, indent + 4)
+        elif value_shape[0] is Object:
+            _, path, field_names, field_shapes = value_shape
+            values = variable()
+            checks.append(pad + 'if type({}) is not Object:'.format(name))
+            checks.append(pad + '    return False')
+            checks.append(pad + '{} = {}._Object__values'.format(values, name))
+            checks.append(pad + 'if {}.keys() != {}:'.format(values, constant(list(field_names))))
+            checks.append(pad + '    return False')
+            for field_name, field_shape in zip(field_names, field_shapes):
+                emit_check(field_shape, '{}[{!r}]'.format(values, field_name), indent)
+        else:
+            _, cls, field_shapes = value_shape
+            checks.append(pad + 'if type({}) is not {}:'.format(name, constant(cls)))
+            checks.append(pad + '    return False')
+            for field_name, field_shape in zip(cls._field_names, field_shapes):
+                emit_check(field_shape, '{}.{}'.format(name, field_name), indent)
+
+    def emit_encode(value_shape, name, indent):
+        pad = ' ' * indent
+
+        def write(line):
+            encodes.append(pad + line)
+
+        if value_shape is _GENERIC_SHAPE:
+            write('request._encode_single_value(buf, {})'.format(name))
+        elif value_shape is type(None):
+            write('append(0x4e)')
+        elif value_shape is bool:
+            write('append(0x54 if {} else 0x46)'.format(name))
+        elif value_shape in (int, long):
+            # 内联最常用的单字节以及双字节的整数
+            write('if -0x10 <= {} <= 0x2f:'.format(name))
+            write('    append({} + 0x90)'.format(name))
+            write('elif -0x800 <= {} <= 0x7ff:'.format(name))
+            write('    append(0xc8 + ({} >> 8))'.format(name))
+            write('    append({} & 0xff)'.format(name))
+            write('else:')
+            write('    encode_int(buf, {})'.format(name))
+        elif value_shape is float:
+            write('encode_float(buf, {})'.format(name))
+        elif value_shape in (str, unicode):
+            write('encode_str(buf, {})'.format(name))
+        elif value_shape[0] is list:
+            element = variable()
+            write('if not {}:'.format(name))
+            write('    append(0x4e)')
+            write('else:')
+            write("    request._encode_list_head(buf, '[object', len({}))".format(name))
+            write('    for {} in {}:'.format(element, name))
+            emit_encode(value_shape[1], element, indent + 8)
+        else:
+            if value_shape[0] is Object:
+                _, path, field_names, field_shapes = value_shape
+                definition = bytearray('C')
+                Request._encode_str(definition, path)
+                Request._encode_int(definition, len(field_names))
+                for field_name in field_names:
+                    Request._encode_str(definition, field_name)
+                class_key = constant((path, field_names))
+                definition = constant(str(definition))
+                values = variable()
+                write('{} = {}._Object__values'.format(values, name))
+                fields = ['{}[{!r}]'.format(values, field_name) for field_name in field_names]
+            else:
+                _, cls, field_shapes = value_shape
+                class_key = constant(cls)
+                definition = constant(cls._definition)
+                fields = ['{}.{}'.format(name, field_name) for field_name in cls._field_names]
+            class_id = variable()
+            write('{} = classes.get({})'.format(class_id, class_key))
+            write('if {} is None:'.format(class_id))
+            write('    {} = classes[{}] = len(classes)'.format(class_id, class_key))
+            write('    buf += {}'.format(definition))
+            write('if {} <= 0xf:'.format(class_id))
+            write('    append(0x60 + {})'.format(class_id))
+            write('else:')
+            write('    request._encode_class_id(buf, {})'.format(class_id))
+            for field, field_shape in zip(fields, field_shapes):
+                field_name = variable()
+                write('{} = {}'.format(field_name, field))
+                emit_encode(field_shape, field_name, indent)
+
+    for i, argument_shape in enumerate(shape):
+        emit_check(argument_shape, 'arguments[{}]'.format(i), 4)
+        name = variable()
+        encodes.append('    {} = arguments[{}]'.format(name, i))
+        emit_encode(argument_shape, name, 4)
+
+    lines = ['def encode(request, buf, arguments, classes):',
+             '    if len(arguments) != {}:'.format(len(shape)),
+             '        return False']
+    lines.extend(checks)
+    lines.append('    append = buf.append')
+    lines.extend(encodes)
+    lines.append('    return True')
+    namespace = dict(constants)
+    exec compile('\n'.join(lines), '<encoder for shape {}>'.format(len(shape)), 'exec') in namespace
+    return namespace['encode']
+
+
+def _read_chunks(spill):
+    """
+    从临时文件中逐块读取数据，读取完毕之后关闭并删除临时文件
+    :param spill:
+    :return:
+    """
+    try:
+        while 1:
+            chunk = spill.read(_STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        spill.close()
+
+
+def _get_number_kind(value):
+    """
+    获取数字列表在Java中所对应的基本类型，元素为Python的long的列表总是对应long
+    :param value: list, array.array或者numpy数组
+    :return: 基本类型(int, long, double)，以及用于编码的数组；列表中的元素不是同一种类型的数字时基本类型为None
+    """
+    if isinstance(value, list):
+        types = set(map(type, value))
+        if len(types) > 1:
+            return None, value
+        _type = types.pop()
+        if _type is float:
+            kind = 'double'
+        elif _type is int and MIN_INT_32 <= min(value) and max(value) <= MAX_INT_32:
+            kind = 'int'
+        else:
+            kind = 'long'
+        if _type is long:
+            # 在int范围内的long转化为int，才能与int一样进行编码
+            value = map(int, value)
+        if numpy is not None and len(value) >= _NUMPY_MIN_SIZE:
+            value = numpy.array(value, dtype=numpy.float64 if kind == 'double' else numpy.int64)
+        return kind, value
+
+    if isinstance(value, array):
+        typecode, itemsize = value.typecode, value.itemsize
+        if typecode not in 'bBhHiIlLfd':
+            raise HessianTypeError('Unknown array type: {}'.format(typecode))
+        if numpy is not None:
+            value = numpy.frombuffer(value, dtype=numpy.dtype(typecode))
+    else:
+        if value.ndim != 1 or value.dtype.kind not in 'iuf':
+            raise HessianTypeError('Unknown array type: {} with shape {}'.format(value.dtype, value.shape))
+        typecode, itemsize = value.dtype.char, value.dtype.itemsize
+        if value.dtype.kind == 'u':
+            typecode = typecode.upper()
+    if typecode in 'fdeg':
+        return 'double', value
+    # 大于等于4个字节的无符号整数会超出int的范围
+    if itemsize < 4 or (itemsize == 4 and typecode.islower()):
+        return 'int', value
+    return 'long', value
+
+
+def _interleave(tag, packed, width):
+    """
+    在每一个定长的值的前面插入类型标识
+    :param tag: 类型标识
+    :param packed: 所有的值一次性打包之后的字节
+    :param width: 每一个值的字节数
+    :return:
+    """
+    count = len(packed) // width
+    result = bytearray(count * (width + 1))
+    result[0::width + 1] = chr(tag) * count
+    for i in xrange(width):
+        result[i + 1::width + 1] = packed[i::width]
+    return result
+
+
+def _encode_numpy_ints(values):
+    """
+    使用numpy对整数数组进行编码，参见方法：Request#_encode_int
+    :param values:
+    :return:
+    """
+    if values.dtype.kind == 'u' and values.dtype.itemsize == 8 and values.max() > numpy.iinfo(numpy.int64).max:
+        raise HessianTypeError('Array value out of range of java long')
+    values = values.astype(numpy.int64)
+    sizes = numpy.select([(-0x10 <= values) & (values <= 0x2f),
+                          (-0x800 <= values) & (values <= 0x7ff),
+                          (-0x40000 <= values) & (values <= 0x3ffff),
+                          (MIN_INT_32 <= values) & (values <= MAX_INT_32)], [1, 2, 3, 5], 9)
+    offsets = numpy.cumsum(sizes) - sizes
+    result = numpy.empty(int(sizes.sum()), dtype=numpy.uint8)
+
+    def put(size, tag, shifts):
+        mask = sizes == size
+        positions, selected = offsets[mask], values[mask]
+        if tag is not None:
+            result[positions] = tag
         else:
-            raise HessianTypeError('Unknown argument type: {}'.format(value))
+            result[positions] = selected >> shifts[0]
+            shifts = shifts[1:]
+        first = size - len(shifts)
+        for i, shift in enumerate(shifts):
+            result[positions + first + i] = (selected >> shift) & 0xff
 
+    result[offsets[sizes == 1]] = values[sizes == 1] + 0x90
+    put(2, None, (8, 0))
+    put(3, None, (16, 8, 0))
+    put(5, 0x49, (24, 16, 8, 0))
+    put(9, 0x4c, (56, 48, 40, 32, 24, 16, 8, 0))
+    # 2个字节以及3个字节编码的第一个字节需要加上偏移量
+    result[offsets[sizes == 2]] += 0xc8
+    result[offsets[sizes == 3]] += 0xd4
+    return result.tostring()
 
-def get_request_body_length(body):
+
+def _encode_numpy_doubles(values):
+    """
+    使用numpy对浮点数数组进行编码，参见方法：Request#_encode_float
+    :param values:
+    :return:
+    """
+    values = values.astype(numpy.float64)
+    with numpy.errstate(invalid='ignore', over='ignore'):
+        int_values = numpy.trunc(values)
+        shorts = (int_values == values) & (-0x8000 <= int_values) & (int_values < 0x8000)
+        mills = numpy.trunc(values * 1000)
+        mills = ~shorts & (0.001 * mills == values) & (MIN_INT_32 <= mills) & (mills <= MAX_INT_32)
+    int_values = numpy.where(shorts, int_values, 0).astype(numpy.int64)
+    mills_values = numpy.where(mills, numpy.trunc(values * 1000), 0).astype(numpy.int64)
+
+    sizes = numpy.select([shorts & (int_values == 0),
+                          shorts & (int_values == 1),
+                          shorts & (-0x80 <= int_values) & (int_values < 0x80),
+                          shorts,
+                          mills], [1, 1, 2, 3, 5], 9)
+    tags = numpy.select([sizes == 1, sizes == 2, sizes == 3, sizes == 5],
+                        [numpy.where(int_values == 0, 0x5b, 0x5c), 0x5d, 0x5e, 0x5f], 0x44)
+    offsets = numpy.cumsum(sizes) - sizes
+    result = numpy.empty(int(sizes.sum()), dtype=numpy.uint8)
+    result[offsets] = tags
+
+    mask = sizes == 2
+    result[offsets[mask] + 1] = int_values[mask] & 0xff
+    mask = sizes == 3
+    for i, shift in enumerate((8, 0)):
+        result[offsets[mask] + 1 + i] = (int_values[mask] >> shift) & 0xff
+    mask = sizes == 5
+    for i, shift in enumerate((24, 16, 8, 0)):
+        result[offsets[mask] + 1 + i] = (mills_values[mask] >> shift) & 0xff
+    mask = sizes == 9
+    packed = values[mask].astype('>f8').view(numpy.uint8).reshape(-1, 8)
+    for i in xrange(8):
+        result[offsets[mask] + 1 + i] = packed[:, i]
+    return result.tostring()
+
+
+def _encode_surrogate_pairs(data):
     """
-    获取body的长度，并将其转为长度为4个字节的字节数组
-    :param body:
+    Java中使用一对代理字符(surrogate pair)来表示超出BMP的字符，Hessian对每个代理字符分别使用3个字节进行编码
+    :param data: utf-8编码的str
     :return:
     """
-    return list(bytearray(struct.pack('!i', len(body))))
+    parts = _SUPPLEMENTARY_CHAR.split(data)
+    chars = parts[1::2]
+    pairs = map(_SURROGATE_PAIRS.get, chars)
+    if None in pairs:
+        pairs = map(_to_surrogate_pair, chars)
+    parts[1::2] = pairs
+    return ''.join(parts)
+
+
+def _to_surrogate_pair(char):
+    """
+    :param char: 4个字节的utf-8字符
+    :return: 6个字节的代理对
+    """
+    pair = _SURROGATE_PAIRS.get(char)
+    if pair is not None:
+        return pair
+    b0, b1, b2, b3 = bytearray(char)
+    ch = (((b0 & 0x07) << 18) | ((b1 & 0x3f) << 12) | ((b2 & 0x3f) << 6) | (b3 & 0x3f)) - 0x10000
+    result = bytearray()
+    for unit in (0xd800 + (ch >> 10), 0xdc00 + (ch & 0x3ff)):
+        result.append(0xe0 + (unit >> 12))
+        result.append(0x80 + ((unit >> 6) & 0x3f))
+        result.append(0x80 + (unit & 0x3f))
+    pair = str(result)
+    if len(_SURROGATE_PAIRS) < _SURROGATE_PAIRS_MAX_SIZE:
+        _SURROGATE_PAIRS[char] = pair
+    return pair
 
 
 if __name__ == '__main__':
@@ -40,6 +40,8 @@ MIN_INT_32 = -2147483648
 
 # MAGIC_NUM(2) + FLAG(1) + STATUS(1)
 DEFAULT_REQUEST_META = num_2_byte_list(0xdabbc200)
+# 请求体长度(4)的占位符，请求体序列化完成之后再回填真正的长度
+BODY_LENGTH_PLACEHOLDER = bytearray(4)
 
 # 客户端对服务端发送的心跳的请求的头部
 CLI_HEARTBEAT_REQ_HEAD = num_2_byte_list(0xdabbe2) + [0]
@@ -60,6 +62,15 @@ TIMEOUT_IDLE = 60
 TIMEOUT_MAX_TIMES = 3
 
 # 数据的头部大小为16个字节
-# 读取的数据类型：1 head; 2 error_body; 3 common_body;
+# 读取的数据类型：1 head; 2 error_body; 3 common_body; 4 streamed_body;
 # 头部信息不存在invoke_id，所以为None
 DEFAULT_READ_PARAMS = 16, 1, None
+
+# 流式读取响应体时每次从socket读取的最大字节数
+STREAM_READ_SIZE = 0x10000
+# 流式读取时尚未被调用方取走的数据的上限，超过之后暂停读取此连接
+STREAM_BUFFER_SIZE = 4 << 20
+# 连接被暂停读取超过这么多秒之后放弃此流式读取的响应并恢复读取，避免同一个远程主机的其它调用一直收不到响应
+STREAM_PAUSE_TIMEOUT = 60
+# 值为列表的响应体不小于此大小时被写入临时文件，之后从文件的mmap分块解码，为0时不使用
+SPILL_BODY_SIZE = 64 << 20
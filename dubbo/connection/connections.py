@@ -18,17 +18,20 @@
  */
 """
 
+import errno
 import logging
+import mmap
 import select
 import socket
+import tempfile
 import threading
 import time
 from struct import unpack, pack
 
-from dubbo.codec.encoder import Request
-from dubbo.codec.decoder import Response, parse_response_head
+from dubbo.codec.decoder import Response, ResponseStream, parse_response_head, decode_mapped, is_list_response
 from dubbo.common.constants import CLI_HEARTBEAT_RES_HEAD, CLI_HEARTBEAT_TAIL, CLI_HEARTBEAT_REQ_HEAD, \
-    TIMEOUT_CHECK_INTERVAL, TIMEOUT_IDLE, TIMEOUT_MAX_TIMES, DEFAULT_READ_PARAMS
+    TIMEOUT_CHECK_INTERVAL, TIMEOUT_IDLE, TIMEOUT_MAX_TIMES, DEFAULT_READ_PARAMS, STREAM_READ_SIZE, \
+    STREAM_BUFFER_SIZE, STREAM_PAUSE_TIMEOUT, SPILL_BODY_SIZE
 from dubbo.common.exceptions import DubboResponseException, DubboRequestTimeoutException
 from dubbo.common.util import get_invoke_id
 
@@ -47,6 +50,15 @@ class BaseConnectionPool(object):
         self.conn_lock = threading.Lock()
         # 用于在数据读取完毕之后唤醒主线程
         self.conn_events = {}
+        # 每个请求解析响应时的选项
+        self.decode_options = {}
+        # 流式读取响应的请求，参见方法：get_stream
+        self.streams = {}
+        # 调用方超过这么多秒没有取走数据导致连接一直被暂停时，放弃此流式读取的响应
+        self.stream_pause_timeout = STREAM_PAUSE_TIMEOUT
+        # 值为列表的正常响应体不小于此大小时被写入临时文件，解码时不需要把整个响应体读入内存，为0时不使用；
+        # 只对之后创建的连接生效
+        self.spill_size = SPILL_BODY_SIZE
 
         reading_thread = threading.Thread(target=self._read_from_server)
         reading_thread.setDaemon(True)  # 当主线程退出时此线程同时退出
@@ -56,26 +68,29 @@ class BaseConnectionPool(object):
         scanning_thread.setDaemon(True)
         scanning_thread.start()
 
-    def get(self, host, request_param, timeout=None):
+    def get(self, host, request, timeout=None, decode_options=None):
         """
         执行远程调用获取数据
         :param host:
-        :param request_param:
+        :param request: 参见类：dubbo.codec.encoder.Request
         :param timeout:
+        :param decode_options: 解析响应时的选项，参见类：dubbo.codec.decoder.Response
         :return:
         """
         conn = self._get_connection(host)
-        request = Request(request_param)
-        request_data = request.encode()
+        request_data = request.encode_segments()
         invoke_id = request.invoke_id
 
         event = threading.Event()
         self.conn_events[invoke_id] = event
+        if decode_options:
+            self.decode_options[invoke_id] = decode_options
         # 发送数据
         conn.write(request_data)
         logger.debug('Waiting response, invoke_id={}, timeout={}, host={}'.format(invoke_id, timeout, host))
         event.wait(timeout)
         del self.conn_events[invoke_id]
+        self.decode_options.pop(invoke_id, None)
 
         if invoke_id not in self.results:
             err = "Socket(host='{}'): Read timed out. (read timeout={})".format(host, timeout)
@@ -88,6 +103,61 @@ class BaseConnectionPool(object):
             raise result
         return result
 
+    def get_stream(self, host, request, timeout=None, decode_options=None):
+        """
+        执行远程调用并流式地解码响应，响应体的数据不再被完整地缓存，响应的值为列表时每个元素的数据到达之后即可被取出
+        :param host:
+        :param request: 参见类：dubbo.codec.encoder.Request
+        :param timeout: 等待下一块数据的超时时间
+        :param decode_options: 解析响应时的选项，参见类：dubbo.codec.decoder.ResponseStream
+        :return: 逐个产生列表中的元素的generator
+        """
+        conn = self._get_connection(host)
+        request_data = request.encode_segments()
+        invoke_id = request.invoke_id
+
+        stream = _ResponseStream(self, host, ResponseStream(**(decode_options or {})))
+        self.streams[invoke_id] = stream
+        # 在返回generator之前发送数据，调用方开始迭代时数据可能已经到达
+        conn.write(request_data)
+        logger.debug('Streaming response, invoke_id={}, timeout={}, host={}'.format(invoke_id, timeout, host))
+        return self._read_stream(host, invoke_id, stream, timeout)
+
+    def _read_stream(self, host, invoke_id, stream, timeout):
+        """
+        在调用方的线程中解码读取线程收到的数据
+        :param host:
+        :param invoke_id:
+        :param stream:
+        :param timeout:
+        :return:
+        """
+        decoder = stream.decoder
+        try:
+            while not decoder.done:
+                chunks, finished = stream.take(host, timeout)
+                for chunk in chunks:
+                    decoder.feed(chunk)
+                if finished:
+                    decoder.finish()
+                for value in decoder.read_values():
+                    yield value
+            if decoder.error_response is not None:
+                raise self._parse_error(decoder.error_response)
+        finally:
+            # 调用方提前结束迭代时，响应体剩余的数据在读取之后直接被丢弃
+            self.streams.pop(invoke_id, None)
+            stream.close()
+
+    def resume(self, conn):
+        """
+        恢复读取被暂停的连接
+        :param conn:
+        :return:
+        """
+        conn.last_active = time.time()
+        conn.paused = False
+
     def _get_connection(self, host):
         """
         通过host获取到与此host相关的socket，本地会对socket进行缓存
@@ -139,6 +209,7 @@ class BaseConnectionPool(object):
                 1 头部
                 2 因为头部的解析错误，需要被读取的错误body
                 3 正确的body
+                4 流式读取的正确的body中的一块数据
         :param invoke_id
         :return:
             next_read_length 下一次读取需要读取的数据长度
@@ -150,6 +221,7 @@ class BaseConnectionPool(object):
         if not data:
             logger.debug('{} closed by remote server.'.format(host))
             self._delete_connection(conn)
+            self._fail_streams(host)
             return 0, 0, 0
 
         # 响应的头部
@@ -160,19 +232,55 @@ class BaseConnectionPool(object):
         elif data_type == 2:
             logger.debug('received error response body with invoke_id={}, host={}'.format(invoke_id, host))
             res = Response(data)
-            error = res.read_next()
-            self.results[invoke_id] = DubboResponseException('\n{}'.format(error))
-            self.conn_events[invoke_id].set()
+            error = DubboResponseException('\n{}'.format(res.read_next()))
+            stream = self.streams.pop(invoke_id, None)
+            if stream is not None:
+                stream.fail(error)
+            else:
+                self.results[invoke_id] = error
+                self.conn_events[invoke_id].set()
             return DEFAULT_READ_PARAMS
         # 正常的响应体
         elif data_type == 3:
             logger.debug('received normal response body with invoke_id={}, host={}'.format(invoke_id, host))
             self._parse_response(invoke_id, data)
             return DEFAULT_READ_PARAMS
+        # 流式读取的响应体中的一块数据
+        elif data_type == 4:
+            finished = conn.read_length == 0
+            stream = self.streams.get(invoke_id)
+            if stream is not None:
+                stream.feed(data, conn, finished)
+            if finished:
+                logger.debug('received streamed response body with invoke_id={}, host={}'.format(invoke_id, host))
+                self.streams.pop(invoke_id, None)
+                return DEFAULT_READ_PARAMS
+            return conn.read_length, 4, invoke_id
 
         else:
             raise RuntimeError('Unknown data type {}.'.format(data_type))
 
+    def _fail_streams(self, host):
+        """
+        连接被关闭时，此连接上尚未读取完毕的流式响应都不会再收到数据，唤醒等待这些响应的调用方
+        :param host:
+        :return:
+        """
+        for invoke_id, stream in self.streams.items():
+            if stream.host == host and self.streams.pop(invoke_id, None) is not None:
+                stream.fail(DubboResponseException(
+                    "Socket(host='{}'): Connection closed before the response was completely read".format(host)))
+
+    def _expire_streams(self):
+        """
+        放弃暂停读取连接的时间过长的流式响应，例如调用方不再迭代却仍然持有generator，
+        恢复读取此连接之后这个响应剩余的数据被直接丢弃
+        :return:
+        """
+        for invoke_id, stream in self.streams.items():
+            if stream.expire(self.stream_pause_timeout):
+                self.streams.pop(invoke_id, None)
+
     def _parse_head(self, data, conn):
         """
         对dubbo响应的头部信息进行解析
@@ -203,6 +311,8 @@ class BaseConnectionPool(object):
         # 普通的数据包
         else:
             invoke_id = unpack('!q', data[4:12])[0]
+            if invoke_id in self.streams and body_length > 0:
+                return body_length, 4, invoke_id
             return body_length, 3, invoke_id
 
     def _parse_response(self, invoke_id, body):
@@ -217,7 +327,11 @@ class BaseConnectionPool(object):
             return
 
         try:
-            res = Response(body)
+            options = self.decode_options.pop(invoke_id, {})
+            if isinstance(body, mmap.mmap):
+                self.results[invoke_id] = self._parse_mapped_response(body, options)
+                return
+            res = Response(body, **options)
             flag = res.read_int()
             if flag == 2:  # 响应的值为NULL
                 self.results[invoke_id] = None
@@ -235,6 +349,21 @@ class BaseConnectionPool(object):
             self.conn_events[invoke_id].set()  # 唤醒请求线程
             logger.debug('Event set, invoked_id={}'.format(invoke_id))
 
+    def _parse_mapped_response(self, body, options):
+        """
+        对被写入临时文件的响应体进行解析，响应的值为列表时分块解码，参见方法：dubbo.codec.decoder.decode_mapped
+        :param body: 响应体所在的临时文件的mmap
+        :param options: 解析响应时的选项
+        :return: 响应的值或者异常
+        """
+        try:
+            stream = decode_mapped(body, **options)
+        finally:
+            body.close()
+        if stream.error_response is not None:
+            return self._parse_error(stream.error_response)
+        return stream.value
+
     @staticmethod
     def _parse_error(res):
         """
@@ -256,6 +385,7 @@ class BaseConnectionPool(object):
         """
         while 1:
             starting = time.time()
+            self._expire_streams()
             for host in self._connection_pool.keys():
                 try:
                     self._check_conn(host)
@@ -273,8 +403,8 @@ class BaseConnectionPool(object):
         :return:
         """
         conn = self._connection_pool[host]
-        # 如果未达到最大的超时时间，则不进行任何操作
-        if time.time() - conn.last_active <= TIMEOUT_IDLE:
+        # 如果未达到最大的超时时间，则不进行任何操作；被暂停读取的连接无法收到心跳的响应
+        if time.time() - conn.last_active <= TIMEOUT_IDLE or conn.paused:
             return
 
         # 达到最大的超时次数，对此连接进行重连
@@ -300,13 +430,16 @@ class SelectConnectionPool(BaseConnectionPool):
 
     def __init__(self):
         self.select_timeout = 0.5  # select模型超时时间
+        self.paused_select_timeout = 0.01  # 有连接被暂停读取时的超时时间，以便尽快恢复读取
         BaseConnectionPool.__init__(self)
 
     def _read_from_server(self):
         while 1:
             try:
-                conns = self._connection_pool.values()
-                readable, writeable, exceptional = select.select(conns, [], [], self.select_timeout)
+                conns = [conn for conn in self._connection_pool.values() if not conn.paused]
+                paused = len(conns) < len(self._connection_pool)
+                timeout = self.paused_select_timeout if paused else self.select_timeout
+                readable, writeable, exceptional = select.select(conns, [], [], timeout)
             except select.error as e:
                 logger.exception(e)
                 break
@@ -318,7 +451,7 @@ class SelectConnectionPool(BaseConnectionPool):
 
     def _new_connection(self, host):
         ip, port = host.split(':')
-        self._connection_pool[host] = Connection(ip, int(port))
+        self._connection_pool[host] = Connection(ip, int(port), self.spill_size)
         # 保证select模型已经开始监听最新加入的这个fd的读事件，否则可能会导致此fd读事件丢失
         time.sleep(self.select_timeout)
 
@@ -330,12 +463,116 @@ class SelectConnectionPool(BaseConnectionPool):
 connection_pool = SelectConnectionPool()
 
 
+class _ResponseStream(object):
+    """
+    流式读取的响应，读取线程收到的数据交给调用方的线程解码；
+    尚未被调用方取走的数据超过STREAM_BUFFER_SIZE时暂停读取此连接，直到调用方取走这些数据
+    """
+
+    def __init__(self, pool, host, decoder):
+        self.pool = pool
+        self.host = host
+        self.decoder = decoder
+        self.condition = threading.Condition()
+        self.chunks = []
+        self.buffered = 0
+        self.finished = False
+        self.error = None
+        self.closed = False
+        # 调用方开始迭代之前不暂停读取，避免调用方不再迭代时连接一直被暂停
+        self.started = False
+        # 被暂停读取的连接以及暂停的时间
+        self.paused_conn = None
+        self.paused_since = None
+
+    def feed(self, data, conn, finished):
+        """
+        读取线程收到了一块数据
+        :param data:
+        :param conn:
+        :param finished: 响应体是否已经读取完毕
+        :return:
+        """
+        with self.condition:
+            if self.closed:
+                return
+            self.chunks.append(data)
+            self.buffered += len(data)
+            self.finished = finished
+            if self.started and not finished and self.buffered > STREAM_BUFFER_SIZE:
+                conn.paused = True
+                self.paused_conn = conn
+                self.paused_since = time.time()
+            self.condition.notify()
+
+    def fail(self, error):
+        with self.condition:
+            self.error = error
+            self.condition.notify()
+
+    def expire(self, timeout):
+        """
+        连接被暂停读取超过timeout秒时放弃此响应，调用方之后取数据时抛出异常
+        :param timeout:
+        :return: 是否放弃了此响应
+        """
+        with self.condition:
+            if self.paused_conn is None or time.time() - self.paused_since <= timeout:
+                return False
+            self.error = DubboRequestTimeoutException(
+                "Socket(host='{}'): Response not consumed in {} seconds, stop reading it".format(self.host, timeout))
+            self.closed = True
+            self.chunks = []
+            self.__resume()
+            self.condition.notify()
+            return True
+
+    def take(self, host, timeout):
+        """
+        取走读取线程已经收到的数据，没有数据时等待
+        :param host:
+        :param timeout: 等待的超时时间
+        :return: 收到的数据块以及响应体是否已经读取完毕
+        """
+        with self.condition:
+            self.started = True
+            deadline = None if timeout is None else time.time() + timeout
+            while not self.chunks and not self.finished and self.error is None:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    err = "Socket(host='{}'): Read timed out. (read timeout={})".format(host, timeout)
+                    raise DubboRequestTimeoutException(err)
+                self.condition.wait(remaining)
+            if self.error is not None:
+                raise self.error
+            chunks, self.chunks = self.chunks, []
+            self.buffered = 0
+            self.__resume()
+            return chunks, self.finished
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.chunks = []
+            self.__resume()
+
+    def __resume(self):
+        if self.paused_conn is not None:
+            self.pool.resume(self.paused_conn)
+            self.paused_conn = None
+
+
 class Connection(object):
     """
     对Socket链接做了一些封装
     """
 
-    def __init__(self, host, port):
+    def __init__(self, host, port, spill_size=SPILL_BODY_SIZE):
+        """
+        :param host:
+        :param port:
+        :param spill_size: 值为列表的正常响应体不小于此大小时被写入临时文件，为0时不使用
+        """
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.settimeout(5)
         sock.connect((host, port))
@@ -343,9 +580,18 @@ class Connection(object):
         sock.setblocking(False)
         self.__sock = sock
         self.__host = '{0}:{1}'.format(host, port)
+        self.__write_lock = threading.Lock()
 
         self.read_length, self.read_type, self.invoke_id = DEFAULT_READ_PARAMS
-        self.read_buffer = []
+        # 正在读取的数据，为预先分配好的bytearray，或者较大的响应体所写入的临时文件；没有正在读取的数据时为None
+        self.read_buffer = None
+        # 已经读取的字节数
+        self.read_size = 0
+        self.spill_size = spill_size
+        # 较大的响应体在读取到开头之后才决定是否写入临时文件，参见方法：__choose_buffer
+        self.spill_pending = False
+        # 流式读取的响应尚未被调用方取走的数据过多时暂停读取
+        self.paused = False
 
         self.last_active = time.time()
 
@@ -360,18 +606,42 @@ class Connection(object):
     def write(self, data):
         """
         向远程主机写数据
+        :param data: 需要写入的数据，或者需要按顺序写入的多个分段
+                     参见方法：dubbo.codec.encoder.Request#encode_segments
+        :return:
+        """
+        segments = data if isinstance(data, list) else [data]
+        # 多个线程同时写入时，保证每一个请求的所有分段都是连续的
+        with self.__write_lock:
+            for segment in segments:
+                if isinstance(segment, (str, bytearray, memoryview, buffer)):
+                    self.__write(segment)
+                else:
+                    # 逐块产生数据的分段
+                    for chunk in segment:
+                        self.__write(chunk)
+
+    def __write(self, data):
+        """
+        写入一段完整的数据
+        :param data:
         :return:
         """
+        if not isinstance(data, (memoryview, buffer)):
+            data = memoryview(data)
         while 1:
             try:
                 length = self.__sock.send(data)
                 if length == len(data):
                     break
                 else:
-                    # 截取尚未写完的数据，接下来再次发送
-                    data = data[length:]
+                    # 截取尚未写完的数据，接下来再次发送，截取时不复制数据
+                    if isinstance(data, memoryview):
+                        data = data[length:]
+                    else:
+                        data = buffer(data, length)
             except socket.error as e:
-                if e.errno == 35:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
                     time.sleep(.01)
                 else:
                     raise
@@ -384,18 +654,77 @@ class Connection(object):
         """
         self.last_active = time.time()
 
-        data = list(bytearray(self.__sock.recv(self.read_length - len(self.read_buffer))))
+        if self.read_type == 4:
+            # 流式读取的响应体，收到的数据直接交给回调
+            data = self.__sock.recv(min(self.read_length, STREAM_READ_SIZE))
+            if not data:
+                callback([], self, None, None)
+                return
+            self.read_length -= len(data)
+            self.read_length, self.read_type, self.invoke_id = callback(data, self, 4, self.invoke_id)
+            return
+
+        if self.read_buffer is None:
+            self.read_size = 0
+            # 只有正常的响应体才可能写入临时文件，错误的响应体需要完整地读入内存构造Response
+            self.spill_pending = self.read_type == 3 and 0 < self.spill_size <= self.read_length
+            self.read_buffer = bytearray() if self.spill_pending else bytearray(self.read_length)
+
+        if self.spill_pending:
+            data = self.__sock.recv(min(self.read_length - self.read_size, STREAM_READ_SIZE))
+            self.read_buffer += data
+            length = len(data)
+        elif isinstance(self.read_buffer, bytearray):
+            # 直接读取到预先分配好的内存中，不产生中间的对象
+            length = self.__sock.recv_into(memoryview(self.read_buffer)[self.read_size:])
+        else:
+            data = self.__sock.recv(min(self.read_length - self.read_size, STREAM_READ_SIZE))
+            self.read_buffer.write(data)
+            length = len(data)
         # 断开连接
-        if not data:
+        if not length:
+            self.__discard_buffer()
             callback([], self, None, None)
             return
 
-        self.read_buffer.extend(data)
+        self.read_size += length
+        if self.spill_pending and (self.read_size >= 2 or self.read_size == self.read_length):
+            self.__choose_buffer()
         # 数据读取已经满足要求
-        if len(self.read_buffer) == self.read_length:
+        if self.read_size == self.read_length:
+            data = self.read_buffer
+            self.read_buffer = None
+            if not isinstance(data, bytearray):
+                # 解码时从临时文件的mmap中分块读取，关闭文件之后mmap仍然有效
+                spill_file = data
+                try:
+                    spill_file.flush()
+                    data = mmap.mmap(spill_file.fileno(), self.read_length, access=mmap.ACCESS_READ)
+                finally:
+                    spill_file.close()
             self.read_length, self.read_type, self.invoke_id \
-                = callback(bytearray(self.read_buffer), self, self.read_type, self.invoke_id)
-            self.read_buffer = []
+                = callback(data, self, self.read_type, self.invoke_id)
+
+    def __choose_buffer(self):
+        """
+        根据已经读取的响应体的开头决定是否写入临时文件：只有值为列表的响应才能分块解码，
+        其它的值(例如包含列表的分页对象)解码时仍然需要完整的数据，写入临时文件只会多一次写入和读取，所以直接读入内存
+        :return:
+        """
+        head = self.read_buffer
+        self.spill_pending = False
+        if is_list_response(head):
+            self.read_buffer = tempfile.TemporaryFile()
+            self.read_buffer.write(head)
+        else:
+            self.read_buffer = bytearray(self.read_length)
+            self.read_buffer[:len(head)] = head
+
+    def __discard_buffer(self):
+        if self.read_buffer is not None and not isinstance(self.read_buffer, bytearray):
+            self.read_buffer.close()
+        self.read_buffer = None
+        self.spill_pending = False
 
     def close(self):
         """
@@ -403,6 +732,7 @@ class Connection(object):
         :return:
         """
         logger.debug('{} closed by client.'.format(self.__host))
+        self.__discard_buffer()
         self.__sock.shutdown(socket.SHUT_RDWR)
         self.__sock.close()
 
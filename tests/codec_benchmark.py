@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+"""
+编解码的性能测试，不依赖于Zookeeper以及远程的dubbo服务，使用方法：
+
+    python -m tests.codec_benchmark
+"""
+import time
+from array import array
+from datetime import datetime, timedelta
+
+from dubbo.codec.decoder import Response, ResponseStream, decode_mapped
+from dubbo.codec.encoder import Object, Request, Binary, Signature, RequestCache
+
+
+def benchmark(name, func, repeat=5):
+    """
+    多次执行func并输出其中最快的一次的耗时
+    :param name:
+    :param func:
+    :param repeat:
+    :return:
+    """
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        func()
+        cost = time.time() - start
+        if best is None or cost < best:
+            best = cost
+    print '{0:<48} {1:>10.2f}ms'.format(name, best * 1000)
+
+
+def request_param(method, arguments):
+    return {
+        'dubbo_version': '2.4.10',
+        'version': '1.0.0',
+        'path': 'me.hourui.echo.provider.Echo',
+        'method': method,
+        'arguments': arguments
+    }
+
+
+def object_list(size):
+    items = []
+    for i in xrange(size):
+        item = Object('me.hourui.echo.bean.Item')
+        item['id'] = 100000 + i
+        item['name'] = 'item-name-{}'.format(i)
+        item['price'] = i * 0.25
+        item['stock'] = i % 1000
+        item['enabled'] = i % 2 == 0
+        items.append(item)
+    return items
+
+
+def defined_object_list(size):
+    item_class = Object.define('me.hourui.echo.bean.Item', ['id', 'name', 'price', 'stock', 'enabled'])
+    return [item_class(100000 + i, 'item-name-{}'.format(i), i * 0.25, i % 1000, i % 2 == 0) for i in xrange(size)]
+
+
+def encode_payloads():
+    payloads = [
+        ('encode 50KB objects', [object_list(2000)]),
+        ('encode 500KB objects', [object_list(19500)]),
+        ('encode 500KB defined objects', [defined_object_list(19500)]),
+        ('encode 500KB int list', [range(1 << 20, (1 << 20) + 100000)]),
+        ('encode 500KB string list', [['string-value-{}'.format(i) for i in xrange(25000)]]),
+    ]
+    for name, arguments in payloads:
+        param = request_param('echo', arguments)
+        size = len(Request(param).encode())
+        benchmark('{} ({} bytes)'.format(name, size), lambda: Request(param).encode())
+
+
+def encode_numbers():
+    ids = range(10000000000, 10000000000 + 100000)
+    scores = [i * 0.37 for i in xrange(100000)]
+    payloads = [
+        ('encode 100k ids (list)', ids),
+        ('encode 100k ids (array)', array('l', ids)),
+        ('encode 100k scores (list)', scores),
+        ('encode 100k scores (array)', array('d', scores)),
+    ]
+    for name, value in payloads:
+        param = request_param('echo', [value])
+        benchmark(name, lambda: Request(param).encode())
+
+
+def encode_specialized():
+    payloads = [
+        ('500KB objects', [object_list(19500)]),
+        ('500KB defined objects', [defined_object_list(19500)]),
+        ('small objects', [object_list(3), 'A000000', 10086]),
+    ]
+    for name, arguments in payloads:
+        param = request_param('save', arguments)
+        shapes = {}
+        times = 1 if len(arguments) == 1 else 10000
+
+        def encode(**kwargs):
+            for i in xrange(times):
+                Request(param, **kwargs).encode()
+
+        benchmark('encode {} x{}'.format(name, times), encode)
+        benchmark('encode {} x{} (specialized)'.format(name, times), lambda: encode(shapes=shapes))
+
+
+def encode_references():
+    warehouse = Object('me.hourui.echo.bean.Warehouse', {'id': 15373, 'name': 'warehouse-' * 20})
+    items = object_list(5000)
+    for item in items:
+        item['warehouse'] = warehouse
+    param = request_param('batchUpdate', [items])
+    for references in (False, True):
+        size = len(Request(param, references=references).encode())
+        name = 'encode shared objects (references={}, {} bytes)'.format(references, size)
+        benchmark(name, lambda: Request(param, references=references).encode())
+
+
+def encode_small_calls():
+    param = request_param('findById', ['A000000', 10086])
+    templates = {}
+
+    def encode(times, **kwargs):
+        for i in xrange(times):
+            Request(param, **kwargs).encode()
+
+    benchmark('encode 10000 small calls', lambda: encode(10000))
+    benchmark('encode 10000 small calls (templates)', lambda: encode(10000, templates=templates))
+    signature = Signature('(String, long)')
+    benchmark('encode 10000 small calls (templates, signature)',
+              lambda: encode(10000, templates=templates, signature=signature))
+    cache = RequestCache()
+    benchmark('encode 10000 small calls (cache)', lambda: encode(10000, cache=cache))
+
+
+def encode_strings():
+    json_string = '{"id": 10086, "name": "python-dubbo", "tags": ["hessian", "dubbo"]}, ' * 15000
+    payloads = [
+        ('encode 1MB ascii string', json_string),
+        ('encode 1MB cjk string', u'昊天金阙无上至尊自然妙有弥罗至真高天上圣大慈仁者玉皇' * 13000),
+        ('encode 1MB emoji string', u'\U0001f436\U0001f431 dubbo ' * 65000),
+    ]
+    for name, value in payloads:
+        param = request_param('echo1', [value])
+        benchmark(name, lambda: Request(param).encode())
+
+
+def encode_binary():
+    param = request_param('upload', ['image.png', Binary('\x89PNG' * (10 << 18))])
+    benchmark('encode 10MB binary', lambda: Request(param).encode())
+    benchmark('encode 10MB binary (segments)', lambda: Request(param).encode_segments())
+
+
+def encode_value(value):
+    buf = bytearray()
+    Request(request_param('echo', []))._encode_single_value(buf, value)
+    return buf
+
+
+def nested_response(size):
+    """
+    模拟一个较大的嵌套响应：订单列表，每个订单包含买家以及商品列表
+    """
+    orders = []
+    for i in xrange(size):
+        order = Object('me.hourui.echo.bean.Order')
+        order['id'] = 100000 + i
+        order['buyer'] = Object('me.hourui.echo.bean.User', {'name': 'user-{}'.format(i), 'score': i * 1.5})
+        order['items'] = object_list(20)
+        order['tags'] = {'source': 'app', 'channel': 'D2C'}
+        orders.append(order)
+    return encode_value(orders)
+
+
+def wide_response(size):
+    """
+    模拟商品列表的响应：每个商品有40个字段，通常只会用到其中的几个
+    """
+    fields = ['id', 'name', 'price'] + ['field{}'.format(i) for i in xrange(37)]
+    item_class = Object.define('me.hourui.echo.bean.Product', fields)
+    items = []
+    for i in xrange(size):
+        values = [100000 + i, 'product-name-{}'.format(i), i * 0.25]
+        values += ['value-{}'.format(j) if j % 2 else j * i for j in xrange(37)]
+        items.append(item_class(*values))
+    return encode_value(Object('me.hourui.echo.bean.Page', {'items': items, 'total': size}))
+
+
+def order_list(size):
+    """
+    模拟订单列表的响应：状态、币种等字段的值重复较多
+    """
+    order_class = Object.define('me.hourui.echo.bean.Order', ['id', 'status', 'currency', 'channel', 'remark'])
+    statuses = ['CREATED', 'PAID', 'SHIPPED', 'FINISHED', 'CANCELED']
+    orders = [order_class(i, statuses[i % 5], 'CNY', 'D2C' if i % 3 else 'APP', 'remark-{}'.format(i))
+              for i in xrange(size)]
+    return encode_value(orders)
+
+
+def stream_values(data, chunk_size=0x10000):
+    """
+    模拟流式读取：响应体分块到达，每收到一块就取出其中完整的元素
+    """
+    stream = ResponseStream()
+    values = []
+    for i in xrange(0, len(data), chunk_size):
+        stream.feed(data[i:i + chunk_size])
+        values.extend(stream.read_values())
+    stream.finish()
+    values.extend(stream.read_values())
+    return values
+
+
+def decode_responses():
+    payloads = [
+        ('decode nested response', nested_response(1000)),
+        ('decode 500KB objects', encode_value(object_list(19500))),
+        ('decode 500KB int list', encode_value(range(1 << 20, (1 << 20) + 100000))),
+        ('decode 1MB ascii string', encode_value('{"id": 10086, "name": "python-dubbo"}, ' * 27000)),
+        ('decode 1MB cjk string', encode_value(u'昊天金阙无上至尊自然妙有弥罗至真高天上圣大慈仁者玉皇' * 13000)),
+        ('decode 1MB emoji string', encode_value(u'\U0001f436\U0001f431 dubbo ' * 65000)),
+    ]
+    for name, data in payloads:
+        benchmark('{} ({} bytes)'.format(name, len(data)), lambda: Response(data).read_next())
+    data = nested_response(1000)
+    benchmark('decode nested response (unicode)', lambda: Response(data, unicode_strings=True).read_next())
+    benchmark('decode nested response (lazy)', lambda: Response(data, lazy=True).read_next())
+    benchmark('decode nested response (lazy, read 10 orders)',
+              lambda: [order['buyer']['name'] for order in Response(data, lazy=True).read_next()[:10]])
+    data = encode_value(object_list(19500))
+    benchmark('decode 500KB objects (defined_objects)', lambda: Response(data, defined_objects=True).read_next())
+    benchmark('decode 500KB objects (columns)', lambda: Response(data, columns=True).read_next())
+    data = order_list(20000)
+    benchmark('decode order list ({} bytes)'.format(len(data)), lambda: Response(data).read_next())
+    benchmark('decode order list (intern_strings)', lambda: Response(data, intern_strings=True).read_next())
+    body = bytearray([0x91]) + data
+    benchmark('decode order list (stream, 64KB chunks)', lambda: stream_values(body))
+    body = str(body)
+    benchmark('decode order list (mapped, 1MB chunks)', lambda: decode_mapped(body))
+    for name, values in [('1M doubles', [i * 3.14159265 for i in xrange(1, 1000001)]),
+                         ('1M mixed doubles', [i * 0.25 if i % 3 else i * 3.14159265 for i in xrange(1000000)]),
+                         ('1M ints', range(1000000))]:
+        data = encode_value(values)
+        benchmark('decode {}'.format(name), lambda: Response(data).read_next())
+        benchmark('decode {} (typed_arrays)'.format(name), lambda: Response(data, typed_arrays=True).read_next())
+    for name, value in [('10MB binary', Binary('\x89PNG' * (10 << 18))),
+                        ('1000 10KB binaries', [Binary('\x89PNG' * 2560) for i in xrange(1000)])]:
+        data = encode_value(value)
+        benchmark('decode {}'.format(name), lambda: Response(data).read_next())
+        benchmark('decode {} (binary_views)'.format(name), lambda: Response(data, binary_views=True).read_next())
+    start = datetime(2018, 5, 20, 13, 14, 15, 678000)
+    data = encode_value([start + timedelta(seconds=i) for i in xrange(100000)])
+    for dates in ('string', 'millis', 'datetime', 'utc'):
+        benchmark('decode 100k dates (dates={})'.format(dates), lambda: Response(data, dates=dates).read_next())
+    data = wide_response(2000)
+    select = ['items[*].id', 'items[*].price', 'total']
+    benchmark('decode product list ({} bytes)'.format(len(data)), lambda: Response(data).read_next())
+    benchmark('decode product list (select 3 fields)', lambda: Response(data, select=select).read_next())
+
+
+if __name__ == '__main__':
+    encode_payloads()
+    encode_numbers()
+    encode_specialized()
+    encode_references()
+    encode_small_calls()
+    encode_strings()
+    encode_binary()
+    decode_responses()
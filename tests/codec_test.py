@@ -0,0 +1,937 @@
+# -*- coding: utf-8 -*-
+"""
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import mmap
+import struct
+import tempfile
+import time
+import unittest
+import uuid
+from array import array
+from datetime import datetime, date
+from decimal import Decimal
+
+from dubbo.codec import encoder, decoder
+from dubbo.codec.decoder import Response, ResponseStream, LazyDict, LazyList, materialize, register_decoder, \
+    decode_mapped
+from dubbo.codec.encoder import Object, DefinedObject, Request, Binary, Signature, RequestCache, register_encoder
+from dubbo.common.exceptions import HessianTypeError
+
+
+def request_param(method, arguments):
+    return {
+        'dubbo_version': '2.4.10',
+        'version': '1.0.0',
+        'path': 'me.hourui.echo.provider.Echo',
+        'method': method,
+        'arguments': arguments
+    }
+
+
+def encode_value(value, **kwargs):
+    """
+    使用请求的编码器对单个值进行编码
+    """
+    buf = bytearray()
+    Request(request_param('echo', []), **kwargs)._encode_single_value(buf, value)
+    return buf
+
+
+def decode_values(data, **kwargs):
+    """
+    依次解析出data中所有的值
+    """
+    res = Response(data, **kwargs)
+    values = []
+    while res.length() > 0:
+        values.append(res.read_next())
+    return values
+
+
+class TestEncoder(unittest.TestCase):
+    def test_frame(self):
+        request = Request(request_param('echo', ['hello', 1]))
+        data = request.encode()
+        self.assertEquals(bytearray([0xda, 0xbb, 0xc2, 0x00]), data[:4])
+        self.assertEquals(request.invoke_id, struct.unpack('!q', data[4:12])[0])
+        self.assertEquals(len(data) - 16, struct.unpack('!i', data[12:16])[0])
+
+        values = decode_values(data[16:])
+        self.assertEquals(['2.4.10', 'me.hourui.echo.provider.Echo', '1.0.0', 'echo',
+                           'Ljava/lang/String;I', 'hello', 1], values[:7])
+        self.assertEquals({'path': 'me.hourui.echo.provider.Echo', 'interface': 'me.hourui.echo.provider.Echo',
+                           'version': '1.0.0'}, values[7])
+
+    def test_encode_into(self):
+        buf = bytearray('prefix')
+        request = Request(request_param('echo', [True]))
+        length = request.encode_into(buf)
+        self.assertEquals(len(buf), len('prefix') + length)
+        self.assertEquals(length - 16, struct.unpack('!i', buf[len('prefix') + 12:len('prefix') + 16])[0])
+
+    def test_templates(self):
+        templates = {}
+        for arguments in [['hello', 1], ['world', 2], [1.5]]:
+            param = request_param('echo', arguments)
+            expected = Request(param).encode()[16:]
+            self.assertEquals(expected, Request(param, templates=templates).encode()[16:])
+            self.assertEquals(expected, Request(param, templates=templates).encode()[16:])
+        self.assertEquals(2, len(templates))
+
+    def test_int(self):
+        self.assertEquals(bytearray([0x90]), encode_value(0))
+        self.assertEquals(bytearray([0xc7, 0x00]), encode_value(-0x100))
+        self.assertEquals(bytearray([0xd3, 0xf7, 0xff]), encode_value(-1 - 0x800))
+        self.assertEquals(bytearray('I\x7f\xff\xff\xff'), encode_value(0x7fffffff))
+        self.assertEquals(bytearray('L\x00\x00\x00\x00\x80\x00\x00\x00'), encode_value(0x80000000))
+        for value in [0, -0x10, 0x2f, 0x7ff, -0x800, 0x3ffff, -0x40000, 0x7fffffff, -0x80000000]:
+            self.assertEquals([value], decode_values(encode_value(value)))
+
+    def test_float(self):
+        self.assertEquals(bytearray([0x5b]), encode_value(0.0))
+        self.assertEquals(bytearray([0x5d, 0x80]), encode_value(-128.0))
+        self.assertEquals(bytearray([0x5e, 0x80, 0x00]), encode_value(-32768.0))
+        for value in [0.0, 1.0, -128.0, 127.0, 32767.0, 1.5, -2.25, 3.1415926, 1e300]:
+            self.assertEquals([value], decode_values(encode_value(value)))
+
+    def test_string(self):
+        self.assertEquals(bytearray('\x02\xe4\xb8\xad\xe6\x96\x87'), encode_value(u'中文'))
+        self.assertEquals(encode_value(u'中文'), encode_value('中文'))
+        # 超出BMP的字符使用代理对进行编码，长度为2
+        self.assertEquals(bytearray('\x02\xed\xa0\xbd\xed\xb0\xb6'), encode_value(u'\U0001f436'))
+        self.assertEquals(encode_value(u'\U0001f436'), encode_value('🐶'))
+        for value in ['', 'a' * 0x1f, 'a' * 0x20, '张' * 0x3ff, '张' * 0x400, 'hello 🐶']:
+            self.assertEquals([value], decode_values(encode_value(value)))
+
+    def test_string_chunks(self):
+        data = encode_value(u'x' + u'\U0001f436' * 40000)
+        # 第一个分块不能以高位代理字符结尾
+        self.assertEquals(bytearray('R\x7f\xff'), data[:3])
+        offset = 3 + 1 + 0x7ffe * 3
+        self.assertEquals(bytearray('S\xb8\x82'), data[offset:offset + 3])
+        self.assertEquals(offset + 3 + 0xb882 * 3, len(data))
+
+    def test_object(self):
+        location = Object('me.hourui.echo.bean.Location')
+        location['province'] = '江苏省'
+        location['city'] = '南京市'
+        self.assertEquals([[{'province': '江苏省', 'city': '南京市'}] * 2],
+                          decode_values(encode_value([location, location])))
+
+    def test_object_fields(self):
+        # 同一个类的不同对象的字段不一样时需要分别进行定义
+        user1 = Object('me.hourui.echo.bean.User', {'name': '张三'})
+        user2 = Object('me.hourui.echo.bean.User', {'name': '李四', 'age': 18})
+        self.assertEquals([[{'name': '张三'}, {'name': '李四', 'age': 18}, {'name': '张三'}]],
+                          decode_values(encode_value([user1, user2, user1])))
+
+    def test_defined_object(self):
+        item_class = Object.define('me.hourui.echo.bean.Item', ['id', 'name', 'price'])
+        item1 = item_class(1, 'apple', price=1.5)
+        item2 = item_class(id=2)
+        item2['name'] = 'banana'
+        self.assertEquals('banana', item2.name)
+        self.assertEquals(['id', 'name', 'price'], item2.keys())
+        with self.assertRaises(KeyError):
+            item2['weight'] = 1.0
+        with self.assertRaises(AttributeError):
+            item2.weight = 1.0
+
+        data = encode_value([item1, item2])
+        self.assertEquals(1, data.count(bytearray('me.hourui.echo.bean.Item')))
+        self.assertEquals([[{'id': 1, 'name': 'apple', 'price': 1.5}, {'id': 2, 'name': 'banana', 'price': None}]],
+                          decode_values(data))
+        self.assertEquals('Lme/hourui/echo/bean/Item;', Request(request_param('echo', []))._get_class_name(item1))
+
+        # 字段名必须可以作为属性名，并且不能覆盖DefinedObject的属性以及方法
+        for field_names in [['id', 'id'], ['this$0'], ['class'], ['keys'], ['get_path'], ['_path'], [1], ['__x', 'y']]:
+            with self.assertRaises(ValueError):
+                Object.define('me.hourui.echo.bean.Item', field_names)
+        item = Object.define('me.hourui.echo.bean.Item', ['_x', '__x__'])(1, 2)
+        self.assertEquals((1, 2), (item._x, item['__x__']))
+
+    def test_references(self):
+        location = Object('me.hourui.echo.bean.Location', {'city': '南京市'})
+        users = [Object('me.hourui.echo.bean.User', {'id': i, 'location': location}) for i in xrange(3)]
+        value = Object('me.hourui.echo.bean.Group', {'first': users, 'second': users})
+        self.assertTrue(len(encode_value(value, references=True)) < len(encode_value(value)))
+
+        result = decode_values(encode_value(value, references=True))[0]
+        self.assertEquals(decode_values(encode_value(value)), [result])
+        self.assertTrue(result['first'] is result['second'])
+        self.assertTrue(result['first'][0]['location'] is result['first'][2]['location'])
+
+        # 循环引用
+        node = Object('me.hourui.echo.bean.Node', {'name': 'node'})
+        node['next'] = node
+        result = decode_values(encode_value(node, references=True))[0]
+        self.assertTrue(result['next'] is result)
+
+    def test_numbers(self):
+        ints = [0, -0x10, 0x2f, 0x30, -0x11, 0x7ff, -0x800, 0x800, 0x3ffff, -0x40000, 0x40000,
+                0x7fffffff, -0x80000000] * 30
+        longs = ints + [0x80000000, -0x80000001, 0x7fffffffffffffff, -0x8000000000000000]
+        doubles = [0.0, 1.0, -0.0, 2.0, -128.0, 127.0, 128.0, -32768.0, 32768.0, 1.5, 0.001, -2.25,
+                   3.1415926, 1e300, -1e300, 2147483.647, 2147483.648, 1e-10] * 30
+        numpy = encoder.numpy
+        for values, _type in [(ints, '[int'), (longs, '[long'), (doubles, '[double'),
+                              (range(50), '[int'), ([0x7fffffff] * 100, '[int'), ([1 << 40] * 100, '[long')]:
+            # 逐个元素进行编码的结果
+            expected = bytearray()
+            Request._encode_str(expected, _type)
+            Request._encode_int(expected, len(values))
+            for value in values:
+                (Request._encode_float if _type == '[double' else Request._encode_int)(expected, value)
+            expected = bytearray([0x56]) + expected
+
+            arrays = [values]
+            if _type == '[int':
+                arrays.append(array('i', values))
+            elif _type == '[long':
+                arrays.append(array('l', values))
+            else:
+                arrays.append(array('d', values))
+            try:
+                for value in arrays:
+                    self.assertEquals(expected, encode_value(value))
+                    encoder.numpy = None
+                    self.assertEquals(expected, encode_value(value))
+                    encoder.numpy = numpy
+                if numpy is not None:
+                    dtype = {'[int': numpy.int32, '[long': numpy.int64, '[double': numpy.float64}[_type]
+                    self.assertEquals(expected, encode_value(numpy.array(values, dtype=dtype)))
+            finally:
+                encoder.numpy = numpy
+            self.assertEquals([values], decode_values(expected))
+
+        self.assertEquals(encode_value([1, 2, 3]), encode_value(array('b', [1, 2, 3])))
+        self.assertTrue('[long' in encode_value(array('I', [1, 2, 3])))
+        self.assertTrue('[double' in encode_value(array('f', [1.5])))
+
+        request = Request(request_param('echo', []))
+        self.assertEquals('[I', request._get_class_name([1, 2]))
+        self.assertEquals('[J', request._get_class_name([1, 1 << 40]))
+        self.assertEquals('[D', request._get_class_name(array('d', [1.5])))
+        # 混合了不同类型的元素的数字列表与tuple一样使用无类型的列表
+        for values in [[1, 2.0], [1, 'a', {}], [1.5, None], [1, 1L]]:
+            self.assertEquals(encode_value(tuple(values)), encode_value(values))
+            self.assertEquals([values], decode_values(encode_value(values)))
+        self.assertEquals('Ljava/util/List;', request._get_class_name([1, 2.0]))
+
+        # 参数类型与编码的列表一致
+        for values, class_name, _type in [([1L, 2L], '[J', '[long'), ([1, 2], '[I', '[int'),
+                                          ([1, 2L], 'Ljava/util/List;', None)]:
+            data = Request(request_param('echo', [values])).encode()
+            self.assertEquals([class_name, values], decode_values(data[16:])[4:6])
+            if _type is None:
+                self.assertTrue('\x7a\x91\x92' in data)
+            else:
+                self.assertTrue('\x72' + chr(len(_type)) + _type in data)
+
+    def test_collections(self):
+        self.assertEquals(bytearray('H\x91\x01aZ'), encode_value({1: 'a'}))
+        self.assertEquals([{'a': 1, 'b': ['中文', None]}], decode_values(encode_value({'a': 1, 'b': (u'中文', None)})))
+        self.assertEquals(bytearray([0x7a, 0x91, 0x01, 0x61]), encode_value((1, 'a')))
+        self.assertEquals([[1, 'a', 1.5] * 3], decode_values(encode_value((1, 'a', 1.5) * 3)))
+        data = encode_value({1, 2})
+        self.assertTrue('java.util.HashSet' in data)
+        self.assertEquals([1, 2], sorted(decode_values(data)[0]))
+        self.assertEquals([[{'id': 1}, {'id': 2}]], decode_values(encode_value([{'id': 1}, {'id': 2}])))
+
+        value = {'id': 1}
+        result = decode_values(encode_value(Object('me.hourui.echo.bean.Pair', {'a': value, 'b': value}),
+                                            references=True))[0]
+        self.assertTrue(result['a'] is result['b'])
+
+    def test_dates(self):
+        value = datetime(2018, 5, 20, 13, 14, 0)
+        millis = int(time.mktime(value.timetuple())) * 1000
+        self.assertEquals(bytearray([0x4b]) + struct.pack('!i', millis // 60000), encode_value(value))
+        value = datetime(2018, 5, 20, 13, 14, 15, 678000)
+        self.assertEquals(bytearray([0x4a]) + struct.pack('!q', millis + 15678), encode_value(value))
+        self.assertEquals([value.strftime('%Y-%m-%dT%H:%M:%S.%f+0800')], decode_values(encode_value(value)))
+        self.assertEquals([millis + 15678], decode_values(encode_value(value), dates='millis'))
+        self.assertEquals([value], decode_values(encode_value(value), dates='datetime'))
+        result = decode_values(encode_value(value), dates='utc')[0]
+        self.assertEquals('UTC', result.tzname())
+        self.assertEquals(encode_value(value), encode_value(result))
+        # 按分钟编码的日期
+        value = datetime(2018, 5, 20, 13, 14, 0)
+        self.assertEquals([millis], decode_values(encode_value(value), dates='millis'))
+        self.assertEquals([value], decode_values(encode_value(value), dates='datetime'))
+        self.assertEquals(encode_value(value), encode_value(decode_values(encode_value(value), dates='utc')[0]))
+        self.assertEquals([-1], decode_values(bytearray([0x4a]) + struct.pack('!q', -1), dates='millis'))
+        with self.assertRaises(ValueError):
+            Response(encode_value(value), dates='iso')
+        self.assertEquals(encode_value(datetime(2018, 5, 20)), encode_value(date(2018, 5, 20)))
+
+    def test_decimal(self):
+        data = encode_value(Decimal('3.14159265358979323846'))
+        self.assertTrue('java.math.BigDecimal' in data and '3.14159265358979323846' in data)
+        # 解码时BigDecimal被转换为float
+        self.assertEquals([3.141592653589793], decode_values(data))
+        request = Request(request_param('echo', []))
+        self.assertEquals('Ljava/math/BigDecimal;', request._get_class_name(Decimal('1.5')))
+        self.assertEquals('Ljava/util/Map;', request._get_class_name({}))
+        self.assertEquals('Ljava/util/Date;', request._get_class_name(datetime.now()))
+        self.assertEquals('J', request._get_class_name(1L << 63 - 1))
+
+    def test_converters(self):
+        price = Decimal('3.14159265358979323846')
+        color = Object('me.hourui.echo.bean.Color', {'name': 'RED'})
+        item = Object('me.hourui.echo.bean.Item', {'id': 1, 'price': price, 'color': color})
+        data = encode_value([item, item, Object('me.hourui.echo.bean.Item', {'id': 2, 'price': price, 'color': color})],
+                            references=True)
+        converters = {'java.math.BigDecimal': lambda value: Decimal(value['value'])}
+        result = decode_values(data, converters=converters)[0]
+        self.assertEquals(price, result[0]['price'])
+        self.assertTrue(result[0] is result[1])
+        # 只对指定了converters的响应生效
+        self.assertEquals(float(price), decode_values(data)[0][0]['price'])
+
+        # 转化方法在读取类定义时确定
+        res = Response(data, converters=converters)
+        res.read_next()
+        self.assertEquals({'me.hourui.echo.bean.Item': None, 'me.hourui.echo.bean.Color': None,
+                           'java.math.BigDecimal': converters['java.math.BigDecimal']},
+                          dict(zip(res.paths, res.converters)))
+
+        register_decoder('me.hourui.echo.bean.Color', lambda value: value['name'].lower())
+        try:
+            for options in [{}, {'defined_objects': True}, {'columns': True}, {'lazy': True}]:
+                result = materialize(decode_values(data, **options)[0])
+                self.assertEquals(['red', 'red', 'red'], [value['color'] for value in result])
+            # 被转化的类不会作为列
+            result = decode_values(encode_value([color, color]), columns=True)[0]
+            self.assertEquals(['red', 'red'], result)
+            result = decode_values(data, select=['[*].color'])[0]
+            self.assertEquals(['red', 'red', 'red'], [value['color'] for value in result])
+            # 覆盖默认的转化方式，以及取消转化
+            self.assertEquals('RED', decode_values(data, converters={'me.hourui.echo.bean.Color': lambda value:
+                                                                     value['name']})[0][0]['color'])
+        finally:
+            register_decoder('me.hourui.echo.bean.Color', None)
+        self.assertEquals({'name': 'RED'}, decode_values(data)[0][0]['color'])
+
+    def test_register_encoder(self):
+        class Name(unicode):
+            pass
+
+        self.assertEquals(encode_value(u'张三'), encode_value(Name(u'张三')))
+        with self.assertRaises(HessianTypeError):
+            encode_value(uuid.uuid4())
+
+        register_encoder(uuid.UUID, str, 'java.util.UUID')
+        value = uuid.uuid4()
+        self.assertEquals([str(value)], decode_values(encode_value(value)))
+        self.assertEquals('Ljava/util/UUID;', Request(request_param('echo', []))._get_class_name(value))
+
+    def test_binary(self):
+        self.assertEquals(bytearray('\x23abc'), encode_value(Binary('abc')))
+        self.assertEquals(bytearray('\x20'), encode_value(bytearray()))
+        self.assertEquals(bytearray('\x34\x10') + 'x' * 0x10, encode_value(bytearray('x' * 0x10)))
+        self.assertEquals(bytearray('B\x04\x00') + 'x' * 0x400, encode_value(memoryview('x' * 0x400)))
+        data = ''.join(chr(i % 256) for i in xrange(0x8000 * 2 + 5))
+        self.assertEquals(bytearray('A\x80\x00') + data[:0x8000] + 'A\x80\x00' + data[0x8000:0x10000] +
+                          '\x25' + data[0x10000:], encode_value(Binary(data)))
+        self.assertEquals(encode_value(Binary(data)), encode_value(buffer(data)))
+        self.assertEquals('[B', Request(request_param('echo', []))._get_class_name(Binary(data)))
+
+    def test_decode_binary(self):
+        for size in (0, 5, 0x10, 0x3ff, 0x400, 0x8000, 0x8000 * 2 + 5):
+            value = ''.join(chr(i % 251) for i in xrange(size))
+            data = encode_value([Binary(value), 'end'])
+            self.assertEquals([[bytearray(value), 'end']], decode_values(data))
+            result = decode_values(data, binary_views=True)[0]
+            self.assertTrue(isinstance(result[0], memoryview))
+            self.assertEquals(value, result[0].tobytes())
+            self.assertEquals([[bytearray(value), 'end']], materialize(decode_values(data, lazy=True)))
+            pairs = encode_value([{'a': Binary(value), 'b': Binary(value[::-1])}])
+            self.assertEquals([{'b': bytearray(value[::-1])}], decode_values(pairs, select=['[*].b'])[0])
+            res = Response(data)
+            res.skip_next()
+            self.assertEquals(0, res.length())
+            if size:
+                with self.assertRaises(HessianTypeError):
+                    decode_values(encode_value(Binary(value))[:-1])
+            # 少于0x10个字节的二进制数据与其它定长的值一样直接根据长度跳过
+            if size >= 0x10:
+                with self.assertRaises(HessianTypeError):
+                    Response(encode_value(Binary(value))[:-1]).skip_next()
+            # 流式解码时数据不完整的二进制数据在收到更多的数据之后重试
+            stream = ResponseStream(binary_views=True)
+            body = bytearray([0x91]) + data
+            values = []
+            for i in xrange(0, len(body), 1000):
+                stream.feed(body[i:i + 1000])
+                values.extend(stream.read_values())
+            stream.finish()
+            values.extend(stream.read_values())
+            self.assertEquals([bytearray(value), 'end'], values)
+
+        # 只有一块的二进制数据不会被复制
+        data = encode_value(Binary('x' * 0x1000))
+        result = Response(data, binary_views=True).read_next()
+        data[-1] = 'y'
+        self.assertEquals('x' * 0xfff + 'y', result.tobytes())
+        res = Response(encode_value(Binary('abc')))
+        self.assertEquals(bytearray('abc'), res.read_binary())
+        with self.assertRaises(HessianTypeError):
+            Response(encode_value('abc')).read_binary()
+
+    def test_encode_segments(self):
+        data = bytearray('x' * 200000)
+        request = Request(request_param('upload', ['image.png', Binary(data), 1]))
+        segments = request.encode_segments()
+        self.assertEquals(request.encode(), bytearray().join(bytearray(segment) for segment in segments))
+        # 二进制数据以引用的方式保存在分段中
+        self.assertTrue(len(segments) > 2)
+        self.assertEquals(sum(len(segment) for segment in segments), len(request.encode()))
+        data[0x8000] = 'y'
+        self.assertEquals('y', segments[3][0])
+
+        request = Request(request_param('upload', [Binary('small')]))
+        self.assertEquals([request.encode()], [bytearray(segment) for segment in request.encode_segments()])
+
+    def test_iterator(self):
+        self.assertEquals(bytearray('\x57\x91\x92Z'), encode_value(iter([1, 2])))
+        self.assertEquals([[0, 1, 2]], decode_values(encode_value(i for i in xrange(3))))
+        self.assertEquals('Ljava/util/List;', Request(request_param('echo', []))._get_class_name(iter([])))
+
+    def test_encode_segments_spill(self):
+        def records():
+            for i in xrange(5000):
+                yield Object('me.hourui.echo.bean.Record', {'id': i, 'name': 'record-name-{}'.format(i)})
+
+        expected = Request(request_param('export', [records(), Binary('x' * 100000)])).encode()
+        request = Request(request_param('export', [records(), Binary('x' * 100000)]))
+        chunk_size, encoder._STREAM_CHUNK_SIZE = encoder._STREAM_CHUNK_SIZE, 0x4000
+        try:
+            segments = request.encode_segments()
+            # 数据已经写入临时文件，通过一个迭代器逐块读取
+            self.assertEquals(1, len(segments))
+            chunks = list(segments[0])
+        finally:
+            encoder._STREAM_CHUNK_SIZE = chunk_size
+        self.assertTrue(len(chunks) > 1)
+        self.assertEquals(expected[16:], bytearray().join(chunks)[16:])
+        self.assertEquals(expected[12:16], bytearray().join(chunks)[12:16])
+
+    def test_signature(self):
+        signature = Signature('(long, java.util.List<String>, java.util.Map<String, Integer>, int[], Integer)')
+        self.assertEquals('JLjava/util/List;Ljava/util/Map;[ILjava/lang/Integer;', signature.parameter_types)
+        self.assertEquals(signature.parameter_types, Signature(['long', 'java.util.List<String>', 'java.util.Map',
+                                                                'int[]', 'java.lang.Integer']).parameter_types)
+        self.assertEquals('D[[Ljava/lang/String;', Signature('double, String[][]').parameter_types)
+        self.assertEquals('', Signature('()').parameter_types)
+
+        arguments = [1, ['a', 'b'], {'a': 1}, [1, 2], None]
+        data = Request(request_param('find', arguments), signature=signature).encode()
+        values = decode_values(data[16:])
+        self.assertEquals('JLjava/util/List;Ljava/util/Map;[ILjava/lang/Integer;', values[4])
+        self.assertEquals(arguments, values[5:10])
+
+        # 参数与声明的类型不一致
+        for arguments in [[1.5, [], {}, [], 1], [1 << 63, [], {}, [], 1], [None, [], {}, [], 1],
+                          [1, [], {}, [], 1 << 31], [1, [], {}, [], 1.0]]:
+            with self.assertRaises(HessianTypeError):
+                Request(request_param('find', arguments), signature=signature).encode()
+        with self.assertRaises(HessianTypeError):
+            Request(request_param('find', [1]), signature=signature).encode()
+
+        data = Request(request_param('find', [1, u'中', True]), signature=Signature('double, char, Boolean')).encode()
+        self.assertEquals(['DCLjava/lang/Boolean;', 1.0, '中', True], decode_values(data[16:])[4:8])
+        with self.assertRaises(HessianTypeError):
+            Signature('java.util.Map<String, Integer')
+
+    def test_signature_elements(self):
+        # 数组以及集合的元素根据声明的类型进行编码
+        signature = Signature('long[], java.util.List<Long>, int[], java.util.Map<String, Long>, Integer[]')
+        arguments = [[1, 2], [1, None], array('i', [3, 1 << 20]), {'a': 1}, [1, None]]
+        data = Request(request_param('find', arguments), signature=signature).encode()
+        self.assertEquals(arguments[:2] + [[3, 1 << 20]] + arguments[3:], decode_values(data[16:])[5:10])
+        self.assertTrue('\x72\x05[long\x91\x92' in data)
+        self.assertTrue('\x7a\xe1N' in data)
+        self.assertTrue('H\x01a\xe1Z' in data)
+        self.assertTrue('\x12[java.lang.Integer\x91N' in data)
+        data = Request(request_param('find', [[], [], [], {}, []]), signature=signature).encode()
+        self.assertEquals([[], [], [], {}, []], decode_values(data[16:])[5:10])
+
+        data = Request(request_param('find', [set(['a']), iter([u'b']), datetime(2018, 1, 1)]),
+                       signature=Signature('java.util.Set<String>, java.util.List<String>, java.util.Date')).encode()
+        self.assertEquals([['a'], ['b'], datetime(2018, 1, 1)], decode_values(data[16:], dates='datetime')[5:8])
+
+        # 元素以及参数与声明的类型不一致
+        for java_type, argument in [('java.util.List<String>', [1, 2]), ('java.util.Date', 'notadate'),
+                                    ('int[]', [1 << 40]), ('int[]', array('l', [1 << 40])), ('long[]', [1.5]),
+                                    ('java.util.List', {}), ('java.util.Map', []), ('double[]', 'abc'),
+                                    ('java.util.Map<String, Long>', {'a': 'b'}), ('String[]', ['a', 1]),
+                                    ('byte[]', [1])]:
+            with self.assertRaises(HessianTypeError):
+                Request(request_param('find', [argument]), signature=Signature(java_type)).encode()
+
+    def test_specialized(self):
+        item_class = Object.define('me.hourui.echo.bean.Item', ['id', 'name', 'extra'])
+
+        def arguments(i):
+            user = Object('me.hourui.echo.bean.User', {'id': 1 << (i * 3), 'name': u'张三', 'score': 1.5 * i,
+                                                        'vip': i % 2 == 0, 'tags': ['a', 'b'], 'extra': None})
+            items = [item_class(j * 1000, 'item-{}'.format(j), {'a': j}) for j in xrange(i)]
+            return [user, items, i, 'hello']
+
+        shapes = {}
+        for i in xrange(1, 20):
+            param = request_param('save', arguments(i))
+            expected = Request(param).encode()[16:]
+            self.assertEquals(expected, Request(param, shapes=shapes).encode()[16:])
+        self.assertTrue(shapes.values()[0].encode is not None)
+
+        # 参数的结构发生变化之后回退到通用的编码方式
+        for value in [arguments(3)[:3] + [u'hello'], arguments(3)[:2] + [3L, 'hello']]:
+            param = request_param('save', value)
+            self.assertEquals(Request(param).encode()[16:], Request(param, shapes=shapes).encode()[16:])
+        user = arguments(3)
+        user[0]['extra'] = 'extra'
+        param = request_param('save', user)
+        self.assertEquals(Request(param).encode()[16:], Request(param, shapes=shapes).encode()[16:])
+        self.assertTrue(shapes.values()[0].misses > 0)
+
+    def test_cache(self):
+        cache = RequestCache(max_size=2)
+        for arguments in [[1, 'a'], [1, 'a'], [1.0, 'a'], [True, 'a'], [1, 'a']]:
+            param = request_param('poll', arguments)
+            expected = Request(param).encode()
+            request = Request(param, cache=cache)
+            data = request.encode()
+            self.assertEquals(request.invoke_id, struct.unpack('!q', str(data[4:12]))[0])
+            self.assertEquals(expected[:4], data[:4])
+            self.assertEquals(expected[12:], data[12:])
+        self.assertEquals(1, cache.hits)
+        self.assertEquals(4, cache.misses)
+        self.assertEquals(2, len(cache))
+
+        # 可变的参数不会被缓存
+        Request(request_param('poll', [[1, 2], (1, 2)]), cache=cache).encode()
+        Request(request_param('poll', [Object('me.hourui.echo.bean.User')]), cache=cache).encode()
+        self.assertEquals(4, cache.misses)
+        param = request_param('poll', [(1, (u'a', None))])
+        self.assertEquals(Request(param).encode()[12:], Request(param, cache=cache).encode()[12:])
+        self.assertEquals(Request(param).encode()[12:], Request(param, cache=cache).encode()[12:])
+        self.assertEquals(2, cache.hits)
+
+
+class TestDecoder(unittest.TestCase):
+    def test_scalars(self):
+        values = [0, -0x10, 0x2f, 0x7ff, -0x800, 0x3ffff, -0x40000, 0x7fffffff, -0x80000000, 0.0, 1.0, -128.0,
+                  32767.0, 1.5, 1e300, True, False, None, '', 'hello', '中文' * 100]
+        data = bytearray()
+        for value in values:
+            data += encode_value(value)
+        self.assertEquals(values, decode_values(data))
+        # long的各种编码
+        self.assertEquals([-8, 0x7ff, -0x40000, 0x7fffffff, 1 << 40],
+                          decode_values(bytearray('\xd8\xff\xff\x38\x00\x00\x59\x7f\xff\xff\xff'
+                                                  'L\x00\x00\x01\x00\x00\x00\x00\x00')))
+        self.assertEquals([2.25, 127.0, -32768.0], decode_values(bytearray('\x5f\x00\x00\x08\xca\x5d\x7f\x5e\x80\x00')))
+        self.assertEquals(['hello'], decode_values('\x05hello'))
+
+    def test_containers(self):
+        self.assertEquals([[1, 'a'], {'a': [1.5]}], decode_values(encode_value((1, 'a')) + encode_value({'a': [1.5]})))
+        # 有类型的map
+        data = bytearray('M\x17java.util.LinkedHashMap\x01a\x91Z')
+        self.assertEquals([{'a': 1}], decode_values(data))
+        self.assertEquals([[1, 2]], decode_values(bytearray('\x55\x04[int\x91\x92Z')))
+        self.assertEquals([{'value': 1}], decode_values(encode_value(Object('a.B', {'value': 1}))))
+        self.assertEquals([1.25], decode_values(encode_value(Decimal('1.25'))))
+
+        item = Object('me.hourui.echo.bean.Item', {'id': 1})
+        data = encode_value(Object('me.hourui.echo.bean.Pair', {'first': item, 'second': item}), references=True)
+        result = decode_values(data)[0]
+        self.assertTrue(result['first'] is result['second'])
+
+        with self.assertRaises(HessianTypeError):
+            decode_values(bytearray('\x40'))
+
+    def test_strings(self):
+        strings = [u'', u'hello', u'中文' * 100, u'\U0001f436\U0001f431 dubbo', u'a' * 0x8000, u'中' * 0xffff,
+                   u'中文' * 0x8000 + u'end', u'\U0001f436' * 0x10000, u'a' * 0x10000 + u'\U0001f436' * 10]
+        data = bytearray()
+        for string in strings:
+            data += encode_value(string) + encode_value(0x10)  # 字符串之后紧跟着一个以后续字节的值开头的整型
+        values = decode_values(data, unicode_strings=True)
+        self.assertEquals(strings, values[0::2])
+        self.assertEquals([0x10] * len(strings), values[1::2])
+        self.assertTrue(all(isinstance(value, unicode) for value in values[0::2]))
+        values = decode_values(data)
+        self.assertEquals([string.encode('utf-8') for string in strings], values[0::2])
+        self.assertTrue(all(type(value) is str for value in values[0::2]))
+
+        # 类名和字段名以及异常信息中的字符串总是str
+        result = decode_values(encode_value(Object('a.B', {'name': u'名字'})), unicode_strings=True)[0]
+        self.assertEquals({u'name': u'名字'}, result)
+        self.assertTrue(type(result.keys()[0]) is str)
+
+        with self.assertRaises(HessianTypeError):
+            decode_values(bytearray('\x05hel'))
+
+    def test_lazy(self):
+        item = Object('me.hourui.echo.bean.Item', {'id': 1, 'price': Decimal('1.5'), 'tags': ('a', 'b')})
+        order = Object('me.hourui.echo.bean.Order', {
+            'items': [item, Object('me.hourui.echo.bean.Item', {'id': 2, 'price': Decimal('2'), 'tags': ()})],
+            'first': item,
+            'buyer': {'name': u'名字' * 0x8000, 'levels': [[1, 2], [3]]},
+            'created': datetime(2018, 1, 1, 12, 0),
+        })
+        data = encode_value((order, order, [item], Object('me.hourui.echo.bean.Item', {'id': 3})), references=True)
+        expected = decode_values(data)[0]
+
+        res = Response(data, lazy=True)
+        result = res.read_next()
+        self.assertEquals(0, res.length())
+        self.assertTrue(isinstance(result, LazyList))
+        self.assertEquals(4, len(result))
+        # 访问之前不会解码其中的值
+        lazy_values = [value for value, end in res.lazy_values.values() if isinstance(value, (LazyDict, LazyList))]
+        self.assertTrue(all(value._value is None for value in lazy_values))
+        order = result[0]
+        self.assertTrue(isinstance(order, LazyDict))
+        self.assertTrue(order is result[1])
+        self.assertTrue(order['first'] is order['items'][0])
+        self.assertEquals(1.5, order['first']['price'])
+        self.assertEquals(['a', 'b'], order['first']['tags'])
+        self.assertEquals([[1, 2], [3]], order['buyer']['levels'])
+        self.assertEquals(expected, result)
+
+        value = materialize(result)
+        self.assertTrue(type(value) is list and type(value[0]) is dict and type(value[0]['items']) is list)
+        self.assertTrue(value[0] is value[1])
+        self.assertEquals(expected, value)
+
+        self.assertEquals(expected, decode_values(data, lazy=True)[0])
+        self.assertEquals([1, 'a', None], decode_values(encode_value(1) + encode_value('a') + encode_value(None),
+                                                        lazy=True))
+
+    def test_select(self):
+        currency = Object('me.hourui.echo.bean.Currency', {'code': 'CNY'})
+        items = []
+        for i in xrange(3):
+            item = Object('me.hourui.echo.bean.Item', {'id': i, 'name': 'item-{}'.format(i), 'price': Decimal(i),
+                                                       'tags': ['a', 'b'], 'extra': {'k': [1.5]}})
+            # 第一个商品的currency在被跳过的字段中，之后的商品中的currency是对它的引用
+            item['origin' if i == 0 else 'currency'] = currency
+            items.append(item)
+        page = Object('me.hourui.echo.bean.Page', {'items': items, 'total': 3, 'owner': {'name': 'owner'}})
+        data = encode_value(page, references=True)
+        expected = decode_values(data)[0]
+
+        result = decode_values(data, select=['items[*].id', 'items[*].price', 'items[*].currency', 'total'])[0]
+        self.assertEquals({'total': 3, 'items': [
+            {'id': 0, 'price': 0},
+            {'id': 1, 'price': 1, 'currency': {'code': 'CNY'}},
+            {'id': 2, 'price': 2, 'currency': {'code': 'CNY'}},
+        ]}, result)
+        self.assertTrue(result['items'][1]['currency'] is result['items'][2]['currency'])
+
+        self.assertEquals({'items': expected['items']}, decode_values(data, select=['items', 'items[*].id'])[0])
+        self.assertEquals({'owner': {'name': 'owner'}, 'items': [{'extra': {'k': [1.5]}}] * 3},
+                          decode_values(data, select=['owner.name', 'items.extra'])[0])
+        self.assertEquals([{'id': 1}], decode_values(encode_value(items[1:2]), select=['[*].id'])[0])
+        with self.assertRaises(ValueError):
+            Response(data, select=['items[0].id'])
+
+        # 之后的值使用了被跳过的值中的类定义以及引用
+        request = Request(request_param('echo', []), references=True)
+        data = bytearray()
+        request._encode_single_value(data, page)
+        request._encode_single_value(data, [currency, Object('me.hourui.echo.bean.Currency', {'code': 'USD'})])
+        res = Response(data)
+        res.skip_next()
+        self.assertEquals([{'code': 'CNY'}, {'code': 'USD'}], res.read_next())
+        self.assertEquals(0, res.length())
+
+    def test_defined_objects(self):
+        item = Object('me.hourui.echo.bean.Item', {'id': 1, 'name': 'apple', 'price': Decimal('1.5')})
+        data = encode_value(Object('me.hourui.echo.bean.Pair', {'first': item, 'second': item}), references=True)
+        result = decode_values(data, defined_objects=True)[0]
+        self.assertTrue(isinstance(result, DefinedObject))
+        self.assertEquals('me.hourui.echo.bean.Pair', result.get_path())
+        self.assertTrue(result.first is result.second)
+        self.assertEquals((1, 'apple', 1.5), (result.first.id, result.first['name'], result.first.price))
+        self.assertFalse(hasattr(result.first, '__dict__'))
+        # 同一个类在不同的响应之间共享
+        self.assertTrue(type(decode_values(data, defined_objects=True)[0].first) is type(result.first))
+        # 解码得到的对象可以直接作为参数
+        self.assertEquals(encode_value(result.first), encode_value(decode_values(encode_value(result.first),
+                                                                                  defined_objects=True)[0]))
+
+        # 字段名不能作为__slots__中的名字的类仍然被解码为dict
+        data = encode_value(Object('me.hourui.echo.bean.Inner', {'this$0': 1, 'keys': 2}))
+        self.assertEquals({'this$0': 1, 'keys': 2}, decode_values(data, defined_objects=True)[0])
+        data = encode_value(Object('me.hourui.echo.bean.Inner', {'__x': 1, 'y': 2}))
+        self.assertEquals({'__x': 1, 'y': 2}, decode_values(data, defined_objects=True)[0])
+
+    def test_intern_strings(self):
+        statuses = [u'PAID', u'SHIPPED', u'中文状态'] * 10 + [u'x' * 100]
+        data = encode_value([Object('me.hourui.echo.bean.Order', {'status': status}) for status in statuses])
+        for unicode_strings in (False, True):
+            cache = decoder.unicode_cache if unicode_strings else decoder.string_cache
+            hits = cache.hits
+            result = decode_values(data, intern_strings=True, unicode_strings=unicode_strings)[0]
+            expected = statuses if unicode_strings else [status.encode('utf-8') for status in statuses]
+            self.assertEquals([{'status': status} for status in expected], result)
+            self.assertTrue(all(type(order['status']) is (unicode if unicode_strings else str) for order in result))
+            self.assertTrue(result[0]['status'] is result[3]['status'])
+            self.assertTrue(result[2]['status'] is result[29]['status'])
+            self.assertTrue(cache.hits - hits >= 27)
+            # 较长的字符串不会被缓存
+            self.assertFalse(result[-1]['status'] is decode_values(data, intern_strings=True)[0][-1]['status'])
+
+        # 字段名总是共用同一个对象，但是没有开启intern_strings时不计入string_cache的统计
+        stats = decoder.string_cache.stats()
+        first = decode_values(data)[0][0].keys()[0]
+        self.assertTrue(first is decode_values(data)[0][0].keys()[0])
+        self.assertEquals(stats, decoder.string_cache.stats())
+        self.assertTrue(0 < stats['hit_rate'] < 1)
+        self.assertEquals(len(decoder.string_cache), stats['size'])
+
+        # 分块的字符串的最后一块较短时仍然需要拼接所有的块
+        data = bytearray('R\x80\x00') + 'a' * 0x8000 + '\x05bcdef'
+        for unicode_strings in (False, True):
+            result = decode_values(data, intern_strings=True, unicode_strings=unicode_strings)
+            self.assertEquals(['a' * 0x8000 + 'bcdef'], result)
+
+        cache = decoder.StringCache(max_size=4)
+        for key in 'abcdef':
+            cache.put(key, key)
+        self.assertTrue(len(cache) <= 4)
+        self.assertEquals('f', cache.get('f'))
+
+    def test_columns(self):
+        item_class = Object.define('me.hourui.echo.bean.Item', ['id', 'name', 'price', 'enabled'])
+        items = [item_class(i, 'item-{}'.format(i), i * 0.5, i % 2 == 0) for i in xrange(50)]
+        numpy = decoder.numpy
+        try:
+            for use_numpy in (False, True):
+                decoder.numpy = numpy if use_numpy else None
+                for value in (items, iter(items)):
+                    columns = decode_values(encode_value(value), columns=True)[0]
+                    self.assertEquals(['enabled', 'id', 'name', 'price'], sorted(columns))
+                    self.assertEquals(range(50), list(columns['id']))
+                    self.assertEquals([i * 0.5 for i in xrange(50)], list(columns['price']))
+                    self.assertEquals(['item-{}'.format(i) for i in xrange(50)], columns['name'])
+                    self.assertEquals([i % 2 == 0 for i in xrange(50)], columns['enabled'])
+                    if use_numpy and numpy is not None:
+                        self.assertTrue(isinstance(columns['id'], numpy.ndarray))
+                    else:
+                        self.assertEquals(array('l', range(50)), columns['id'])
+                        self.assertEquals('d', columns['price'].typecode)
+        finally:
+            decoder.numpy = numpy
+
+        # 不符合列的类型的值使列转化为list
+        values = [Object('me.hourui.echo.bean.Item', {'id': i}) for i in (1, None, 2.5)]
+        self.assertEquals({'id': [1, None, 2.5]}, decode_values(encode_value(values), columns=True)[0])
+        # 列表中的对象被引用时解码为dict
+        data = encode_value(([items[0], items[1]], items[1]), references=True)
+        columns, item = decode_values(data, columns=True)[0]
+        self.assertEquals([0, 1], list(columns['id']))
+        self.assertEquals({'id': 1, 'name': 'item-1', 'price': 0.5, 'enabled': False}, item)
+
+        # 元素不全是同一个类的对象时仍然解码为list
+        other = Object('me.hourui.echo.bean.Other', {'id': 3})
+        data = encode_value(((items[0], items[1], other, items[2], 1), items[1]), references=True)
+        rows, item = decode_values(data, columns=True)[0]
+        self.assertEquals([0, 1, 3, 2], [row['id'] for row in rows[:4]])
+        self.assertEquals(1, rows[-1])
+        self.assertTrue(rows[1] is item)
+        self.assertEquals([1.5], decode_values(encode_value([Decimal('1.5')]), columns=True)[0])
+
+    def test_typed_arrays(self):
+        payloads = [
+            range(-16, 48),  # 一个字节
+            range(-2048, 2048, 7),
+            range(1 << 20, (1 << 20) + 100),  # 定长的I
+            [(-1 << 40) + i for i in xrange(40)],  # 定长的L
+            [1, 1 << 20, -1 << 40, 0],
+            [0.0, 1.0, 2.5, -128.0, 30000.0, 0.001, 1e300],
+            [0.0] * 40 + [float(i) for i in xrange(-100, 100)] + [i * 0.25 for i in xrange(-40, 40)],
+            [(i + 1) * 3.14159265 for i in xrange(100)],  # 定长的D
+        ]
+        numpy = decoder.numpy
+        try:
+            for use_numpy in (False, True):
+                decoder.numpy = numpy if use_numpy else None
+                for values in payloads:
+                    data = encode_value(values)
+                    self.assertEquals([values], decode_values(data))
+                    result = decode_values(data, typed_arrays=True)[0]
+                    self.assertEquals(values, list(result))
+                    if isinstance(values[0], float):
+                        typecode = 'd'
+                    else:
+                        typecode = 'l' if max(values) > 0x7fffffff or min(values) < -0x80000000 else 'i'
+                    if use_numpy and numpy is not None:
+                        self.assertEquals(numpy.dtype(typecode), result.dtype)
+                    else:
+                        self.assertEquals(typecode, result.typecode)
+        finally:
+            decoder.numpy = numpy
+        # 由Java编码的long[]：使用long的编码，以及可变长度的数组
+        data = bytearray([0x72, 0x05]) + '[long' + bytearray([0xe1, 0xf8, 0x10])
+        self.assertEquals([1, 16], list(decode_values(data, typed_arrays=True)[0]))
+        data = bytearray([0x56, 0x05]) + '[long' + bytearray([0xc8, 120]) + bytearray([0xe1]) * 40 + \
+            bytearray([0xf7, 0x00]) * 40 + bytearray([0x3b, 0x00, 0x01]) * 40
+        expected = [1] * 40 + [-256] * 40 + [-65535] * 40
+        self.assertEquals(expected, list(decode_values(data, typed_arrays=True)[0]))
+        data = bytearray([0x55, 0x04]) + '[int' + bytearray([0x91, 0xc8, 0x10, 0x5a])
+        self.assertEquals([1, 16], list(decode_values(data, typed_arrays=True)[0]))
+        # 其它的列表不受影响
+        self.assertEquals([['a', 'b']], decode_values(encode_value(['a', 'b']), typed_arrays=True))
+
+    def test_stream(self):
+        def stream_values(body, chunk_size, **kwargs):
+            stream = ResponseStream(**kwargs)
+            values = []
+            for i in xrange(0, len(body), chunk_size):
+                stream.feed(body[i:i + chunk_size])
+                values.extend(stream.read_values())
+            stream.finish()
+            values.extend(stream.read_values())
+            self.assertTrue(stream.done)
+            return values
+
+        status = Object('me.hourui.echo.bean.Status', {'name': 'PAID'})
+        orders = [Object('me.hourui.echo.bean.Order', {'id': i, 'name': u'订单-{}'.format(i) * (i % 7),
+                                                       'status': Object('me.hourui.echo.bean.Status', {'name': 'PAID'}),
+                                                       'items': range(i % 5)}) for i in xrange(200)]
+        # 同一个元素中的引用可以被解析
+        orders[0]['previous'] = orders[0]['status']
+        expected = Response(encode_value(orders, references=True)).read_next()
+        for value in (orders, iter(orders)):
+            body = bytearray([0x91]) + encode_value(value, references=True)
+            for chunk_size in (1, 7, 1000, len(body)):
+                self.assertEquals(expected, stream_values(body, chunk_size))
+        # 元素的数据完整之后即可被取出
+        stream = ResponseStream()
+        body = bytearray([0x91]) + encode_value(orders)
+        stream.feed(body[:len(body) / 2])
+        self.assertTrue(0 < len(stream.read_values()) < len(orders))
+
+        body = bytearray([0x91]) + encode_value(orders)
+        values = stream_values(body, 100, select=['[*].id'], unicode_strings=True)
+        self.assertEquals([{'id': i} for i in xrange(200)], values)
+        self.assertEquals([{'id': 1}], stream_values(bytearray([0x91]) + encode_value({'id': 1}), 1))
+        self.assertEquals([], stream_values(bytearray([0x92]), 1))
+
+        # 对已经取出的元素以及其中的值的引用无法被解析
+        order = Object('me.hourui.echo.bean.Order', {'id': 1})
+        body = bytearray([0x91]) + encode_value([order, order], references=True)
+        self.assertRaises(HessianTypeError, stream_values, body, 1)
+        body = bytearray([0x91]) + encode_value([{'status': status}, {'status': status}], references=True)
+        self.assertRaises(HessianTypeError, stream_values, body, 1)
+
+        # 已经取出的元素中的map/list/对象不再被保留
+        rows = ({'id': i, 'extra': {'name': 'row'}, 'tags': ['a', 'b']} for i in xrange(5000))
+        body = bytearray([0x91]) + encode_value(rows)
+        stream = ResponseStream()
+        for i in xrange(0, len(body), 0x4000):
+            stream.feed(body[i:i + 0x4000])
+            stream.read_values()
+            live = [value for value in stream.response.objects if value is not decoder._RELEASED]
+            self.assertTrue(len(live) <= 1)
+        stream.finish()
+        stream.read_values()
+        self.assertTrue(stream.done)
+
+        error = Object('java.lang.RuntimeException', {'detailMessage': 'boom', 'stackTrace': []})
+        stream = ResponseStream()
+        stream.feed(bytearray([0x90]) + encode_value(error))
+        self.assertEquals([], stream.read_values())
+        self.assertFalse(stream.done)
+        stream.finish()
+        stream.read_values()
+        self.assertEquals('boom', stream.error_response.read_error()['detailMessage'])
+
+        stream = ResponseStream()
+        stream.feed(body[:-1])
+        stream.finish()
+        self.assertRaises(HessianTypeError, stream.read_values)
+
+    def test_decode_mapped(self):
+        status = Object('me.hourui.echo.bean.Status', {'name': 'PAID'})
+        orders = [Object('me.hourui.echo.bean.Order', {'id': i, 'remark': u'备注-{}'.format(i) * (i % 7),
+                                                       'status': status}) for i in xrange(300)]
+        page = Object('me.hourui.echo.bean.Page', {'items': orders, 'total': 300})
+        # 对已经解码的元素以及列表本身的引用仍然可以被解析
+        cyclic = [[1, 2]]
+        cyclic.append(cyclic)
+        cyclic.append(cyclic[0])
+        for value in (orders, iter(orders), page, cyclic, range(100)):
+            data = bytearray([0x91]) + encode_value(value, references=True)
+            expected = Response(data[1:]).read_next()
+            for chunk_size in (1, 100, 1 << 20):
+                stream = decode_mapped(str(data), chunk_size)
+                self.assertTrue(stream.done)
+                if value is cyclic:
+                    result = stream.value
+                    self.assertTrue(result[1] is result and result[2] is result[0])
+                    self.assertEquals([1, 2], result[0])
+                else:
+                    self.assertEquals(expected, stream.value)
+
+        # 从临时文件的mmap中解码
+        data = bytearray([0x91]) + encode_value(orders)
+        with tempfile.TemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            mapped = mmap.mmap(f.fileno(), len(data), access=mmap.ACCESS_READ)
+        self.assertEquals(Response(data[1:]).read_next(), decode_mapped(mapped, 256).value)
+        mapped.close()
+
+        data = bytearray([0x91]) + encode_value([i * 0.5 for i in xrange(100)])
+        self.assertEquals(array('d', [i * 0.5 for i in xrange(100)]),
+                          array('d', decode_mapped(str(data), 16, typed_arrays=True).value))
+        self.assertEquals(None, decode_mapped(str(bytearray([0x92])), 16).value)
+        error = Object('java.lang.RuntimeException', {'detailMessage': 'boom', 'stackTrace': []})
+        stream = decode_mapped(str(bytearray([0x90]) + encode_value(error)), 16)
+        self.assertEquals('boom', stream.error_response.read_error()['detailMessage'])
+        with self.assertRaises(HessianTypeError):
+            decode_mapped(str(data[:-1]), 16)
+
+    def test_read_error(self):
+        trace = Object('java.lang.StackTraceElement', {'declaringClass': 'me.hourui.Echo', 'methodName': 'echo',
+                                                       'fileName': 'Echo.java', 'lineNumber': 10})
+        error = Object('java.lang.RuntimeException', {'detailMessage': 'boom', 'stackTrace': [trace]})
+        res = Response(bytearray([0x90]) + encode_value(error), unicode_strings=True, defined_objects=True)
+        self.assertEquals(0, res.read_int())
+        error = res.read_error()
+        self.assertEquals('java.lang.RuntimeException', error['cause'])
+        self.assertTrue(type(error['detailMessage']) is str)
+        self.assertEquals('boom', error['detailMessage'])
+        self.assertEquals('echo', error['stackTrace'][0]['methodName'])
+
+        res = Response(bytearray('\x05hello'))
+        with self.assertRaises(HessianTypeError):
+            res.read_int()
+        self.assertEquals('hello', res.read_string())
+
+
+if __name__ == '__main__':
+    unittest.main()
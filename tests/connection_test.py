@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import mmap
+import select
+import socket
+import threading
+import time
+import unittest
+
+from dubbo.codec.decoder import ResponseStream
+from dubbo.codec.encoder import Object
+from dubbo.common.constants import STREAM_BUFFER_SIZE
+from dubbo.common.exceptions import DubboResponseException, DubboRequestTimeoutException
+from dubbo.connection.connections import connection_pool, _ResponseStream, Connection
+from tests.codec_test import encode_value
+
+
+class _FakeConnection(object):
+    """
+    只用于触发回调的连接，读取线程可以对其进行select，但是永远不会有数据可读
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.read_length = 0x100
+        self.paused = False
+        self.last_active = time.time()
+        self.__sock, self.__peer = socket.socketpair()
+
+    def remote_host(self):
+        return self.host
+
+    def fileno(self):
+        return self.__sock.fileno()
+
+    def close(self):
+        self.__sock.close()
+        self.__peer.close()
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.host = '127.0.0.1:20880'
+        self.conn = _FakeConnection(self.host)
+        connection_pool._connection_pool[self.host] = self.conn
+
+    def tearDown(self):
+        # 全局的连接池中不能残留伪造的连接以及流式响应
+        if connection_pool._connection_pool.get(self.host) is self.conn:
+            del connection_pool._connection_pool[self.host]
+        for invoke_id in (1, 2):
+            connection_pool.streams.pop(invoke_id, None)
+        self.conn.close()
+
+    def test_stream_disconnected(self):
+        host, conn = self.host, self.conn
+        stream = _ResponseStream(connection_pool, host, ResponseStream())
+        connection_pool.streams[1] = stream
+        other = _ResponseStream(connection_pool, '127.0.0.1:20881', ResponseStream())
+        connection_pool.streams[2] = other
+
+        errors = []
+
+        def read():
+            try:
+                list(connection_pool._read_stream(host, 1, stream, None))
+            except DubboResponseException as e:
+                errors.append(e)
+
+        reading_thread = threading.Thread(target=read)
+        reading_thread.setDaemon(True)
+        reading_thread.start()
+        # 响应体的一部分数据到达之后连接被远程关闭
+        connection_pool._callback(bytearray('\x91\x7a\x90'), conn, 4, 1)
+        connection_pool._callback(bytearray(), conn, None, None)
+        reading_thread.join(5)
+
+        self.assertFalse(reading_thread.is_alive())
+        self.assertEquals(1, len(errors))
+        self.assertTrue('Connection closed' in str(errors[0]))
+        self.assertFalse(host in connection_pool._connection_pool)
+        self.assertFalse(1 in connection_pool.streams)
+        # 其它连接上的响应不受影响
+        self.assertTrue(connection_pool.streams.pop(2) is other)
+        self.assertTrue(other.error is None)
+
+    def start_paused_stream(self):
+        """
+        开始迭代一个流式响应，之后收到的数据超过STREAM_BUFFER_SIZE使连接被暂停读取
+        """
+        stream = _ResponseStream(connection_pool, self.host, ResponseStream())
+        connection_pool.streams[1] = stream
+        values = connection_pool._read_stream(self.host, 1, stream, None)
+        connection_pool._callback(bytearray('\x91\x7a\x90'), self.conn, 4, 1)
+        self.assertEquals(0, next(values))
+        connection_pool._callback(bytearray(STREAM_BUFFER_SIZE + 1), self.conn, 4, 1)
+        self.assertTrue(self.conn.paused)
+        return stream, values
+
+    def test_stream_abandoned(self):
+        # 调用方不再迭代时恢复读取连接
+        stream, values = self.start_paused_stream()
+        values.close()
+        self.assertFalse(self.conn.paused)
+        self.assertFalse(1 in connection_pool.streams)
+
+        stream, values = self.start_paused_stream()
+        del values
+        self.assertFalse(self.conn.paused)
+        self.assertFalse(1 in connection_pool.streams)
+
+    def test_stream_pause_timeout(self):
+        # 调用方持有generator却长时间不取走数据时放弃此响应
+        stream, values = self.start_paused_stream()
+        connection_pool._expire_streams()
+        self.assertTrue(self.conn.paused)
+        stream.paused_since -= connection_pool.stream_pause_timeout + 1
+        connection_pool._expire_streams()
+        self.assertFalse(self.conn.paused)
+        self.assertFalse(1 in connection_pool.streams)
+        self.assertRaises(DubboRequestTimeoutException, next, values)
+        # 之后收到的剩余的数据被直接丢弃
+        connection_pool._callback(bytearray(STREAM_BUFFER_SIZE + 1), self.conn, 4, 1)
+        self.assertFalse(self.conn.paused)
+
+
+class TestConnection(unittest.TestCase):
+    def read_body(self, body, spill_size):
+        """
+        通过本地的连接收到一个正常的响应体
+        :return: 回调收到的响应体
+        """
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        conn = Connection('127.0.0.1', server.getsockname()[1], spill_size)
+        peer = server.accept()[0]
+        received = []
+
+        def callback(data, _conn, data_type, invoke_id):
+            received.append(data)
+            return 0, 0, None
+
+        try:
+            conn.read_length, conn.read_type = len(body), 3
+            peer.sendall(body)
+            while not received:
+                select.select([conn], [], [], 1)
+                conn.read(callback)
+        finally:
+            conn.close()
+            peer.close()
+            server.close()
+        return received[0]
+
+    def test_spill(self):
+        rows = [Object('me.hourui.echo.bean.Order', {'id': i, 'remark': 'x' * 100}) for i in xrange(2000)]
+        body = bytearray([0x91]) + encode_value(rows)
+        data = self.read_body(body, 0x1000)
+        self.assertTrue(isinstance(data, mmap.mmap))
+        self.assertEquals(str(body), data[:])
+        data.close()
+
+        # 值不是列表的响应体不写入临时文件
+        for value in (Object('me.hourui.echo.bean.Page', {'items': rows}), 'x' * 0x10000):
+            body = bytearray([0x91]) + encode_value(value)
+            self.assertEquals(body, self.read_body(body, 0x1000))
+        body = bytearray([0x91]) + encode_value(rows)
+        self.assertEquals(body, self.read_body(body, 0))
+        self.assertEquals(bytearray([0x92]), self.read_body(bytearray([0x92]), 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -127,6 +127,12 @@ class TestDubbo(unittest.TestCase):
         self.assertEquals(-1000, dubbo.call('echo7', -1000))
         self.assertEquals(-100000, dubbo.call('echo7', -100000))
 
+        # 拼写错误的选项在发送请求之前就抛出异常
+        with self.assertRaises(TypeError):
+            dubbo.call('echo1', 'hello', unicode_string=True)
+        with self.assertRaises(TypeError):
+            dubbo.call_stream('echo1', 'hello', selects=['id'])
+
     # @unittest.skip('skip performance test')
     def test_multi_threading(self):
         for i in xrange(10):
@@ -6,3 +6,4 @@ echo -e "\033[33m${PWD}\033[0m"
 
 python -m unittest tests.dubbo_test
 python -m unittest tests.run_test
+python -m unittest tests.codec_test